@@ -0,0 +1,19 @@
+from database import SessionLocal, engine
+from modules.stock.models import StockCheckpoint
+from modules.stock.checkpoint_utils import build_month_end_checkpoints
+
+def build():
+    StockCheckpoint.__table__.create(bind=engine, checkfirst=True)
+    db = SessionLocal()
+    try:
+        print("Building month-end stock checkpoints...")
+        result = build_month_end_checkpoints(db)
+        print(f"Checked {result['periods']} periods, wrote {result['checkpoints']} checkpoints.")
+    except Exception as e:
+        print(f"Error: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,80 @@
+"""
+Streaming Export
+Streams query results as NDJSON or CSV with a server-side cursor, so memory
+stays flat no matter how many rows are exported.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Rows fetched from the server-side cursor and written per response chunk
+EXPORT_BATCH_SIZE = 2000
+
+
+def _plain(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _ndjson_chunks(result, keys):
+    for partition in result.partitions():
+        yield "".join(
+            json.dumps(dict(zip(keys, map(_plain, row))), separators=(",", ":")) + "\n"
+            for row in partition
+        )
+
+
+def _csv_chunks(result, keys):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(keys)
+    for partition in result.partitions():
+        writer.writerows([_plain(value) for value in row] for row in partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Header only when there were no rows
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_export(statement, export_format: str, filename: str) -> StreamingResponse:
+    """
+    Stream a Core select as NDJSON or CSV.
+    Runs in its own session because the response body is produced after the
+    request's dependencies may already have closed theirs.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {', '.join(EXPORT_FORMATS)}")
+
+    def generate():
+        from database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            result = db.execute(
+                statement.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+            )
+            keys = list(result.keys())
+            chunks = _ndjson_chunks(result, keys) if export_format == "ndjson" else _csv_chunks(result, keys)
+            for chunk in chunks:
+                yield chunk
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        generate(),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
@@ -2,6 +2,7 @@
 Document Numbering System
 Auto-generates document numbers with naming series support
 """
+import threading
 from typing import Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import func
@@ -21,8 +22,19 @@ NAMING_SERIES = {
     "Material Request": "MAT-.YYYY.-",
     "Quotation": "QUO-.YYYY.-",
     "Work Order": "WO-.YYYY.-",
+    "Period Closing Voucher": "PCV-.YYYY.-",
 }
 
+# Sequences are five digits and wrap around after this
+SEQUENCE_LIMIT = 100000
+
+# Last sequence handed out per prefix and day, so numbers taken in quick
+# succession by this process never repeat. Numbers are only unique within
+# one process: another worker can hand out the same sequence, which the
+# unique name columns then reject.
+_last_sequences = {}
+_sequence_lock = threading.Lock()
+
 
 def get_fiscal_year(date: Optional[datetime] = None) -> str:
     """Get fiscal year from date (defaults to current year)"""
@@ -65,7 +77,8 @@ def get_next_number(
         date: Optional date for fiscal year (uses current date if not provided)
     
     Returns:
-        Next document number (e.g., "SAL-ORD-2024-00001")
+        Next document number (e.g., "SAL-ORD-2024-20240115-00001"), unique
+        within this process
     """
     if series is None:
         series = NAMING_SERIES.get(doctype, f"{doctype.upper()}-.YYYY.-")
@@ -101,7 +114,14 @@ def get_next_number(
         timestamp = datetime.now().strftime("%Y%m%d")
     
     # Add a sequence number (simplified - in production use proper sequence)
-    sequence = int(time.time() * 1000) % 100000  # Use last 5 digits of timestamp
+    sequence = int(time.time() * 1000) % SEQUENCE_LIMIT  # Use last 5 digits of timestamp
+    with _sequence_lock:
+        last = _last_sequences.get((prefix, timestamp))
+        if last is not None and sequence <= last:
+            # Counting up from the last number wraps to 00000 rather than
+            # growing a sixth digit
+            sequence = (last + 1) % SEQUENCE_LIMIT
+        _last_sequences[(prefix, timestamp)] = sequence
     
     # Format: PREFIX-YYYYMMDD-00001
     number_str = f"{prefix}-{timestamp}-{sequence:05d}"
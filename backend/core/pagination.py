@@ -0,0 +1,99 @@
+"""
+Keyset (Cursor) Pagination
+Shared by every list endpoint. Pages are read with a WHERE on the sort key
+instead of OFFSET, so deep pages cost the same as the first one.
+
+The next page token is returned in the X-Next-Cursor response header and
+passed back as the `cursor` query parameter. skip/limit keep working when no
+cursor is given.
+"""
+import base64
+import json
+from datetime import date, datetime
+from typing import Optional, Sequence
+from fastapi import HTTPException, Response
+from sqlalchemy import Date, DateTime, and_, or_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Opaque token for the sort key of the last row on a page"""
+    payload = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_columns: Sequence) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(sort_columns):
+            raise ValueError("cursor does not match the sort key")
+
+        decoded = []
+        for column, value in zip(sort_columns, values):
+            if value is not None and isinstance(column.type, DateTime):
+                value = datetime.fromisoformat(value)
+            elif value is not None and isinstance(column.type, Date):
+                value = date.fromisoformat(value)
+            decoded.append(value)
+        return decoded
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after(sort_columns: Sequence, values: Sequence, descending: bool):
+    """
+    Rows after the cursor position. Nullable columns sort last in either
+    direction, matching the ORDER BY built in paginate().
+    """
+    column, value = sort_columns[0], values[0]
+    beyond = column < value if descending else column > value
+
+    if len(sort_columns) == 1:
+        return beyond
+
+    rest = _after(sort_columns[1:], values[1:], descending)
+    if value is None:
+        return and_(column.is_(None), rest)
+    if column.nullable:
+        return or_(beyond, column.is_(None), and_(column == value, rest))
+    return or_(beyond, and_(column == value, rest))
+
+
+def paginate(
+    query,
+    response: Response,
+    sort_columns: Sequence,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    descending: bool = False
+) -> list:
+    """
+    Read one page of a query ordered by sort_columns, whose last column must
+    be unique (normally the primary key id).
+    With a cursor the page starts right after it and skip is ignored.
+    One extra row is read to tell whether a next page exists; if it does,
+    its cursor is set in the X-Next-Cursor header.
+    """
+    order_by = []
+    for column in sort_columns:
+        ordered = column.desc() if descending else column.asc()
+        if column.nullable and column is not sort_columns[-1]:
+            ordered = ordered.nulls_last()
+        order_by.append(ordered)
+    query = query.order_by(*order_by)
+
+    if cursor:
+        query = query.filter(_after(sort_columns, decode_cursor(cursor, sort_columns), descending))
+    elif skip:
+        query = query.offset(skip)
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([getattr(last, column.key) for column in sort_columns])
+
+    return rows
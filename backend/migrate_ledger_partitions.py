@@ -0,0 +1,116 @@
+"""
+Ledger table migration
+
+PostgreSQL: converts stock_ledger_entries and gl_entries into tables
+range-partitioned by posting_date (one partition per year plus a default
+partition) and creates the composite indexes declared on the models as
+partitioned indexes. Running it again only adds partitions for upcoming
+years and any missing indexes.
+
+SQLite (and other databases): no partitioning, only the missing composite
+indexes are created.
+
+Usage: python migrate_ledger_partitions.py [--years-ahead N]
+"""
+import argparse
+from datetime import date
+from sqlalchemy import text
+from database import engine
+from modules.stock.models import StockLedgerEntry
+from modules.accounts.models import GLEntry
+
+LEDGER_TABLES = (StockLedgerEntry.__table__, GLEntry.__table__)
+
+
+def is_partitioned(conn, table_name: str) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {"name": table_name}).first() is not None
+
+
+def ensure_year_partitions(conn, table_name: str, first_year: int, last_year: int):
+    """Create yearly partitions (and the default partition) that do not exist yet"""
+    for year in range(first_year, last_year + 1):
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {table_name}_y{year} PARTITION OF {table_name} "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        ))
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT"))
+
+
+def partition_table(conn, table, years_ahead: int):
+    """Rebuild one ledger table as a posting_date range-partitioned table, keeping its rows"""
+    name = table.name
+    old = f"{name}_unpartitioned"
+
+    if conn.execute(text(f"SELECT 1 FROM {name} WHERE posting_date IS NULL LIMIT 1")).first():
+        raise RuntimeError(f"{name} has rows without posting_date, fix them before partitioning")
+
+    years = conn.execute(text(
+        f"SELECT EXTRACT(YEAR FROM MIN(posting_date)), EXTRACT(YEAR FROM MAX(posting_date)) FROM {name}"
+    )).first()
+    this_year = date.today().year
+    first_year = int(years[0]) if years[0] else this_year
+    last_year = max(int(years[1]) if years[1] else this_year, this_year) + years_ahead
+
+    foreign_keys = conn.execute(text(
+        "SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = CAST(:name AS regclass) AND contype = 'f'"
+    ), {"name": name}).scalars().all()
+
+    conn.execute(text(f"ALTER TABLE {name} RENAME TO {old}"))
+    conn.execute(text(
+        f"CREATE TABLE {name} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        f"PARTITION BY RANGE (posting_date)"
+    ))
+    ensure_year_partitions(conn, name, first_year, last_year)
+    conn.execute(text(f"INSERT INTO {name} SELECT * FROM {old}"))
+
+    # Keep the id sequence alive when the old table goes
+    conn.execute(text(f"ALTER SEQUENCE {name}_id_seq OWNED BY {name}.id"))
+    conn.execute(text(f"DROP TABLE {old}"))
+
+    # The partition key has to be part of the primary key
+    conn.execute(text(f"ALTER TABLE {name} ALTER COLUMN posting_date SET NOT NULL"))
+    conn.execute(text(f"ALTER TABLE {name} ADD PRIMARY KEY (id, posting_date)"))
+    for definition in foreign_keys:
+        conn.execute(text(f"ALTER TABLE {name} ADD {definition}"))
+
+
+def migrate(bind=engine, years_ahead: int = 1) -> dict:
+    """Partition (PostgreSQL only) and index the ledger tables. Safe to run repeatedly."""
+    result = {}
+    with bind.begin() as conn:
+        for table in LEDGER_TABLES:
+            table.create(bind=conn, checkfirst=True)
+
+            if conn.dialect.name == "postgresql":
+                if is_partitioned(conn, table.name):
+                    ensure_year_partitions(
+                        conn, table.name, date.today().year, date.today().year + years_ahead
+                    )
+                    result[table.name] = "partitions extended"
+                else:
+                    partition_table(conn, table, years_ahead)
+                    result[table.name] = "partitioned"
+            else:
+                result[table.name] = "indexed (no partitioning on %s)" % conn.dialect.name
+
+            # On a partitioned parent these become partitioned indexes on every partition
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+            if conn.dialect.name == "postgresql":
+                conn.execute(text(f"ANALYZE {table.name}"))
+
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partition and index the stock and GL ledger tables")
+    parser.add_argument("--years-ahead", type=int, default=1, help="Yearly partitions to create beyond the current year")
+    args = parser.parse_args()
+
+    for table_name, status in migrate(years_ahead=args.years_ahead).items():
+        print(f"{table_name}: {status}")
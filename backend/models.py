@@ -22,6 +22,8 @@ class Item(Base):
     is_stock_item = Column(Boolean, default=True)
     has_serial_no = Column(Boolean, default=False)
     has_batch_no = Column(Boolean, default=False)
+    default_supplier_id = Column(Integer, ForeignKey("suppliers.id"), nullable=True) # Used when purchasing from material requests
+    item_group_id = Column(Integer, ForeignKey("item_groups.id"), nullable=True, index=True)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     
     # In a real ERP, we'd have more complex relationships, but this is a start.
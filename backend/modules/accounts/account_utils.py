@@ -0,0 +1,187 @@
+"""
+Chart of Accounts Utilities
+In-process indexes of the chart of accounts per company: account names and
+numbers to account ids, and the account tree that reports roll up through
+"""
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from typing import Dict, List, NamedTuple, Optional
+from .models import Account
+
+# Charts are reloaded after this many seconds, so changes committed by
+# other processes are picked up; account changes committed in this process
+# drop the index immediately
+ACCOUNT_CACHE_TTL = 300
+
+
+class Chart(NamedTuple):
+    """Account lookups of one company scope"""
+    names: Dict[str, int]
+    numbers: Dict[str, int]
+    ids: Dict[int, Optional[int]] # account id -> company id
+
+
+class AccountNode(NamedTuple):
+    """One account of the tree, root_type inherited from the nearest ancestor when unset"""
+    id: int
+    account_name: str
+    account_number: Optional[str]
+    parent_account_id: Optional[int]
+    is_group: bool
+    root_type: Optional[str]
+
+
+class AccountTree(NamedTuple):
+    """Account tree of one company scope"""
+    nodes: Dict[int, AccountNode]
+    children: Dict[int, List[int]] # parent id -> child ids, in display order
+    roots: Dict[Optional[str], List[int]] # root type -> top level account ids, in display order
+    post_order: List[int] # every account after all of its descendants
+
+
+def _build_tree(rows) -> AccountTree:
+    """Index (id, name, number, parent id, is_group, root_type) rows into a tree"""
+    rows = sorted(rows, key=lambda row: (row[2] is None, row[2] or "", row[1], row[0]))
+    parents = {row[0]: row[3] for row in rows}
+
+    children: Dict[int, List[int]] = {}
+    top_level = []
+    for row in rows:
+        account_id, parent_id = row[0], row[3]
+        # Parents outside the scope count as missing
+        if parent_id in parents and parent_id != account_id:
+            children.setdefault(parent_id, []).append(account_id)
+        else:
+            top_level.append(account_id)
+
+    # Walk from the top level; accounts never reached sit in a parent cycle
+    # and are treated as top level themselves
+    fields = {row[0]: row for row in rows}
+    nodes: Dict[int, AccountNode] = {}
+    roots: Dict[Optional[str], List[int]] = {}
+    post_order: List[int] = []
+
+    def walk(start_id: int):
+        stack = [(start_id, fields[start_id][5], False)]
+        while stack:
+            account_id, inherited_root_type, expanded = stack.pop()
+            if expanded:
+                post_order.append(account_id)
+                continue
+            if account_id in nodes:
+                continue
+            account_id, account_name, account_number, parent_id, is_group, root_type = fields[account_id]
+            root_type = root_type or inherited_root_type
+            nodes[account_id] = AccountNode(account_id, account_name, account_number, parent_id, bool(is_group), root_type)
+            stack.append((account_id, root_type, True))
+            for child_id in reversed(children.get(account_id, [])):
+                if child_id not in nodes:
+                    stack.append((child_id, root_type, False))
+
+    for account_id in top_level:
+        walk(account_id)
+        roots.setdefault(nodes[account_id].root_type, []).append(account_id)
+    for row in rows:
+        if row[0] not in nodes:
+            parent_id = parents[row[0]]
+            if row[0] in children.get(parent_id, []):
+                children[parent_id].remove(row[0])
+            walk(row[0])
+            roots.setdefault(nodes[row[0]].root_type, []).append(row[0])
+
+    return AccountTree(nodes, children, roots, post_order)
+
+
+class AccountCache:
+    """
+    Index of the chart of accounts per company, loaded with one query per
+    company. A company's own accounts win over shared accounts (no company)
+    with the same name; without a company every account is visible and the
+    oldest wins, as a plain lookup by name would.
+    """
+
+    def __init__(self, ttl: float = ACCOUNT_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._charts: Dict[Optional[int], tuple] = {} # company_id -> (loaded_at, Chart)
+        self._trees: Dict[Optional[int], tuple] = {} # company_id -> (loaded_at, AccountTree)
+
+    def get_chart(self, db: Session, company_id: Optional[int] = None, reload: bool = False) -> Chart:
+        """Chart index of a company; reload skips the cached one, e.g. after a miss"""
+        with self._lock:
+            entry = self._charts.get(company_id)
+            if entry and not reload and time.monotonic() - entry[0] < self.ttl:
+                return entry[1]
+
+        query = db.query(Account.id, Account.account_name, Account.account_number, Account.company_id)
+        if company_id is not None:
+            query = query.filter((Account.company_id == company_id) | Account.company_id.is_(None))
+        # Company accounts first, then by age, so setdefault keeps the preferred one
+        rows = sorted(query.all(), key=lambda row: (row.company_id is None, row.id))
+
+        chart = Chart({}, {}, {})
+        for account_id, account_name, account_number, account_company_id in rows:
+            chart.names.setdefault(account_name, account_id)
+            if account_number:
+                chart.numbers.setdefault(account_number, account_id)
+            chart.ids[account_id] = account_company_id
+
+        with self._lock:
+            self._charts[company_id] = (time.monotonic(), chart)
+        return chart
+
+    def get_tree(self, db: Session, company_id: Optional[int] = None, reload: bool = False) -> AccountTree:
+        """
+        Account tree of a company's accounts and the shared ones, loaded with
+        one query; reload skips the cached one, e.g. after a miss
+        """
+        with self._lock:
+            entry = self._trees.get(company_id)
+            if entry and not reload and time.monotonic() - entry[0] < self.ttl:
+                return entry[1]
+
+        query = db.query(
+            Account.id,
+            Account.account_name,
+            Account.account_number,
+            Account.parent_account_id,
+            Account.is_group,
+            Account.root_type
+        )
+        if company_id is not None:
+            query = query.filter((Account.company_id == company_id) | Account.company_id.is_(None))
+        tree = _build_tree(query.all())
+
+        with self._lock:
+            self._trees[company_id] = (time.monotonic(), tree)
+        return tree
+
+    def clear(self):
+        with self._lock:
+            self._charts.clear()
+            self._trees.clear()
+
+
+account_cache = AccountCache()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_account_changes(session, flush_context):
+    """Remember that accounts changed in this transaction, the index is dropped on commit"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Account):
+            session.info["account_cache_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_account_cache(session):
+    if session.info.pop("account_cache_changed", None):
+        account_cache.clear()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_account_changes(session):
+    session.info.pop("account_cache_changed", None)
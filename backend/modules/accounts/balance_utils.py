@@ -0,0 +1,323 @@
+"""
+Account Balance Utilities
+Daily account balance summary kept by GL postings, its rebuild and
+consistency check, and balances read from it starting at the latest
+period closing snapshot
+"""
+from datetime import date
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, bindparam, case, func, insert, or_, select, tuple_, union_all, update
+from typing import Dict, Iterable, List, Optional, Tuple
+from .models import AccountBalanceSummary, AccountClosingBalance, GLEntry, PeriodClosingVoucher
+
+# Summary key: (account_id, company_id, posting_date, cost_center_id, fiscal_year)
+SummaryKey = Tuple[int, int, date, int, str]
+
+SUMMARY_KEY_COLUMNS = ('account_id', 'company_id', 'posting_date', 'cost_center_id', 'fiscal_year')
+
+PERIOD_CLOSING_VOUCHER = "Period Closing Voucher"
+
+
+def summary_key(row: dict) -> SummaryKey:
+    """Summary key of a GL row, missing dimensions as 0 / \"\""""
+    return (
+        row['account_id'],
+        row.get('company_id') or 0,
+        row['posting_date'],
+        row.get('cost_center_id') or 0,
+        row.get('fiscal_year') or ""
+    )
+
+
+def _gl_summary_columns():
+    """GL columns grouped into summary keys, with the same 0 / "" for missing dimensions"""
+    return (
+        GLEntry.account_id,
+        func.coalesce(GLEntry.company_id, 0),
+        GLEntry.posting_date,
+        func.coalesce(GLEntry.cost_center_id, 0),
+        func.coalesce(GLEntry.fiscal_year, "")
+    )
+
+
+def update_account_balances(db: Session, rows: Iterable[dict], sign: int = 1):
+    """
+    Add GL rows to the daily summary (sign=-1 takes them out, for entries
+    being cancelled). Existing summary rows are read with one query, then
+    written with one insert for new keys and one executemany increment for
+    the rest. Does not commit - the caller commits in the same transaction
+    as the GL rows.
+    """
+    changes: Dict[SummaryKey, List[float]] = {}
+    for row in rows:
+        change = changes.setdefault(summary_key(row), [0.0, 0.0])
+        change[0] += sign * (row.get('debit') or 0.0)
+        change[1] += sign * (row.get('credit') or 0.0)
+    if not changes:
+        return
+
+    existing = dict(
+        (tuple(key), summary_id)
+        for summary_id, *key in db.query(
+            AccountBalanceSummary.id,
+            AccountBalanceSummary.account_id,
+            AccountBalanceSummary.company_id,
+            AccountBalanceSummary.posting_date,
+            AccountBalanceSummary.cost_center_id,
+            AccountBalanceSummary.fiscal_year
+        ).filter(
+            tuple_(*[getattr(AccountBalanceSummary, column) for column in SUMMARY_KEY_COLUMNS]).in_(list(changes))
+        ).all()
+    )
+
+    new_rows = [
+        dict(zip(SUMMARY_KEY_COLUMNS, key), debit=debit, credit=credit)
+        for key, (debit, credit) in changes.items() if key not in existing
+    ]
+    if new_rows:
+        db.execute(insert(AccountBalanceSummary), new_rows)
+
+    table = AccountBalanceSummary.__table__
+    increments = [
+        {'summary_id': existing[key], 'debit_change': debit, 'credit_change': credit}
+        for key, (debit, credit) in changes.items() if key in existing
+    ]
+    if increments:
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam('summary_id'))
+            .values(
+                debit=func.coalesce(table.c.debit, 0.0) + bindparam('debit_change'),
+                credit=func.coalesce(table.c.credit, 0.0) + bindparam('credit_change')
+            ),
+            increments
+        )
+
+
+def rebuild_account_balances(db: Session, company_id: Optional[int] = None) -> int:
+    """
+    Regenerate the daily summary (all of it, or one company's) from the
+    non-cancelled GL entries with one grouped INSERT ... SELECT. Also the
+    backfill for GL entries posted before the summary existed.
+    Does not commit - the caller commits. Returns the number of summary rows written.
+    """
+    delete = db.query(AccountBalanceSummary)
+    gl_filters = [GLEntry.is_cancelled == False]
+    if company_id is not None:
+        delete = delete.filter(AccountBalanceSummary.company_id == company_id)
+        gl_filters.append(GLEntry.company_id == company_id)
+    delete.delete(synchronize_session=False)
+
+    key_columns = _gl_summary_columns()
+    result = db.execute(
+        insert(AccountBalanceSummary).from_select(
+            list(SUMMARY_KEY_COLUMNS) + ['debit', 'credit'],
+            select(
+                *key_columns,
+                func.sum(func.coalesce(GLEntry.debit, 0.0)),
+                func.sum(func.coalesce(GLEntry.credit, 0.0))
+            ).where(*gl_filters).group_by(*key_columns)
+        )
+    )
+    return result.rowcount
+
+
+def check_account_balances(
+    db: Session,
+    company_id: Optional[int] = None,
+    tolerance: float = 0.01,
+    limit: int = 100
+) -> dict:
+    """
+    Consistency check: regroup the GL into summary keys and compare with the
+    summary, in two grouped queries. Keys missing on either side count as 0.
+    Returns {"checked", "mismatched", "mismatches": [first `limit` differences]}
+    """
+    key_columns = _gl_summary_columns()
+    gl_query = db.query(
+        *key_columns,
+        func.sum(func.coalesce(GLEntry.debit, 0.0)),
+        func.sum(func.coalesce(GLEntry.credit, 0.0))
+    ).filter(GLEntry.is_cancelled == False)
+    summary_query = db.query(
+        *[getattr(AccountBalanceSummary, column) for column in SUMMARY_KEY_COLUMNS],
+        AccountBalanceSummary.debit,
+        AccountBalanceSummary.credit
+    )
+    if company_id is not None:
+        gl_query = gl_query.filter(GLEntry.company_id == company_id)
+        summary_query = summary_query.filter(AccountBalanceSummary.company_id == company_id)
+
+    expected = {tuple(row[:5]): (row[5] or 0.0, row[6] or 0.0) for row in gl_query.group_by(*key_columns).all()}
+    actual = {tuple(row[:5]): (row[5] or 0.0, row[6] or 0.0) for row in summary_query.all()}
+
+    mismatches = []
+    mismatched = 0
+    for key in expected.keys() | actual.keys():
+        gl_debit, gl_credit = expected.get(key, (0.0, 0.0))
+        summary_debit, summary_credit = actual.get(key, (0.0, 0.0))
+        if abs(gl_debit - summary_debit) > tolerance or abs(gl_credit - summary_credit) > tolerance:
+            mismatched += 1
+            if len(mismatches) < limit:
+                mismatches.append(dict(
+                    zip(SUMMARY_KEY_COLUMNS, key),
+                    gl_debit=gl_debit,
+                    gl_credit=gl_credit,
+                    summary_debit=summary_debit,
+                    summary_credit=summary_credit
+                ))
+
+    mismatches.sort(key=lambda mismatch: (mismatch['posting_date'], mismatch['account_id']))
+    return {"checked": len(expected.keys() | actual.keys()), "mismatched": mismatched, "mismatches": mismatches}
+
+
+def _closing_cutoffs(cutoff: Optional[date] = None, company_id: Optional[int] = None):
+    """Subquery of the latest submitted period closing on or before a date per company (0 = no company)"""
+    company_key = func.coalesce(PeriodClosingVoucher.company_id, 0)
+    statement = select(
+        company_key.label("company_id"),
+        func.max(PeriodClosingVoucher.posting_date).label("closing_date")
+    ).where(PeriodClosingVoucher.docstatus == 1)
+    if cutoff:
+        statement = statement.where(PeriodClosingVoucher.posting_date <= cutoff)
+    if company_id:
+        statement = statement.where(PeriodClosingVoucher.company_id == company_id)
+    return statement.group_by(company_key).subquery()
+
+
+def balance_rows(
+    cutoff: Optional[date] = None,
+    to_date: Optional[date] = None,
+    company_id: Optional[int] = None,
+    account_ids: Optional[List[int]] = None
+):
+    """
+    Subquery of (account_id, posting_date, debit, credit) rows that sum to
+    the balances up to to_date: per company, the closing snapshot of its
+    latest period closing on or before cutoff (dated the closing date),
+    then only the daily summary rows after it. Companies without a closing
+    read the whole summary. cutoff must not be after to_date.
+    """
+    cutoffs = _closing_cutoffs(cutoff, company_id)
+
+    snapshot = select(
+        AccountClosingBalance.account_id,
+        AccountClosingBalance.closing_date.label("posting_date"),
+        AccountClosingBalance.debit,
+        AccountClosingBalance.credit
+    ).join(cutoffs, and_(
+        AccountClosingBalance.company_id == cutoffs.c.company_id,
+        AccountClosingBalance.closing_date == cutoffs.c.closing_date
+    ))
+    summary = select(
+        AccountBalanceSummary.account_id,
+        AccountBalanceSummary.posting_date,
+        AccountBalanceSummary.debit,
+        AccountBalanceSummary.credit
+    ).outerjoin(cutoffs, AccountBalanceSummary.company_id == cutoffs.c.company_id).where(
+        or_(cutoffs.c.closing_date.is_(None), AccountBalanceSummary.posting_date > cutoffs.c.closing_date)
+    )
+    if to_date:
+        summary = summary.where(AccountBalanceSummary.posting_date <= to_date)
+    if company_id:
+        snapshot = snapshot.where(AccountClosingBalance.company_id == company_id)
+        summary = summary.where(AccountBalanceSummary.company_id == company_id)
+    if account_ids is not None:
+        snapshot = snapshot.where(AccountClosingBalance.account_id.in_(account_ids))
+        summary = summary.where(AccountBalanceSummary.account_id.in_(account_ids))
+
+    return union_all(snapshot, summary).subquery("balance_rows")
+
+
+def get_account_balances(
+    db: Session,
+    account_ids: Optional[List[int]] = None,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    company_id: Optional[int] = None,
+    exclude_closing: bool = False
+) -> Dict[int, dict]:
+    """
+    Debit, credit and balance per account over a date range, in one grouped
+    query. A range with a from_date sums the daily summary; balances up to a
+    date start from the latest period closing snapshot.
+
+    With exclude_closing the entries of period closings in the range are
+    read back from the GL in a second grouped query and left out, so income
+    and expense movements of a closed year are not netted to zero.
+    Returns {account_id: {"debit": float, "credit": float, "balance": float}}
+    """
+    if from_date:
+        rows = select(
+            AccountBalanceSummary.account_id,
+            AccountBalanceSummary.posting_date,
+            AccountBalanceSummary.debit,
+            AccountBalanceSummary.credit
+        ).where(AccountBalanceSummary.posting_date >= from_date)
+        if account_ids is not None:
+            rows = rows.where(AccountBalanceSummary.account_id.in_(account_ids))
+        if company_id:
+            rows = rows.where(AccountBalanceSummary.company_id == company_id)
+        if to_date:
+            rows = rows.where(AccountBalanceSummary.posting_date <= to_date)
+        rows = rows.subquery()
+    else:
+        rows = balance_rows(to_date, to_date, company_id, account_ids)
+
+    totals = {
+        account_id: [float(debit or 0.0), float(credit or 0.0)]
+        for account_id, debit, credit in db.execute(
+            select(rows.c.account_id, func.sum(rows.c.debit), func.sum(rows.c.credit)).group_by(rows.c.account_id)
+        ).all()
+    }
+
+    if exclude_closing:
+        closing = select(
+            GLEntry.account_id,
+            func.sum(GLEntry.debit),
+            func.sum(GLEntry.credit)
+        ).where(
+            GLEntry.voucher_type == PERIOD_CLOSING_VOUCHER,
+            GLEntry.is_cancelled == False
+        ).group_by(GLEntry.account_id)
+        if account_ids is not None:
+            closing = closing.where(GLEntry.account_id.in_(account_ids))
+        if company_id:
+            closing = closing.where(GLEntry.company_id == company_id)
+        if from_date:
+            closing = closing.where(GLEntry.posting_date >= from_date)
+        if to_date:
+            closing = closing.where(GLEntry.posting_date <= to_date)
+        for account_id, debit, credit in db.execute(closing).all():
+            if account_id in totals:
+                totals[account_id][0] -= float(debit or 0.0)
+                totals[account_id][1] -= float(credit or 0.0)
+
+    return {
+        account_id: {"debit": debit, "credit": credit, "balance": debit - credit}
+        for account_id, (debit, credit) in totals.items()
+    }
+
+
+def get_closing_balances(
+    db: Session,
+    dates: List[date],
+    company_id: Optional[int] = None
+) -> Dict[int, List[float]]:
+    """
+    Closing balance (debit - credit) per account on each of several dates,
+    in one grouped query with one conditional sum per date, starting from
+    the latest period closing snapshot on or before the earliest date.
+    Returns {account_id: [balance on dates[0], balance on dates[1], ...]}
+    """
+    rows = balance_rows(min(dates), max(dates), company_id)
+    net = func.coalesce(rows.c.debit, 0.0) - func.coalesce(rows.c.credit, 0.0)
+    statement = select(
+        rows.c.account_id,
+        *[func.sum(case((rows.c.posting_date <= as_of, net), else_=0.0)) for as_of in dates]
+    ).group_by(rows.c.account_id)
+
+    return {
+        account_id: [float(balance or 0.0) for balance in balances]
+        for account_id, *balances in db.execute(statement).all()
+    }
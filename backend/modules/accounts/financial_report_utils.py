@@ -0,0 +1,312 @@
+"""
+Financial Report Utilities
+Financial statements read from the latest period closing snapshot and the
+daily account balance summary after it, with a constant number of queries,
+rolled up through the cached account tree
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy import case, func, select
+from .account_utils import AccountTree, account_cache
+from .balance_utils import balance_rows, get_account_balances, get_closing_balances
+from .models import Account, PeriodClosingVoucher
+
+# Balance sheet section -> root type of its accounts
+BALANCE_SHEET_SECTIONS = {
+    "assets": "Asset",
+    "liabilities": "Liability",
+    "equity": "Equity",
+}
+
+# Profit and loss section -> root type of its accounts
+PROFIT_AND_LOSS_SECTIONS = {
+    "income": "Income",
+    "expenses": "Expense",
+}
+
+# Root types whose balances are shown credit positive
+CREDIT_ROOT_TYPES = ("Liability", "Equity", "Income")
+
+# Comparative dates accepted next to the report date
+MAX_COMPARATIVE_PERIODS = 12
+
+# Balances smaller than this are treated as zero
+ZERO_BALANCE = 0.005
+
+
+def _roll_up(tree: AccountTree, balances: Dict[int, List[float]], periods: int) -> Dict[int, List[float]]:
+    """
+    Balance of every account plus all of its descendants, for the accounts
+    that have a non-zero balance themselves or below them. One pass over
+    the tree in post order, children before parents.
+    """
+    rolled: Dict[int, List[float]] = {}
+    for account_id in tree.post_order:
+        own = balances.get(account_id)
+        total = list(own) if own else [0.0] * periods
+        has_balance = bool(own) and any(abs(balance) >= ZERO_BALANCE for balance in own)
+        for child_id in tree.children.get(account_id, []):
+            child_total = rolled.get(child_id)
+            # A child of another root type is reported in its own section
+            if child_total is not None and tree.nodes[child_id].root_type == tree.nodes[account_id].root_type:
+                has_balance = True
+                for index in range(periods):
+                    total[index] += child_total[index]
+        if has_balance:
+            rolled[account_id] = total
+    return rolled
+
+
+def _top_level(tree: AccountTree, root_type: str) -> List[int]:
+    """Top level accounts of a root type, including those under a parent of another root type"""
+    nested = [
+        account_id for account_id in tree.post_order
+        if tree.nodes[account_id].root_type == root_type
+        and tree.nodes[account_id].parent_account_id in tree.nodes
+        and tree.nodes[tree.nodes[account_id].parent_account_id].root_type != root_type
+    ]
+    return tree.roots.get(root_type, []) + nested
+
+
+def _section(tree: AccountTree, rolled: Dict[int, List[float]], root_type: str, periods: int) -> tuple:
+    """Nested rows of one root type and its totals per period, sign-adjusted for display"""
+    sign = -1.0 if root_type in CREDIT_ROOT_TYPES else 1.0
+
+    # Built in post order so every child row exists before its parent's
+    built: Dict[int, dict] = {}
+    for account_id in tree.post_order:
+        total = rolled.get(account_id)
+        node = tree.nodes[account_id]
+        if total is None or node.root_type != root_type:
+            continue
+        balances = [sign * balance or 0.0 for balance in total]
+        built[account_id] = {
+            "account_id": account_id,
+            "account_name": node.account_name,
+            "account_number": node.account_number,
+            "is_group": node.is_group,
+            "balance": balances[0],
+            "comparative_balances": balances[1:],
+            "children": [built[child_id] for child_id in tree.children.get(account_id, []) if child_id in built]
+        }
+
+    rows = [built[account_id] for account_id in _top_level(tree, root_type) if account_id in built]
+
+    totals = [0.0] * periods
+    for row in rows:
+        totals[0] += row["balance"]
+        for index, balance in enumerate(row["comparative_balances"], start=1):
+            totals[index] += balance
+    return rows, totals
+
+
+def get_balance_sheet(
+    db: Session,
+    as_of_date: date,
+    company_id: Optional[int] = None,
+    comparative_dates: Optional[List[date]] = None
+) -> dict:
+    """
+    Balance sheet as of a date, optionally with comparative dates.
+
+    Closing balances of every account on all dates come from one grouped
+    query over the latest period closing snapshot and the daily balance
+    summary after it, and are rolled up to the group
+    accounts through the cached account tree, so the cost does not grow with
+    the number of accounts queried. Liabilities and equity are shown credit
+    positive. Income less expense not yet closed to equity is reported as
+    provisional_profit_loss and counted with liabilities and equity.
+
+    Each section is a list of nested rows (account_id, account_name,
+    account_number, is_group, balance, comparative_balances, children);
+    group rows carry the subtotal of their children.
+    """
+    comparative_dates = list(comparative_dates or [])
+    if len(comparative_dates) > MAX_COMPARATIVE_PERIODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_COMPARATIVE_PERIODS} comparative dates are allowed"
+        )
+    dates = [as_of_date] + comparative_dates
+
+    tree = account_cache.get_tree(db, company_id)
+    balances = get_closing_balances(db, dates, company_id)
+    rolled = _roll_up(tree, balances, len(dates))
+
+    sections = {}
+    totals = {}
+    for section, root_type in BALANCE_SHEET_SECTIONS.items():
+        sections[section], totals[section] = _section(tree, rolled, root_type, len(dates))
+
+    # Income and expense since the start of the books, credit positive
+    profit_loss = [0.0] * len(dates)
+    for root_type in ("Income", "Expense"):
+        for account_id in _top_level(tree, root_type):
+            for index, balance in enumerate(rolled.get(account_id, [])):
+                profit_loss[index] -= balance
+
+    def period_totals(index: int) -> dict:
+        total_liabilities_and_equity = totals["liabilities"][index] + totals["equity"][index] + profit_loss[index]
+        return {
+            "total_assets": totals["assets"][index],
+            "total_liabilities": totals["liabilities"][index],
+            "total_equity": totals["equity"][index],
+            "provisional_profit_loss": profit_loss[index],
+            "total_liabilities_and_equity": total_liabilities_and_equity,
+            "difference": totals["assets"][index] - total_liabilities_and_equity
+        }
+
+    report = {"as_of_date": as_of_date, "company_id": company_id}
+    report.update(sections)
+    report.update(period_totals(0))
+    report["comparatives"] = [
+        dict(as_of_date=comparative_date, **period_totals(index))
+        for index, comparative_date in enumerate(comparative_dates, start=1)
+    ]
+    return report
+
+
+def get_profit_and_loss(
+    db: Session,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    company_id: Optional[int] = None
+) -> dict:
+    """
+    Income and expense per account for a date range. Without from_date the
+    range starts after the latest period closing before to_date (or at the
+    beginning of the books), so the default is the open period.
+
+    Movements are summed from the daily balance summary with the closing
+    entries of period closings inside the range left out, so closed years
+    still report their profit.
+    """
+    to_date = to_date or date.today()
+    if from_date and to_date < from_date:
+        raise HTTPException(status_code=400, detail="to_date must be on or after from_date")
+
+    if not from_date:
+        latest = select(func.max(PeriodClosingVoucher.posting_date)).where(
+            PeriodClosingVoucher.docstatus == 1,
+            PeriodClosingVoucher.posting_date < to_date
+        )
+        if company_id:
+            latest = latest.where(PeriodClosingVoucher.company_id == company_id)
+        latest = db.execute(latest).scalar()
+        from_date = latest + timedelta(days=1) if latest else None
+
+    tree = account_cache.get_tree(db, company_id)
+    account_ids = [
+        account_id for account_id, node in tree.nodes.items()
+        if node.root_type in PROFIT_AND_LOSS_SECTIONS.values()
+    ]
+    balances = get_account_balances(db, account_ids, from_date, to_date, company_id, exclude_closing=True)
+
+    report = {"from_date": from_date, "to_date": to_date, "company_id": company_id}
+    totals = {}
+    for section, root_type in PROFIT_AND_LOSS_SECTIONS.items():
+        sign = -1.0 if root_type in CREDIT_ROOT_TYPES else 1.0
+        rows = [
+            {
+                "account_id": account_id,
+                "account": tree.nodes[account_id].account_name,
+                "amount": sign * balances[account_id]["balance"] or 0.0
+            }
+            for account_id in tree.post_order
+            if account_id in balances and tree.nodes[account_id].root_type == root_type
+            and abs(balances[account_id]["balance"]) >= ZERO_BALANCE
+        ]
+        report[section] = rows
+        totals[section] = sum(row["amount"] for row in rows)
+
+    report.update({
+        "total_income": totals["income"],
+        "total_expense": totals["expenses"],
+        "net_profit": totals["income"] - totals["expenses"]
+    })
+    return report
+
+
+def trial_balance_statement(
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    company_id: Optional[int] = None
+):
+    """
+    Select of the trial balance, one row per account with postings up to
+    to_date: opening debit/credit before from_date, period debit and credit,
+    closing debit/credit and the closing balance (debit - credit). Balances
+    start from the latest period closing before from_date and the summary
+    rows after it are grouped in one pass with conditional sums, joined to
+    the accounts, so the report is a single query that can also be streamed.
+    """
+    if from_date and to_date and to_date < from_date:
+        raise HTTPException(status_code=400, detail="to_date must be on or after from_date")
+
+    # Everything before the period may start from a closing snapshot
+    rows = balance_rows(from_date - timedelta(days=1) if from_date else to_date, to_date, company_id)
+    debit = func.coalesce(rows.c.debit, 0.0)
+    credit = func.coalesce(rows.c.credit, 0.0)
+    if from_date:
+        in_period = rows.c.posting_date >= from_date
+        opening = func.sum(case((in_period, 0.0), else_=debit - credit))
+        period_debit = func.sum(case((in_period, debit), else_=0.0))
+        period_credit = func.sum(case((in_period, credit), else_=0.0))
+    else:
+        opening = func.sum(0.0)
+        period_debit = func.sum(debit)
+        period_credit = func.sum(credit)
+
+    balances = select(
+        rows.c.account_id,
+        opening.label("opening"),
+        period_debit.label("debit"),
+        period_credit.label("credit")
+    ).group_by(rows.c.account_id).subquery()
+
+    closing = balances.c.opening + balances.c.debit - balances.c.credit
+    return select(
+        Account.id.label("account_id"),
+        Account.account_name,
+        Account.account_number,
+        Account.root_type,
+        case((balances.c.opening > 0, balances.c.opening), else_=0.0).label("opening_debit"),
+        case((balances.c.opening < 0, -balances.c.opening), else_=0.0).label("opening_credit"),
+        balances.c.debit,
+        balances.c.credit,
+        case((closing > 0, closing), else_=0.0).label("closing_debit"),
+        case((closing < 0, -closing), else_=0.0).label("closing_credit"),
+        closing.label("balance")
+    ).join(balances, balances.c.account_id == Account.id).order_by(
+        Account.account_number.is_(None), Account.account_number, Account.account_name, Account.id
+    )
+
+
+def get_trial_balance(
+    db: Session,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    company_id: Optional[int] = None
+) -> dict:
+    """
+    Trial balance for a date range with opening, period and closing columns
+    per account, and their totals. Without from_date the period starts at
+    the beginning of the books and the opening columns are zero.
+    """
+    columns = ("opening_debit", "opening_credit", "debit", "credit", "closing_debit", "closing_credit")
+    totals = dict.fromkeys(columns, 0.0)
+    rows = []
+    for row in db.execute(trial_balance_statement(from_date, to_date, company_id)).mappings():
+        row = dict(row)
+        row["balance"] = float(row["balance"] or 0.0)
+        for column in columns:
+            row[column] = float(row[column] or 0.0)
+            totals[column] += row[column]
+        rows.append(row)
+
+    report = {"from_date": from_date, "to_date": to_date, "company_id": company_id, "trial_balance": rows}
+    report.update({f"total_{column}": total for column, total in totals.items()})
+    report["difference"] = totals["closing_debit"] - totals["closing_credit"]
+    return report
@@ -2,10 +2,157 @@
 General Ledger Utilities
 Functions for creating GL entries from transactions
 """
+from fastapi import HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, or_
 from datetime import date
 from typing import List, Optional
-from .models import GLEntry, Account
+from .models import GLEntry
+from .account_utils import account_cache
+from .balance_utils import update_account_balances, get_account_balances
+
+# Largest difference between total debit and total credit a GL map may have
+BALANCE_TOLERANCE = 0.01
+
+
+def _resolve_account(chart, entry_dict: dict) -> Optional[int]:
+    """Account id of a GL map row in a chart index, None if the chart does not have it"""
+    account_id = entry_dict.get("account_id")
+    if account_id is None:
+        account = entry_dict.get("account")
+        account_id = chart.names.get(account)
+        if account_id is None:
+            account_id = chart.numbers.get(account)
+        return account_id
+    return account_id if account_id in chart.ids else None
+
+
+def validate_gl_map(
+    db: Session,
+    gl_map: List[dict],
+    company_id: Optional[int] = None,
+    fiscal_year: Optional[str] = None
+) -> List[dict]:
+    """
+    Check a whole GL map before anything is written and return the GL rows
+    to insert. Accounts are given as account_id, or as "account" (name or
+    number) resolved through the chart of accounts index, so no row costs a
+    query; an account missing from the index reloads the company's chart
+    once, in case it was added by another process. Every row needs a known
+    account of the company, a voucher and
+    non-negative amounts, the map must balance and no row may fall in a
+    closed period.
+    Raises HTTPException 400 listing the first problem found.
+    """
+    rows = []
+    total_debit = 0.0
+    total_credit = 0.0
+    reloaded = set()
+    for index, entry_dict in enumerate(gl_map, start=1):
+        row_company_id = company_id or entry_dict.get("company_id")
+        chart = account_cache.get_chart(db, row_company_id)
+
+        account_id = _resolve_account(chart, entry_dict)
+        if account_id is None and row_company_id not in reloaded:
+            reloaded.add(row_company_id)
+            chart = account_cache.get_chart(db, row_company_id, reload=True)
+            account_id = _resolve_account(chart, entry_dict)
+        if account_id is None:
+            if entry_dict.get("account_id") is None:
+                account = f"'{entry_dict.get('account')}'"
+            else:
+                account = entry_dict["account_id"]
+            raise HTTPException(status_code=400, detail=f"Row {index}: account {account} not found")
+
+        if not entry_dict.get("voucher_type") or not entry_dict.get("voucher_no"):
+            raise HTTPException(status_code=400, detail=f"Row {index}: voucher_type and voucher_no are required")
+
+        debit = entry_dict.get("debit") or 0.0
+        credit = entry_dict.get("credit") or 0.0
+        if debit < 0 or credit < 0:
+            raise HTTPException(status_code=400, detail=f"Row {index}: debit and credit cannot be negative")
+        total_debit += debit
+        total_credit += credit
+
+        rows.append({
+            "posting_date": entry_dict.get("posting_date") or date.today(),
+            "account_id": account_id,
+            "party_type": entry_dict.get("party_type"),
+            "party": entry_dict.get("party"),
+            "cost_center_id": entry_dict.get("cost_center_id"),
+            "project": entry_dict.get("project"),
+            "against_voucher_type": entry_dict.get("against_voucher_type"),
+            "against_voucher_no": entry_dict.get("against_voucher_no"),
+            "voucher_type": entry_dict["voucher_type"],
+            "voucher_no": entry_dict["voucher_no"],
+            "against": entry_dict.get("against"),
+            "debit": debit,
+            "credit": credit,
+            "company_id": row_company_id,
+            "fiscal_year": fiscal_year or entry_dict.get("fiscal_year"),
+            "is_cancelled": False
+        })
+
+    if abs(total_debit - total_credit) > BALANCE_TOLERANCE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"GL entries do not balance: debit {total_debit} != credit {total_credit}"
+        )
+    validate_open_period(db, rows)
+    return rows
+
+
+def validate_open_period(db: Session, rows: List[dict]):
+    """
+    Reject GL rows dated in a closed period: on or before a submitted period
+    closing of the row's company, or inside a fiscal year marked closed for
+    that company or for all companies. Two queries on small tables for the
+    whole map. Raises HTTPException 400.
+    """
+    from modules.setup.models import FiscalYear
+    from .models import PeriodClosingVoucher
+
+    if not rows:
+        return
+    company_ids = {row.get("company_id") or 0 for row in rows}
+    first_date = min(row["posting_date"] for row in rows)
+    last_date = max(row["posting_date"] for row in rows)
+
+    company_key = func.coalesce(PeriodClosingVoucher.company_id, 0)
+    closed_through = dict(db.query(company_key, func.max(PeriodClosingVoucher.posting_date)).filter(
+        PeriodClosingVoucher.docstatus == 1,
+        PeriodClosingVoucher.posting_date >= first_date,
+        company_key.in_(company_ids)
+    ).group_by(company_key).all())
+    closed_years = db.query(
+        FiscalYear.year,
+        FiscalYear.company_id,
+        FiscalYear.year_start_date,
+        FiscalYear.year_end_date
+    ).filter(
+        FiscalYear.is_closed == True,
+        FiscalYear.year_start_date <= last_date,
+        FiscalYear.year_end_date >= first_date,
+        or_(FiscalYear.company_id.is_(None), FiscalYear.company_id.in_(company_ids))
+    ).all()
+    if not closed_through and not closed_years:
+        return
+
+    for index, row in enumerate(rows, start=1):
+        posting_date = row["posting_date"]
+        row_company_id = row.get("company_id") or 0
+        through = closed_through.get(row_company_id)
+        if through and posting_date <= through:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Row {index}: posting date {posting_date} is in a closed period (closed through {through})"
+            )
+        for year, year_company_id, year_start_date, year_end_date in closed_years:
+            if (year_company_id or 0) in (0, row_company_id) and year_start_date <= posting_date <= year_end_date:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Row {index}: posting date {posting_date} is in closed fiscal year {year}"
+                )
 
 
 def make_gl_entries(
@@ -13,15 +160,17 @@ def make_gl_entries(
     gl_map: List[dict],
     company_id: Optional[int] = None,
     fiscal_year: Optional[str] = None,
-    update_outstanding: bool = True
-):
+    update_outstanding: bool = True,
+    commit: bool = True
+) -> List[dict]:
     """
     Create GL entries from a list of GL map dictionaries
     
     gl_map format:
     [
         {
-            "account": "Debtors",
+            "account": "Debtors",    # Account name or number, or instead:
+            "account_id": None,      # Account id, skips the name lookup
             "party_type": "Customer",
             "party": "Customer Name",
             "debit": 1000.0,
@@ -36,42 +185,20 @@ def make_gl_entries(
         },
         ...
     ]
+
+    The map is validated as a whole first (see validate_gl_map), then all
+    rows are written with a single bulk insert and added to the daily
+    account balance summary in the same commit. With commit=False the
+    caller commits, for documents that write more in the same transaction.
+    Returns the inserted rows.
     """
-    entries = []
-    
-    for entry_dict in gl_map:
-        # Get account by name
-        account = db.query(Account).filter(
-            Account.account_name == entry_dict.get("account")
-        ).first()
-        
-        if not account:
-            raise ValueError(f"Account '{entry_dict.get('account')}' not found")
-        
-        gl_entry = GLEntry(
-            posting_date=entry_dict.get("posting_date", date.today()),
-            account_id=account.id,
-            party_type=entry_dict.get("party_type"),
-            party=entry_dict.get("party"),
-            cost_center_id=entry_dict.get("cost_center_id"),
-            project=entry_dict.get("project"),
-            against_voucher_type=entry_dict.get("against_voucher_type"),
-            against_voucher_no=entry_dict.get("against_voucher_no"),
-            voucher_type=entry_dict.get("voucher_type"),
-            voucher_no=entry_dict.get("voucher_no"),
-            against=entry_dict.get("against"),
-            debit=entry_dict.get("debit", 0.0),
-            credit=entry_dict.get("credit", 0.0),
-            company_id=company_id or entry_dict.get("company_id"),
-            fiscal_year=fiscal_year or entry_dict.get("fiscal_year"),
-            is_cancelled=False
-        )
-        
-        db.add(gl_entry)
-        entries.append(gl_entry)
-    
-    db.commit()
-    return entries
+    rows = validate_gl_map(db, gl_map, company_id, fiscal_year)
+    if rows:
+        db.execute(insert(GLEntry), rows)
+        update_account_balances(db, rows)
+    if commit:
+        db.commit()
+    return rows
 
 
 def make_reverse_gl_entries(
@@ -81,7 +208,10 @@ def make_reverse_gl_entries(
     company_id: Optional[int] = None
 ):
     """
-    Create reverse GL entries for cancellation
+    Create reverse GL entries for cancellation. The original and reverse
+    entries both end up cancelled, so the originals are taken out of the
+    daily account balance summary in the same commit. Entries in a closed
+    period cannot be reversed.
     """
     # Get original entries
     original_entries = db.query(GLEntry).filter(
@@ -90,6 +220,10 @@ def make_reverse_gl_entries(
         GLEntry.is_cancelled == False,
         GLEntry.company_id == company_id
     ).all()
+    validate_open_period(db, [
+        {'posting_date': entry.posting_date, 'company_id': entry.company_id}
+        for entry in original_entries
+    ])
     
     reverse_entries = []
     
@@ -118,6 +252,19 @@ def make_reverse_gl_entries(
         
         db.add(reverse_entry)
         reverse_entries.append(reverse_entry)
+
+    update_account_balances(db, [
+        {
+            'account_id': entry.account_id,
+            'company_id': entry.company_id,
+            'posting_date': entry.posting_date,
+            'cost_center_id': entry.cost_center_id,
+            'fiscal_year': entry.fiscal_year,
+            'debit': entry.debit,
+            'credit': entry.credit
+        }
+        for entry in original_entries
+    ], sign=-1)
     
     db.commit()
     return reverse_entries
@@ -128,38 +275,13 @@ def get_account_balance(
     account_id: int,
     from_date: Optional[date] = None,
     to_date: Optional[date] = None,
-    company_id: Optional[int] = None
+    company_id: Optional[int] = None,
+    exclude_closing: bool = False
 ) -> dict:
     """
-    Get account balance from GL entries
+    Get account balance from the daily account balance summary, optionally
+    without period closing entries (see get_account_balances)
     Returns: {"debit": float, "credit": float, "balance": float}
     """
-    from sqlalchemy import func
-    
-    query = db.query(
-        func.sum(GLEntry.debit).label('total_debit'),
-        func.sum(GLEntry.credit).label('total_credit')
-    ).filter(
-        GLEntry.account_id == account_id,
-        GLEntry.is_cancelled == False
-    )
-    
-    if company_id:
-        query = query.filter(GLEntry.company_id == company_id)
-    if from_date:
-        query = query.filter(GLEntry.posting_date >= from_date)
-    if to_date:
-        query = query.filter(GLEntry.posting_date <= to_date)
-    
-    result = query.first()
-    
-    total_debit = float(result.total_debit) if result.total_debit else 0.0
-    total_credit = float(result.total_credit) if result.total_credit else 0.0
-    balance = total_debit - total_credit
-    
-    return {
-        "debit": total_debit,
-        "credit": total_credit,
-        "balance": balance
-    }
-
+    balances = get_account_balances(db, [account_id], from_date, to_date, company_id, exclude_closing)
+    return balances.get(account_id, {"debit": 0.0, "credit": 0.0, "balance": 0.0})
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Boolean, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -63,6 +63,15 @@ class JournalEntryAccount(Base):
 class GLEntry(Base):
     """General Ledger Entry - All accounting entries are stored here"""
     __tablename__ = "gl_entries"
+    __table_args__ = (
+        # Account balances: covers (account_id, is_cancelled, posting_date) filters and,
+        # on PostgreSQL, the summed debit/credit without touching the heap
+        Index(
+            "ix_gl_account_cancelled_date", "account_id", "is_cancelled", "posting_date",
+            postgresql_include=["debit", "credit"]
+        ),
+        Index("ix_gl_voucher", "voucher_type", "voucher_no"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     posting_date = Column(Date, nullable=False, index=True)
@@ -86,6 +95,81 @@ class GLEntry(Base):
     account = relationship("Account")
 
 
+class AccountBalanceSummary(Base):
+    """
+    Non-cancelled GL debit and credit per account, company, day, cost center
+    and fiscal year - updated with every GL posting and reversal, so balances
+    sum a few summary rows instead of the ledger.
+    Missing dimensions are stored as 0 / "" so the key stays unique.
+    """
+    __tablename__ = "account_balance_summaries"
+    __table_args__ = (
+        UniqueConstraint(
+            "account_id", "company_id", "posting_date", "cost_center_id", "fiscal_year",
+            name="uq_account_balance_summary"
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    company_id = Column(Integer, nullable=False, default=0)
+    posting_date = Column(Date, nullable=False, index=True)
+    cost_center_id = Column(Integer, nullable=False, default=0)
+    fiscal_year = Column(String, nullable=False, default="")
+    debit = Column(Float, default=0.0)
+    credit = Column(Float, default=0.0)
+
+
+class PeriodClosingVoucher(Base):
+    """
+    Period Closing Voucher - closes a fiscal year of a company: posts the
+    income and expense balances to an equity account and snapshots every
+    account's closing balance (AccountClosingBalance)
+    """
+    __tablename__ = "period_closing_vouchers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True, nullable=True)  # Document number
+    fiscal_year_id = Column(Integer, ForeignKey("fiscal_years.id"), nullable=False)
+    posting_date = Column(Date, index=True)  # Last day of the fiscal year
+    closing_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)  # Retained earnings
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=True)
+    net_profit = Column(Float, default=0.0)
+    remarks = Column(String, nullable=True)
+    docstatus = Column(Integer, default=0)  # 0=Draft, 1=Submitted, 2=Cancelled
+    status = Column(String, default="Draft")
+    submitted_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    submitted_at = Column(DateTime, nullable=True)
+    cancelled_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    cancelled_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    closing_account = relationship("Account")
+
+
+class AccountClosingBalance(Base):
+    """
+    Cumulative debit and credit per account of a company up to a period
+    closing, closing entries included - balances start here and add only
+    the summary rows after it. A missing company is stored as 0, as in
+    AccountBalanceSummary.
+    """
+    __tablename__ = "account_closing_balances"
+    __table_args__ = (
+        UniqueConstraint("account_id", "company_id", "closing_date", name="uq_account_closing_balance"),
+        Index("ix_account_closing_balance_company_date", "company_id", "closing_date"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    period_closing_voucher_id = Column(Integer, ForeignKey("period_closing_vouchers.id"), nullable=False, index=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    company_id = Column(Integer, nullable=False, default=0)
+    closing_date = Column(Date, nullable=False)
+    debit = Column(Float, default=0.0)
+    credit = Column(Float, default=0.0)
+
+
 class PaymentLedgerEntry(Base):
     """Payment Ledger Entry - For tracking receivables and payables"""
     __tablename__ = "payment_ledger_entries"
@@ -0,0 +1,202 @@
+"""
+Period Closing Utilities
+Closing a fiscal year of a company: income and expense balances posted to
+an equity account, a closing balance snapshot of every account that later
+balances start from, and reopening by cancelling the latest closing
+"""
+from datetime import datetime
+from typing import Dict, List
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, select, union_all
+from core.document_lifecycle import DocStatus, validate_submit, validate_cancel
+from .account_utils import account_cache
+from .balance_utils import PERIOD_CLOSING_VOUCHER
+from .gl_utils import make_gl_entries, make_reverse_gl_entries
+from .models import AccountBalanceSummary, AccountClosingBalance, PeriodClosingVoucher
+
+# Root types closed to equity at the end of a fiscal year
+PROFIT_AND_LOSS_ROOT_TYPES = ("Income", "Expense")
+
+# Root types a closing account may have
+CLOSING_ACCOUNT_ROOT_TYPES = ("Equity", "Liability")
+
+# Balances smaller than this are not closed
+ZERO_BALANCE = 0.005
+
+
+def _latest_closing(db: Session, company_id):
+    """Latest submitted period closing of a company (None = postings without a company)"""
+    return db.query(PeriodClosingVoucher).filter(
+        PeriodClosingVoucher.docstatus == DocStatus.SUBMITTED.value,
+        func.coalesce(PeriodClosingVoucher.company_id, 0) == (company_id or 0)
+    ).order_by(PeriodClosingVoucher.posting_date.desc()).first()
+
+
+def _cumulative_balances(db: Session, company_id, previous, closing_date) -> Dict[int, List[float]]:
+    """
+    Cumulative [debit, credit] per account of exactly one company up to a
+    date: the previous closing snapshot plus the summary rows after it, in
+    one grouped query
+    """
+    company_key = company_id or 0
+    snapshot = select(
+        AccountClosingBalance.account_id,
+        AccountClosingBalance.debit,
+        AccountClosingBalance.credit
+    ).where(AccountClosingBalance.company_id == company_key)
+    summary = select(
+        AccountBalanceSummary.account_id,
+        AccountBalanceSummary.debit,
+        AccountBalanceSummary.credit
+    ).where(
+        AccountBalanceSummary.company_id == company_key,
+        AccountBalanceSummary.posting_date <= closing_date
+    )
+    if previous:
+        snapshot = snapshot.where(AccountClosingBalance.closing_date == previous.posting_date)
+        summary = summary.where(AccountBalanceSummary.posting_date > previous.posting_date)
+        rows = union_all(snapshot, summary).subquery()
+    else:
+        rows = summary.subquery()
+    return {
+        account_id: [float(debit or 0.0), float(credit or 0.0)]
+        for account_id, debit, credit in db.execute(
+            select(rows.c.account_id, func.sum(rows.c.debit), func.sum(rows.c.credit)).group_by(rows.c.account_id)
+        ).all()
+    }
+
+
+def submit_period_closing(db: Session, voucher: PeriodClosingVoucher, user_id: int) -> PeriodClosingVoucher:
+    """
+    Close the voucher's fiscal year for its company in one transaction:
+
+    - post the income and expense balances not yet closed (this year's, and
+      any earlier year left open) to the closing account on the last day
+      of the year
+    - snapshot every account's cumulative debit and credit, closing entries
+      included, so balances up to later dates start from it
+    - mark the fiscal year closed when it belongs to the voucher's company
+
+    GL postings on or before the closing date are rejected from then on.
+    """
+    from modules.setup.models import FiscalYear
+
+    validate_submit(db, voucher, user_id)
+    fiscal_year = db.query(FiscalYear).filter(FiscalYear.id == voucher.fiscal_year_id).first()
+    if not fiscal_year:
+        raise HTTPException(status_code=404, detail="Fiscal Year not found")
+    if fiscal_year.is_closed:
+        raise HTTPException(status_code=400, detail=f"Fiscal year {fiscal_year.year} is already closed")
+    closing_date = fiscal_year.year_end_date
+
+    previous = _latest_closing(db, voucher.company_id)
+    if previous and previous.posting_date >= closing_date:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Books are already closed through {previous.posting_date} by {previous.name}"
+        )
+
+    tree = account_cache.get_tree(db, voucher.company_id)
+    closing_account = tree.nodes.get(voucher.closing_account_id)
+    if not closing_account:
+        # The account may have been added since the tree was cached
+        tree = account_cache.get_tree(db, voucher.company_id, reload=True)
+        closing_account = tree.nodes.get(voucher.closing_account_id)
+    if not closing_account:
+        raise HTTPException(status_code=400, detail="Closing account not found")
+    if closing_account.is_group or closing_account.root_type not in CLOSING_ACCOUNT_ROOT_TYPES:
+        raise HTTPException(status_code=400, detail="Closing account must be an Equity or Liability ledger account")
+
+    balances = _cumulative_balances(db, voucher.company_id, previous, closing_date)
+
+    gl_map = []
+    net_profit = 0.0
+    for account_id, (debit, credit) in balances.items():
+        node = tree.nodes.get(account_id)
+        balance = debit - credit
+        if not node or node.root_type not in PROFIT_AND_LOSS_ROOT_TYPES or abs(balance) < ZERO_BALANCE:
+            continue
+        net_profit -= balance
+        gl_map.append({
+            "account_id": account_id,
+            "debit": -balance if balance < 0 else 0.0,
+            "credit": balance if balance > 0 else 0.0,
+            "against": closing_account.account_name
+        })
+    if abs(net_profit) >= ZERO_BALANCE:
+        gl_map.append({
+            "account_id": closing_account.id,
+            "debit": -net_profit if net_profit < 0 else 0.0,
+            "credit": net_profit if net_profit > 0 else 0.0
+        })
+    for entry in gl_map:
+        entry.update(voucher_type=PERIOD_CLOSING_VOUCHER, voucher_no=voucher.name, posting_date=closing_date)
+
+    rows = make_gl_entries(db, gl_map, company_id=voucher.company_id, fiscal_year=fiscal_year.year, commit=False)
+
+    # The snapshot is the cumulative balances with the closing entries applied
+    for row in rows:
+        balance = balances.setdefault(row["account_id"], [0.0, 0.0])
+        balance[0] += row["debit"]
+        balance[1] += row["credit"]
+    if balances:
+        db.execute(insert(AccountClosingBalance), [
+            {
+                "period_closing_voucher_id": voucher.id,
+                "account_id": account_id,
+                "company_id": voucher.company_id or 0,
+                "closing_date": closing_date,
+                "debit": debit,
+                "credit": credit
+            }
+            for account_id, (debit, credit) in balances.items()
+        ])
+
+    if fiscal_year.company_id == voucher.company_id:
+        fiscal_year.is_closed = True
+    voucher.posting_date = closing_date
+    voucher.net_profit = net_profit
+    voucher.docstatus = DocStatus.SUBMITTED.value
+    voucher.status = "Submitted"
+    voucher.submitted_by = user_id
+    voucher.submitted_at = datetime.utcnow()
+
+    db.commit()
+    db.refresh(voucher)
+    return voucher
+
+
+def cancel_period_closing(db: Session, voucher: PeriodClosingVoucher, user_id: int) -> PeriodClosingVoucher:
+    """
+    Reopen the period of the latest closing of a company: drop its snapshot,
+    reverse its closing entries and clear the fiscal year's closed flag, in
+    one transaction. Earlier closings are reopened one at a time, newest first.
+    """
+    from modules.setup.models import FiscalYear
+
+    validate_cancel(db, voucher, user_id)
+    latest = _latest_closing(db, voucher.company_id)
+    if latest and latest.id != voucher.id:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cancel the later period closing {latest.name} first"
+        )
+
+    db.query(AccountClosingBalance).filter(
+        AccountClosingBalance.period_closing_voucher_id == voucher.id
+    ).delete(synchronize_session=False)
+
+    fiscal_year = db.query(FiscalYear).filter(FiscalYear.id == voucher.fiscal_year_id).first()
+    if fiscal_year and fiscal_year.company_id == voucher.company_id:
+        fiscal_year.is_closed = False
+    voucher.docstatus = DocStatus.CANCELLED.value
+    voucher.status = "Cancelled"
+    voucher.cancelled_by = user_id
+    voucher.cancelled_at = datetime.utcnow()
+    db.flush()
+
+    # Commits the whole cancellation once the period is open again
+    make_reverse_gl_entries(db, PERIOD_CLOSING_VOUCHER, voucher.name, company_id=voucher.company_id)
+    db.refresh(voucher)
+    return voucher
@@ -1,5 +1,5 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from core.auth import get_current_active_user
@@ -9,6 +9,7 @@ from models import User
 from . import models, schemas
 from .gl_utils import make_gl_entries, make_reverse_gl_entries
 from datetime import date, datetime
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/accounts",
@@ -30,9 +31,20 @@ def create_account(account: schemas.AccountCreate, db: Session = Depends(get_db)
     db.refresh(db_account)
     return db_account
 
+@router.put("/accounts/{account_id}", response_model=schemas.Account)
+def update_account(account_id: int, account: schemas.AccountCreate, db: Session = Depends(get_db)):
+    db_account = db.query(models.Account).filter(models.Account.id == account_id).first()
+    if not db_account:
+        raise HTTPException(status_code=404, detail="Account not found")
+    for field, value in account.dict(exclude_unset=True).items():
+        setattr(db_account, field, value)
+    db.commit()
+    db.refresh(db_account)
+    return db_account
+
 @router.get("/accounts/", response_model=List[schemas.Account])
-def read_accounts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    accounts = db.query(models.Account).offset(skip).limit(limit).all()
+def read_accounts(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    accounts = paginate(db.query(models.Account), response, [models.Account.id], skip, limit, cursor)
     return accounts
 
 @router.post("/journal-entries/", response_model=schemas.JournalEntry)
@@ -81,15 +93,15 @@ def create_journal_entry(
 
 @router.get("/journal-entries/", response_model=List[schemas.JournalEntry])
 def read_journal_entries(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all journal entries"""
-    entries = db.query(models.JournalEntry).order_by(
-        models.JournalEntry.posting_date.desc()
-    ).offset(skip).limit(limit).all()
+    entries = paginate(db.query(models.JournalEntry), response, [models.JournalEntry.posting_date, models.JournalEntry.id], skip, limit, cursor, descending=True)
     return entries
 
 
@@ -130,19 +142,12 @@ def submit_journal_entry(
             detail="Total debit must equal total credit"
         )
     
-    # Submit the document
-    submit_document(db, entry, current_user.id)
-    
-    # Create GL entries
+    # Build GL entries by account id, no account lookups
     gl_map = []
     for je_account in entry.accounts:
-        account = db.query(models.Account).filter(
-            models.Account.id == je_account.account_id
-        ).first()
-        
         if je_account.debit > 0:
             gl_map.append({
-                "account": account.account_name,
+                "account_id": je_account.account_id,
                 "debit": je_account.debit,
                 "credit": 0.0,
                 "against": je_account.against_account,
@@ -152,7 +157,7 @@ def submit_journal_entry(
             })
         if je_account.credit > 0:
             gl_map.append({
-                "account": account.account_name,
+                "account_id": je_account.account_id,
                 "debit": 0.0,
                 "credit": je_account.credit,
                 "against": je_account.against_account,
@@ -160,8 +165,13 @@ def submit_journal_entry(
                 "voucher_no": entry.name or str(entry.id),
                 "posting_date": entry.posting_date,
             })
-    
-    make_gl_entries(db, gl_map, company_id=entry.company_id)
+
+    # A bad map raises before anything is written; the GL entries and the
+    # submitted status are committed together
+    make_gl_entries(db, gl_map, company_id=entry.company_id, commit=False)
+
+    # Submit the document
+    submit_document(db, entry, current_user.id)
     
     return {"message": "Journal Entry submitted successfully", "status": entry.status}
 
@@ -196,6 +206,74 @@ def cancel_journal_entry(
     
     return {"message": "Journal Entry cancelled successfully", "status": entry.status}
 
+# Period Closing Voucher Endpoints
+
+@router.post("/period-closing-vouchers/", response_model=schemas.PeriodClosingVoucher)
+def create_period_closing_voucher(
+    voucher: schemas.PeriodClosingVoucherCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Create a Period Closing Voucher (Draft) for a fiscal year"""
+    from modules.setup.models import FiscalYear
+
+    fiscal_year = db.query(FiscalYear).filter(FiscalYear.id == voucher.fiscal_year_id).first()
+    if not fiscal_year:
+        raise HTTPException(status_code=404, detail="Fiscal Year not found")
+
+    db_voucher = models.PeriodClosingVoucher(
+        name=get_next_number(db, "Period Closing Voucher", date=fiscal_year.year_end_date),
+        posting_date=fiscal_year.year_end_date,
+        docstatus=0,
+        status="Draft",
+        **voucher.dict()
+    )
+    db.add(db_voucher)
+    db.commit()
+    db.refresh(db_voucher)
+    return db_voucher
+
+@router.get("/period-closing-vouchers/", response_model=List[schemas.PeriodClosingVoucher])
+def read_period_closing_vouchers(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Get all period closing vouchers"""
+    vouchers = paginate(db.query(models.PeriodClosingVoucher), response, [models.PeriodClosingVoucher.posting_date, models.PeriodClosingVoucher.id], skip, limit, cursor, descending=True)
+    return vouchers
+
+@router.post("/period-closing-vouchers/{voucher_id}/submit", response_model=schemas.PeriodClosingVoucher)
+def submit_period_closing_voucher(
+    voucher_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Close the fiscal year: post P&L to the closing account, snapshot balances and lock the period"""
+    from .period_closing_utils import submit_period_closing
+
+    voucher = db.query(models.PeriodClosingVoucher).filter(models.PeriodClosingVoucher.id == voucher_id).first()
+    if not voucher:
+        raise HTTPException(status_code=404, detail="Period Closing Voucher not found")
+    return submit_period_closing(db, voucher, current_user.id)
+
+@router.post("/period-closing-vouchers/{voucher_id}/cancel", response_model=schemas.PeriodClosingVoucher)
+def cancel_period_closing_voucher(
+    voucher_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Reopen the period of the latest closing (reverses its entries and drops its snapshot)"""
+    from .period_closing_utils import cancel_period_closing
+
+    voucher = db.query(models.PeriodClosingVoucher).filter(models.PeriodClosingVoucher.id == voucher_id).first()
+    if not voucher:
+        raise HTTPException(status_code=404, detail="Period Closing Voucher not found")
+    return cancel_period_closing(db, voucher, current_user.id)
+
 # Payment Entry Endpoints
 from . import payment_schemas
 
@@ -300,170 +378,98 @@ def create_payment_entry(payment: payment_schemas.PaymentEntryCreate, db: Sessio
     return db_payment
 
 @router.get("/payments/", response_model=List[payment_schemas.PaymentEntry])
-def read_payment_entries(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_payment_entries(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
     from .payment_models import PaymentEntry
-    payments = db.query(PaymentEntry).offset(skip).limit(limit).all()
+    payments = paginate(db.query(PaymentEntry), response, [PaymentEntry.id], skip, limit, cursor)
     return payments
 
 # Reports
 @router.get("/reports/trial-balance")
 def get_trial_balance(
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    company_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Generate Trial Balance Report"""
-    from sqlalchemy import func
-    
-    # Get all journal entry accounts and sum by account
-    accounts_data = db.query(
-        models.JournalEntryAccount.account_id,
-        func.sum(models.JournalEntryAccount.debit).label('total_debit'),
-        func.sum(models.JournalEntryAccount.credit).label('total_credit')
-    ).group_by(models.JournalEntryAccount.account_id).all()
-    
-    trial_balance = []
-    total_debits = 0.0
-    total_credits = 0.0
-    
-    for acc_id, debit, credit in accounts_data:
-        account = db.query(models.Account).filter(models.Account.id == acc_id).first()
-        if account:
-            balance = debit - credit
-            trial_balance.append({
-                'account_id': acc_id,
-                'account_name': account.account_name,
-                'debit': float(debit) if debit else 0.0,
-                'credit': float(credit) if credit else 0.0,
-                'balance': float(balance)
-            })
-            total_debits += float(debit) if debit else 0.0
-            total_credits += float(credit) if credit else 0.0
-    
-    return {
-        'trial_balance': trial_balance,
-        'total_debit': total_debits,
-        'total_credit': total_credits,
-        'difference': total_debits - total_credits
-    }
+    """Generate Trial Balance Report with opening, period and closing columns"""
+    from .financial_report_utils import get_trial_balance as build_trial_balance
+    return build_trial_balance(db, from_date, to_date, company_id)
+
+@router.get("/reports/trial-balance/export")
+def export_trial_balance(
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    company_id: Optional[int] = None,
+    format: str = "ndjson",
+    current_user: User = Depends(get_current_active_user)
+):
+    """Stream the Trial Balance as NDJSON or CSV, one row per account"""
+    from core.export import stream_export
+    from .financial_report_utils import trial_balance_statement
+    return stream_export(trial_balance_statement(from_date, to_date, company_id), format, "trial_balance")
 
 @router.get("/reports/profit-loss")
 def get_profit_loss(
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+    company_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Generate Profit & Loss Statement"""
-    from sqlalchemy import func
-    
-    # Get Income accounts
-    income_accounts = db.query(
-        models.Account.account_name,
-        func.sum(models.JournalEntryAccount.credit - models.JournalEntryAccount.debit).label('amount')
-    ).join(
-        models.JournalEntryAccount, models.Account.id == models.JournalEntryAccount.account_id
-    ).filter(
-        models.Account.root_type == 'Income'
-    ).group_by(models.Account.account_name).all()
-    
-    # Get Expense accounts
-    expense_accounts = db.query(
-        models.Account.account_name,
-        func.sum(models.JournalEntryAccount.debit - models.JournalEntryAccount.credit).label('amount')
-    ).join(
-        models.JournalEntryAccount, models.Account.id == models.JournalEntryAccount.account_id
-    ).filter(
-        models.Account.root_type == 'Expense'
-    ).group_by(models.Account.account_name).all()
-    
-    total_income = sum([float(amt) if amt else 0.0 for _, amt in income_accounts])
-    total_expense = sum([float(amt) if amt else 0.0 for _, amt in expense_accounts])
-    
-    return {
-        'income': [{'account': name, 'amount': float(amt) if amt else 0.0} for name, amt in income_accounts],
-        'expenses': [{'account': name, 'amount': float(amt) if amt else 0.0} for name, amt in expense_accounts],
-        'total_income': total_income,
-        'total_expense': total_expense,
-        'net_profit': total_income - total_expense
-    }
+    """Generate Profit & Loss Statement, by default for the period since the latest closing"""
+    from .financial_report_utils import get_profit_and_loss
+    return get_profit_and_loss(db, from_date, to_date, company_id)
 
 
 @router.get("/reports/balance-sheet")
 def get_balance_sheet(
+    as_of_date: Optional[date] = None,
+    company_id: Optional[int] = None,
+    comparative_dates: Optional[List[date]] = Query(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Generate Balance Sheet Report"""
-    from sqlalchemy import func
-    from .gl_utils import get_account_balance
-    
-    # Get Asset accounts
-    asset_accounts = db.query(models.Account).filter(
-        models.Account.root_type == 'Asset',
-        models.Account.is_group == False
-    ).all()
-    
-    # Get Liability accounts
-    liability_accounts = db.query(models.Account).filter(
-        models.Account.root_type == 'Liability',
-        models.Account.is_group == False
-    ).all()
-    
-    # Get Equity accounts
-    equity_accounts = db.query(models.Account).filter(
-        models.Account.root_type == 'Equity',
-        models.Account.is_group == False
-    ).all()
-    
-    assets = []
-    total_assets = 0.0
-    for account in asset_accounts:
-        balance = get_account_balance(db, account.id)
-        if balance['balance'] != 0:
-            assets.append({
-                'account': account.account_name,
-                'balance': balance['balance']
-            })
-            total_assets += balance['balance']
-    
-    liabilities = []
-    total_liabilities = 0.0
-    for account in liability_accounts:
-        balance = get_account_balance(db, account.id)
-        if balance['balance'] != 0:
-            liabilities.append({
-                'account': account.account_name,
-                'balance': balance['balance']
-            })
-            total_liabilities += balance['balance']
-    
-    equity = []
-    total_equity = 0.0
-    for account in equity_accounts:
-        balance = get_account_balance(db, account.id)
-        if balance['balance'] != 0:
-            equity.append({
-                'account': account.account_name,
-                'balance': balance['balance']
-            })
-            total_equity += balance['balance']
-    
-    return {
-        'assets': assets,
-        'liabilities': liabilities,
-        'equity': equity,
-        'total_assets': total_assets,
-        'total_liabilities': total_liabilities,
-        'total_equity': total_equity,
-        'total_liabilities_and_equity': total_liabilities + total_equity
-    }
+    """Generate Balance Sheet Report as a tree of accounts with group subtotals"""
+    from .financial_report_utils import get_balance_sheet as build_balance_sheet
+
+    return build_balance_sheet(db, as_of_date or date.today(), company_id, comparative_dates)
+
+
+@router.post("/balance-summary/rebuild")
+def rebuild_balance_summary(
+    company_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Regenerate the daily account balance summary from the GL (also the backfill)"""
+    from .balance_utils import rebuild_account_balances
+
+    count = rebuild_account_balances(db, company_id)
+    db.commit()
+    return {"message": "Account balance summary rebuilt", "rows": count}
+
+
+@router.get("/balance-summary/check")
+def check_balance_summary(
+    company_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Compare the daily account balance summary with the GL"""
+    from .balance_utils import check_account_balances
+    return check_account_balances(db, company_id)
 
 
 @router.get("/gl-entries/")
 def get_gl_entries(
+    response: Response,
     account_id: int = None,
     from_date: date = None,
     to_date: date = None,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
@@ -479,13 +485,35 @@ def get_gl_entries(
     if to_date:
         query = query.filter(GLEntry.posting_date <= to_date)
     
-    entries = query.order_by(
-        GLEntry.posting_date.desc(),
-        GLEntry.id.desc()
-    ).offset(skip).limit(limit).all()
+    entries = paginate(query, response, [GLEntry.posting_date, GLEntry.id], skip, limit, cursor, descending=True)
     
     return entries
 
+@router.get("/gl-entries/export")
+def export_gl_entries(
+    account_id: int = None,
+    from_date: date = None,
+    to_date: date = None,
+    format: str = "ndjson",
+    current_user: User = Depends(get_current_active_user)
+):
+    """Stream all matching General Ledger entries as NDJSON or CSV"""
+    from sqlalchemy import select
+    from core.export import stream_export
+    from .models import GLEntry
+    
+    statement = select(GLEntry.__table__).where(GLEntry.is_cancelled == False)
+    
+    if account_id:
+        statement = statement.where(GLEntry.account_id == account_id)
+    if from_date:
+        statement = statement.where(GLEntry.posting_date >= from_date)
+    if to_date:
+        statement = statement.where(GLEntry.posting_date <= to_date)
+    
+    statement = statement.order_by(GLEntry.posting_date, GLEntry.id)
+    return stream_export(statement, format, "gl_entries")
+
 # Aging Reports
 
 def generate_aging_report(db: Session, account_type: str):
@@ -562,8 +590,8 @@ def create_sales_tax_template(
     return db_template
 
 @router.get("/sales-tax-templates/", response_model=List[tax_schemas.SalesTaxTemplate])
-def read_sales_tax_templates(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(tax_models.SalesTaxTemplate).offset(skip).limit(limit).all()
+def read_sales_tax_templates(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(tax_models.SalesTaxTemplate), response, [tax_models.SalesTaxTemplate.id], skip, limit, cursor)
 
 # Purchase Tax Templates
 @router.post("/purchase-tax-templates/", response_model=tax_schemas.PurchaseTaxTemplate)
@@ -592,8 +620,8 @@ def create_purchase_tax_template(
     return db_template
 
 @router.get("/purchase-tax-templates/", response_model=List[tax_schemas.PurchaseTaxTemplate])
-def read_purchase_tax_templates(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(tax_models.PurchaseTaxTemplate).offset(skip).limit(limit).all()
+def read_purchase_tax_templates(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(tax_models.PurchaseTaxTemplate), response, [tax_models.PurchaseTaxTemplate.id], skip, limit, cursor)
 
 # Bank Reconciliation
 from . import bank_reconciliation_models, bank_reconciliation_schemas
@@ -628,9 +656,11 @@ def create_bank_statement(
 
 @router.get("/bank-statements/", response_model=List[bank_reconciliation_schemas.BankStatement])
 def read_bank_statements(
+    response: Response,
     bank_account_id: int = None,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
@@ -638,7 +668,7 @@ def read_bank_statements(
     query = db.query(bank_reconciliation_models.BankStatement)
     if bank_account_id:
         query = query.filter(bank_reconciliation_models.BankStatement.bank_account_id == bank_account_id)
-    return query.order_by(bank_reconciliation_models.BankStatement.statement_date.desc()).offset(skip).limit(limit).all()
+    return paginate(query, response, [bank_reconciliation_models.BankStatement.statement_date, bank_reconciliation_models.BankStatement.id], skip, limit, cursor, descending=True)
 
 @router.get("/bank-statements/{statement_id}", response_model=bank_reconciliation_schemas.BankStatement)
 def read_bank_statement(
@@ -782,9 +812,11 @@ def create_bank_reconciliation(
 
 @router.get("/bank-reconciliations/", response_model=List[bank_reconciliation_schemas.BankReconciliation])
 def read_bank_reconciliations(
+    response: Response,
     statement_id: int = None,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
@@ -792,7 +824,7 @@ def read_bank_reconciliations(
     query = db.query(bank_reconciliation_models.BankReconciliation)
     if statement_id:
         query = query.filter(bank_reconciliation_models.BankReconciliation.bank_statement_id == statement_id)
-    return query.order_by(bank_reconciliation_models.BankReconciliation.matched_at.desc()).offset(skip).limit(limit).all()
+    return paginate(query, response, [bank_reconciliation_models.BankReconciliation.matched_at, bank_reconciliation_models.BankReconciliation.id], skip, limit, cursor, descending=True)
 
 # Budget Management
 from . import budget_models, budget_schemas
@@ -840,10 +872,12 @@ def create_budget(
 
 @router.get("/budgets/", response_model=List[budget_schemas.Budget])
 def read_budgets(
+    response: Response,
     company_id: int = None,
     account_id: int = None,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get all budgets"""
@@ -852,7 +886,7 @@ def read_budgets(
         query = query.filter(budget_models.Budget.company_id == company_id)
     if account_id:
         query = query.filter(budget_models.Budget.account_id == account_id)
-    return query.order_by(budget_models.Budget.budget_start_date.desc()).offset(skip).limit(limit).all()
+    return paginate(query, response, [budget_models.Budget.budget_start_date, budget_models.Budget.id], skip, limit, cursor, descending=True)
 
 @router.get("/budgets/{budget_id}", response_model=budget_schemas.Budget)
 def read_budget(
@@ -899,13 +933,11 @@ def get_budget_vs_actual(
     if end_date > budget.budget_end_date:
         end_date = budget.budget_end_date
     
-    # Get actual expense from GL Entries
-    actual_expense = db.query(func.sum(models.GLEntry.debit) - func.sum(models.GLEntry.credit)).filter(
-        models.GLEntry.account_id == budget.account_id,
-        models.GLEntry.posting_date >= budget.budget_start_date,
-        models.GLEntry.posting_date <= end_date,
-        models.GLEntry.is_cancelled == False
-    ).scalar() or 0.0
+    # Get actual expense from the daily account balance summary
+    from .gl_utils import get_account_balance
+    actual_expense = get_account_balance(
+        db, budget.account_id, budget.budget_start_date, end_date, exclude_closing=True
+    )['balance']
     
     # Make it positive (expenses are debits)
     if actual_expense < 0:
@@ -936,6 +968,8 @@ def get_all_budgets_vs_actual(
     db: Session = Depends(get_db)
 ):
     """Get budget vs actual for all submitted budgets"""
+    from .gl_utils import get_account_balance
+
     query = db.query(budget_models.Budget).filter(budget_models.Budget.status == "Submitted")
     if company_id:
         query = query.filter(budget_models.Budget.company_id == company_id)
@@ -948,12 +982,9 @@ def get_all_budgets_vs_actual(
         if end_date > budget.budget_end_date:
             end_date = budget.budget_end_date
         
-        actual_expense = db.query(func.sum(models.GLEntry.debit) - func.sum(models.GLEntry.credit)).filter(
-            models.GLEntry.account_id == budget.account_id,
-            models.GLEntry.posting_date >= budget.budget_start_date,
-            models.GLEntry.posting_date <= end_date,
-            models.GLEntry.is_cancelled == False
-        ).scalar() or 0.0
+        actual_expense = get_account_balance(
+            db, budget.account_id, budget.budget_start_date, end_date, exclude_closing=True
+        )['balance']
         
         if actual_expense < 0:
             actual_expense = abs(actual_expense)
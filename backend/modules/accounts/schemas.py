@@ -4,12 +4,14 @@ from datetime import date
 
 class AccountBase(BaseModel):
     account_name: str
+    account_number: Optional[str] = None
     parent_account_id: Optional[int] = None
     is_group: bool = False
     root_type: Optional[str] = None
     report_type: Optional[str] = None
     account_type: Optional[str] = None
     account_currency: Optional[str] = "USD"
+    company_id: Optional[int] = None
 
 class AccountCreate(AccountBase):
     pass
@@ -57,3 +59,23 @@ class JournalEntry(JournalEntryBase):
 
     class Config:
         from_attributes = True
+
+class PeriodClosingVoucherBase(BaseModel):
+    fiscal_year_id: int
+    closing_account_id: int
+    company_id: Optional[int] = None
+    remarks: Optional[str] = None
+
+class PeriodClosingVoucherCreate(PeriodClosingVoucherBase):
+    pass
+
+class PeriodClosingVoucher(PeriodClosingVoucherBase):
+    id: int
+    name: Optional[str] = None
+    posting_date: Optional[date] = None
+    net_profit: float = 0.0
+    docstatus: int = 0
+    status: str = "Draft"
+
+    class Config:
+        from_attributes = True
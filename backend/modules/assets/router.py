@@ -1,5 +1,5 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from core.auth import get_current_active_user
@@ -9,6 +9,7 @@ from . import models, schemas
 from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import math
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/assets",
@@ -38,12 +39,14 @@ def create_asset_category(
 
 @router.get("/categories/", response_model=List[schemas.AssetCategory])
 def read_asset_categories(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get all asset categories"""
-    return db.query(models.AssetCategory).offset(skip).limit(limit).all()
+    return paginate(db.query(models.AssetCategory), response, [models.AssetCategory.id], skip, limit, cursor)
 
 @router.get("/categories/{category_id}", response_model=schemas.AssetCategory)
 def read_asset_category(
@@ -110,8 +113,10 @@ def create_asset(
 
 @router.get("/", response_model=List[schemas.Asset])
 def read_assets(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     company_id: int = None,
     status: str = None,
     db: Session = Depends(get_db)
@@ -122,7 +127,7 @@ def read_assets(
         query = query.filter(models.Asset.company_id == company_id)
     if status:
         query = query.filter(models.Asset.status == status)
-    return query.order_by(models.Asset.purchase_date.desc()).offset(skip).limit(limit).all()
+    return paginate(query, response, [models.Asset.purchase_date, models.Asset.id], skip, limit, cursor, descending=True)
 
 @router.get("/{asset_id}", response_model=schemas.Asset)
 def read_asset(
@@ -1,9 +1,10 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from . import models, schemas
 from . import invoice_schemas
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/buying",
@@ -26,8 +27,8 @@ def create_supplier(supplier: schemas.SupplierCreate, db: Session = Depends(get_
     return db_supplier
 
 @router.get("/suppliers/", response_model=List[schemas.Supplier])
-def read_suppliers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    suppliers = db.query(models.Supplier).offset(skip).limit(limit).all()
+def read_suppliers(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    suppliers = paginate(db.query(models.Supplier), response, [models.Supplier.id], skip, limit, cursor)
     return suppliers
 
 @router.post("/orders/", response_model=schemas.PurchaseOrder)
@@ -73,8 +74,8 @@ def create_purchase_order(order: schemas.PurchaseOrderCreate, db: Session = Depe
     return db_order
 
 @router.get("/orders/", response_model=List[schemas.PurchaseOrder])
-def read_purchase_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    orders = db.query(models.PurchaseOrder).offset(skip).limit(limit).all()
+def read_purchase_orders(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    orders = paginate(db.query(models.PurchaseOrder), response, [models.PurchaseOrder.id], skip, limit, cursor)
     return orders
 
 @router.post("/orders/{order_id}/submit")
@@ -86,6 +87,9 @@ def submit_purchase_order(order_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Order already submitted")
     
     order.status = "Submitted"
+    # Ordered qty counts towards projected stock until it is received
+    from modules.stock.availability_utils import update_bin_qty, order_item_changes
+    update_bin_qty(db, order_item_changes(order.items, "ordered_qty"))
     db.commit()
     return {"status": "Submitted"}
 
@@ -125,12 +129,13 @@ def make_purchase_receipt(order_id: int, db: Session = Depends(get_db)):
     
     # 3. Create Stock Entry (Material Receipt) with Ledger
     from modules.stock.router import create_stock_entry_with_ledger
+    from modules.stock.availability_utils import update_bin_qty, order_item_changes, ORDER_WAREHOUSE
     
     stock_entry_data = {
         'transaction_date': order.transaction_date,
         'purpose': "Material Receipt",
         'voucher_type': "Purchase Receipt",
-        'warehouse': "Stores", # Default to Stores for now
+        'warehouse': ORDER_WAREHOUSE,
         'items': [{
             'item_code': item.item_code,
             'qty': item.qty,
@@ -139,8 +144,9 @@ def make_purchase_receipt(order_id: int, db: Session = Depends(get_db)):
     }
     stock_entry = create_stock_entry_with_ledger(db, stock_entry_data)
     
-    # 4. Update Order Status
+    # 4. Update Order Status, the received qty is no longer on order
     order.receipt_status = "Fully Received"
+    update_bin_qty(db, order_item_changes(order.items, "ordered_qty", sign=-1))
     db.commit()
     
     return {"message": "Purchase Receipt created", "receipt_id": receipt.id, "stock_entry_id": stock_entry.id}
@@ -297,9 +303,9 @@ def submit_return_endpoint(invoice_id: int, db: Session = Depends(get_db)):
     return submit_purchase_return(invoice_id, db)
 
 @router.get("/invoices/", response_model=List[invoice_schemas.PurchaseInvoice])
-def read_purchase_invoices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_purchase_invoices(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
     from .models import PurchaseInvoice
-    invoices = db.query(PurchaseInvoice).offset(skip).limit(limit).all()
+    invoices = paginate(db.query(PurchaseInvoice), response, [PurchaseInvoice.id], skip, limit, cursor)
     return invoices
 
 @router.get("/invoices/{invoice_id}", response_model=invoice_schemas.PurchaseInvoice)
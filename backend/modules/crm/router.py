@@ -1,8 +1,9 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from . import models, schemas
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/crm",
@@ -25,8 +26,8 @@ def create_lead(lead: schemas.LeadCreate, db: Session = Depends(get_db)):
     return db_lead
 
 @router.get("/leads/", response_model=List[schemas.Lead])
-def read_leads(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    leads = db.query(models.Lead).offset(skip).limit(limit).all()
+def read_leads(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    leads = paginate(db.query(models.Lead), response, [models.Lead.id], skip, limit, cursor)
     return leads
 
 @router.post("/opportunities/", response_model=schemas.Opportunity)
@@ -38,6 +39,6 @@ def create_opportunity(opp: schemas.OpportunityCreate, db: Session = Depends(get
     return db_opp
 
 @router.get("/opportunities/", response_model=List[schemas.Opportunity])
-def read_opportunities(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    opps = db.query(models.Opportunity).offset(skip).limit(limit).all()
+def read_opportunities(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    opps = paginate(db.query(models.Opportunity), response, [models.Opportunity.id], skip, limit, cursor)
     return opps
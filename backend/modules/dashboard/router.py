@@ -20,7 +20,7 @@ def get_dashboard_stats(db: Session = Depends(get_db)):
     """Get key metrics for dashboard"""
     from modules.selling.invoice_models import SalesInvoice
     from modules.buying.models import PurchaseInvoice
-    from modules.stock.models import StockLedgerEntry
+    from modules.stock.models import Bin
     from modules.accounts.models import Account
     from modules.selling.models import SalesOrder, Customer
     from modules.buying.models import PurchaseOrder, Supplier
@@ -35,20 +35,9 @@ def get_dashboard_stats(db: Session = Depends(get_db)):
     purchase_count = db.query(func.count(PurchaseInvoice.id)).scalar() or 0
     outstanding_payables = db.query(func.sum(PurchaseInvoice.outstanding_amount)).scalar() or 0.0
     
-    # Stock metrics
-    subquery = db.query(
-        StockLedgerEntry.item_code,
-        func.max(StockLedgerEntry.id).label('latest_id')
-    ).group_by(StockLedgerEntry.item_code).subquery()
-    
-    stock_entries = db.query(StockLedgerEntry).join(
-        subquery,
-        (StockLedgerEntry.item_code == subquery.c.item_code) &
-        (StockLedgerEntry.id == subquery.c.latest_id)
-    ).all()
-    
-    inventory_value = sum([entry.stock_value for entry in stock_entries])
-    total_items = len(stock_entries)
+    # Stock metrics (read from materialized bins)
+    inventory_value = db.query(func.sum(Bin.stock_value)).scalar() or 0.0
+    total_items = db.query(func.count(func.distinct(Bin.item_code))).scalar() or 0
     
     # Net profit (simple calculation)
     net_profit = total_sales - total_purchases
@@ -83,24 +72,13 @@ def get_dashboard_stats(db: Session = Depends(get_db)):
 
     # Chart Data: Stock Value by Warehouse
     warehouse_stock_value = []
-    warehouses = db.query(StockLedgerEntry.warehouse).distinct().all()
+    warehouse_values = db.query(
+        Bin.warehouse,
+        func.sum(Bin.stock_value).label('value')
+    ).group_by(Bin.warehouse).all()
     
-    for wh in warehouses:
-        wh_name = wh[0]
-        # Get latest entry for each item in this warehouse
-        subquery_wh = db.query(
-            StockLedgerEntry.item_code,
-            func.max(StockLedgerEntry.id).label('latest_id')
-        ).filter(StockLedgerEntry.warehouse == wh_name).group_by(StockLedgerEntry.item_code).subquery()
-        
-        entries = db.query(StockLedgerEntry).join(
-            subquery_wh,
-            (StockLedgerEntry.item_code == subquery_wh.c.item_code) &
-            (StockLedgerEntry.id == subquery_wh.c.latest_id)
-        ).all()
-        
-        val = sum([e.stock_value for e in entries])
-        if val > 0:
+    for wh_name, val in warehouse_values:
+        if val and val > 0:
             warehouse_stock_value.append({"name": wh_name, "value": float(val)})
 
     return {
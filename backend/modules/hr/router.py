@@ -1,10 +1,11 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from . import models, schemas
 from modules.setup.models import Employee
 from modules.setup import schemas as setup_schemas
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/hr",
@@ -29,8 +30,8 @@ def create_department(dept: schemas.DepartmentCreate, db: Session = Depends(get_
     return db_dept
 
 @router.get("/departments/", response_model=List[schemas.Department])
-def read_departments(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.Department).offset(skip).limit(limit).all()
+def read_departments(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.Department), response, [models.Department.id], skip, limit, cursor)
 
 # Designations
 @router.post("/designations/", response_model=schemas.Designation)
@@ -42,8 +43,8 @@ def create_designation(desig: schemas.DesignationCreate, db: Session = Depends(g
     return db_desig
 
 @router.get("/designations/", response_model=List[schemas.Designation])
-def read_designations(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.Designation).offset(skip).limit(limit).all()
+def read_designations(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.Designation), response, [models.Designation.id], skip, limit, cursor)
 
 # Leave Types
 @router.post("/leave-types/", response_model=schemas.LeaveType)
@@ -55,8 +56,8 @@ def create_leave_type(lt: schemas.LeaveTypeCreate, db: Session = Depends(get_db)
     return db_lt
 
 @router.get("/leave-types/", response_model=List[schemas.LeaveType])
-def read_leave_types(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.LeaveType).offset(skip).limit(limit).all()
+def read_leave_types(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.LeaveType), response, [models.LeaveType.id], skip, limit, cursor)
 
 # Leave Applications
 @router.post("/leave-applications/", response_model=schemas.LeaveApplication)
@@ -73,8 +74,8 @@ def create_leave_application(la: schemas.LeaveApplicationCreate, db: Session = D
     return db_la
 
 @router.get("/leave-applications/", response_model=List[schemas.LeaveApplication])
-def read_leave_applications(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.LeaveApplication).offset(skip).limit(limit).all()
+def read_leave_applications(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.LeaveApplication), response, [models.LeaveApplication.id], skip, limit, cursor)
 
 # Attendance
 @router.post("/attendance/", response_model=schemas.Attendance)
@@ -94,8 +95,8 @@ def create_attendance(att: schemas.AttendanceCreate, db: Session = Depends(get_d
     return db_att
 
 @router.get("/attendance/", response_model=List[schemas.Attendance])
-def read_attendance(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.Attendance).offset(skip).limit(limit).all()
+def read_attendance(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.Attendance), response, [models.Attendance.id], skip, limit, cursor)
 
 
 # Employees
@@ -108,5 +109,5 @@ def create_employee(emp: setup_schemas.EmployeeCreate, db: Session = Depends(get
     return db_emp
 
 @router.get("/employees/", response_model=List[setup_schemas.Employee])
-def read_employees(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(Employee).offset(skip).limit(limit).all()
+def read_employees(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(Employee), response, [Employee.id], skip, limit, cursor)
@@ -1,8 +1,9 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from . import models, schemas
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/manufacturing",
@@ -54,8 +55,8 @@ def create_bom(bom: schemas.BOMCreate, db: Session = Depends(get_db)):
     return db_bom
 
 @router.get("/boms/", response_model=List[schemas.BOM])
-def read_boms(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    boms = db.query(models.BOM).offset(skip).limit(limit).all()
+def read_boms(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    boms = paginate(db.query(models.BOM), response, [models.BOM.id], skip, limit, cursor)
     return boms
 
 @router.get("/boms/{bom_id}", response_model=schemas.BOM)
@@ -91,12 +92,17 @@ def create_work_order(wo: schemas.WorkOrderCreate, db: Session = Depends(get_db)
                 db.add(db_material)
             db.commit()
     
+    # Plan the finished goods and reserve the materials until they are transferred
+    from modules.stock.availability_utils import update_bin_qty, work_order_changes
+    update_bin_qty(db, work_order_changes(db_wo))
+    db.commit()
+    
     db.refresh(db_wo)
     return db_wo
 
 @router.get("/work-orders/", response_model=List[schemas.WorkOrder])
-def read_work_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    work_orders = db.query(models.WorkOrder).offset(skip).limit(limit).all()
+def read_work_orders(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    work_orders = paginate(db.query(models.WorkOrder), response, [models.WorkOrder.id], skip, limit, cursor)
     return work_orders
 
 @router.post("/work-orders/{wo_id}/start")
@@ -111,13 +117,14 @@ def start_work_order(wo_id: int, db: Session = Depends(get_db)):
     
     # Transfer materials from Source Warehouse to WIP Warehouse
     from modules.stock.router import create_stock_entry_with_ledger
-    from modules.stock.models import Item # To get standard rate
+    from modules.stock.item_utils import get_item_records # To get standard rate
     
+    items = get_item_records(db, (material.item_code for material in wo.material_requests))
     material_items = []
     for material in wo.material_requests:
         # Fetch item cost
-        item = db.query(Item).filter(Item.item_code == material.item_code).first()
-        rate = item.standard_rate if item else 0.0
+        item = items[material.item_code]
+        rate = (item.standard_rate or 0.0) if item else 0.0
         
         material_items.append({
             'item_code': material.item_code,
@@ -136,6 +143,10 @@ def start_work_order(wo_id: int, db: Session = Depends(get_db)):
         }
         create_stock_entry_with_ledger(db, entry_data)
     
+    # Transferred materials are in WIP now, release their reservation
+    from modules.stock.availability_utils import update_bin_qty, work_order_changes
+    update_bin_qty(db, work_order_changes(wo, sign=-1, planned=False))
+    
     wo.status = "In Progress"
     db.commit()
     
@@ -152,14 +163,15 @@ def complete_work_order(wo_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Work Order not in progress")
     
     from modules.stock.router import create_stock_entry_with_ledger
-    from modules.stock.models import Item
+    from modules.stock.item_utils import get_item_records
     
     # 1. Consume Materials from WIP (Material Issue)
+    items = get_item_records(db, (material.item_code for material in wo.material_requests))
     material_items = []
     total_rm_cost = 0.0
     for material in wo.material_requests:
-        item = db.query(Item).filter(Item.item_code == material.item_code).first()
-        rate = item.standard_rate if item else 0.0
+        item = items[material.item_code]
+        rate = (item.standard_rate or 0.0) if item else 0.0
         
         material_items.append({
             'item_code': material.item_code,
@@ -196,6 +208,10 @@ def complete_work_order(wo_id: int, db: Session = Depends(get_db)):
     }
     create_stock_entry_with_ledger(db, entry_data)
     
+    # Produced stock is actual now, no longer planned
+    from modules.stock.availability_utils import update_bin_qty, work_order_changes
+    update_bin_qty(db, work_order_changes(wo, sign=-1, materials=False))
+    
     wo.qty_manufactured = wo.qty_to_manufacture
     wo.status = "Completed"
     db.commit()
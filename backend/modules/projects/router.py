@@ -1,8 +1,9 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from . import models, schemas
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/projects",
@@ -27,8 +28,8 @@ def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db)
     return db_project
 
 @router.get("/projects/", response_model=List[schemas.Project])
-def read_projects(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.Project).offset(skip).limit(limit).all()
+def read_projects(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.Project), response, [models.Project.id], skip, limit, cursor)
 
 @router.get("/projects/{project_id}", response_model=schemas.Project)
 def read_project(project_id: int, db: Session = Depends(get_db)):
@@ -47,11 +48,11 @@ def create_task(task: schemas.TaskCreate, db: Session = Depends(get_db)):
     return db_task
 
 @router.get("/tasks/", response_model=List[schemas.Task])
-def read_tasks(skip: int = 0, limit: int = 100, project_id: int = None, db: Session = Depends(get_db)):
+def read_tasks(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, project_id: int = None, db: Session = Depends(get_db)):
     query = db.query(models.Task)
     if project_id:
         query = query.filter(models.Task.project_id == project_id)
-    return query.offset(skip).limit(limit).all()
+    return paginate(query, response, [models.Task.id], skip, limit, cursor)
 
 # Timesheets
 @router.post("/timesheets/", response_model=schemas.Timesheet)
@@ -82,6 +83,6 @@ def create_timesheet(timesheet: schemas.TimesheetCreate, db: Session = Depends(g
     return db_timesheet
 
 @router.get("/timesheets/", response_model=List[schemas.Timesheet])
-def read_timesheets(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.Timesheet).offset(skip).limit(limit).all()
+def read_timesheets(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.Timesheet), response, [models.Timesheet.id], skip, limit, cursor)
 
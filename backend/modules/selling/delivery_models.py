@@ -26,5 +26,6 @@ class DeliveryNoteItem(Base):
     qty = Column(Float)
     rate = Column(Float)
     amount = Column(Float)
+    batch_no = Column(String, nullable=True)
 
     delivery_note = relationship("DeliveryNote", back_populates="items")
@@ -0,0 +1,276 @@
+"""
+Gross Profit Utilities
+Selling amount against the cost of goods sold per invoice line, taken from
+the stock ledger rows that issued the stock, aggregated in SQL and cached
+per completed month
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, literal, select
+from modules.stock.checkpoint_utils import month_end
+from .invoice_models import SalesInvoice, SalesInvoiceItem, GrossProfitPeriod, GrossProfitSummary
+
+# Invoices in these states carry no sale
+EXCLUDED_STATUSES = ("Draft", "Cancelled")
+
+# group_by option -> key columns of a report row
+GROUP_BY_KEYS = {
+    "item": ("item_code",),
+    "customer": ("customer_id",),
+    "item_customer": ("item_code", "customer_id"),
+    "item_group": ("item_group_id",),
+    "invoice": ("sales_invoice_id", "customer_id", "posting_date"),
+}
+
+
+def get_line_costs(
+    from_date: date,
+    to_date: date,
+    customer_id: Optional[int] = None,
+    item_codes=None
+):
+    """
+    Subquery of the invoice lines posted in a date range with their cost of
+    goods sold (buying_amount).
+
+    A line's cost is its qty at the unit cost of the ledger rows posted for
+    it: the stock the invoice issued itself (voucher_type "Sales Invoice",
+    voucher_detail_no = invoice item), else the delivery of the order line it
+    bills (voucher_type "Sales Order", voucher_detail_no = order item). The
+    issue cost of a ledger row is -stock_value_difference, which reposts keep
+    current. Lines linked to neither are costed at the item's last valuation
+    rate on or before the posting date.
+    item_codes: a list or a select of item codes to restrict to.
+    """
+    from modules.stock.models import StockLedgerEntry
+
+    lines = select(
+        SalesInvoiceItem.id,
+        SalesInvoiceItem.sales_order_item_id,
+        SalesInvoiceItem.sales_invoice_id,
+        SalesInvoiceItem.item_code,
+        SalesInvoiceItem.qty,
+        SalesInvoiceItem.amount,
+        SalesInvoice.customer_id,
+        SalesInvoice.posting_date
+    ).join(SalesInvoice).where(
+        SalesInvoice.posting_date >= from_date,
+        SalesInvoice.posting_date <= to_date,
+        SalesInvoice.status.notin_(EXCLUDED_STATUSES)
+    )
+    if customer_id:
+        lines = lines.where(SalesInvoice.customer_id == customer_id)
+    if item_codes is not None:
+        lines = lines.where(SalesInvoiceItem.item_code.in_(item_codes))
+    lines = lines.cte("gross_profit_lines")
+
+    def issue_costs(voucher_type: str, detail_column):
+        return select(
+            StockLedgerEntry.voucher_detail_no,
+            (func.sum(-StockLedgerEntry.stock_value_difference)
+             / func.nullif(func.sum(-StockLedgerEntry.actual_qty), 0)).label('unit_cost')
+        ).where(
+            StockLedgerEntry.voucher_type == voucher_type,
+            StockLedgerEntry.voucher_detail_no.in_(select(detail_column))
+        ).group_by(StockLedgerEntry.voucher_detail_no).subquery()
+
+    invoice_issues = issue_costs("Sales Invoice", lines.c.id)
+    order_issues = issue_costs("Sales Order", lines.c.sales_order_item_id)
+
+    last_rate = select(StockLedgerEntry.valuation_rate).where(
+        StockLedgerEntry.item_code == lines.c.item_code,
+        StockLedgerEntry.posting_date <= lines.c.posting_date
+    ).order_by(
+        StockLedgerEntry.posting_date.desc(),
+        StockLedgerEntry.posting_time.desc(),
+        StockLedgerEntry.id.desc()
+    ).limit(1).scalar_subquery()
+
+    # coalesce stops at the first linked cost, so the fallback lookup only
+    # runs for unlinked lines
+    unit_cost = func.coalesce(invoice_issues.c.unit_cost, order_issues.c.unit_cost, last_rate, 0.0)
+
+    return select(
+        lines.c.sales_invoice_id,
+        lines.c.customer_id,
+        lines.c.posting_date,
+        lines.c.item_code,
+        func.coalesce(lines.c.qty, 0.0).label('qty'),
+        func.coalesce(lines.c.amount, 0.0).label('selling_amount'),
+        (func.coalesce(lines.c.qty, 0.0) * unit_cost).label('buying_amount')
+    ).select_from(lines).outerjoin(
+        invoice_issues, invoice_issues.c.voucher_detail_no == lines.c.id
+    ).outerjoin(
+        order_issues, order_issues.c.voucher_detail_no == lines.c.sales_order_item_id
+    ).subquery()
+
+
+def build_gross_profit_period(db: Session, period_end: date) -> int:
+    """
+    Cache the gross profit of a completed month per item and customer with
+    one grouped INSERT ... SELECT and mark the month as cached.
+    Does not commit - the caller commits. Returns the number of rows written.
+    """
+    line_costs = get_line_costs(period_end.replace(day=1), period_end)
+    result = db.execute(
+        insert(GrossProfitSummary).from_select(
+            ['period_end', 'item_code', 'customer_id', 'qty', 'selling_amount', 'buying_amount'],
+            select(
+                literal(period_end),
+                line_costs.c.item_code,
+                line_costs.c.customer_id,
+                func.sum(line_costs.c.qty),
+                func.sum(line_costs.c.selling_amount),
+                func.sum(line_costs.c.buying_amount)
+            ).group_by(line_costs.c.item_code, line_costs.c.customer_id)
+        )
+    )
+    db.add(GrossProfitPeriod(period_end=period_end))
+    db.flush()
+    return result.rowcount
+
+
+def invalidate_gross_profit(db: Session, posting_date: date):
+    """
+    Drop the cached months on or after a posting that changes sales or their
+    cost (back-dated invoices, issues and reposts). The next report rebuilds
+    them. Does not commit - the caller commits.
+    """
+    # Postings are normally in the open month, skip the delete then
+    if not db.query(GrossProfitPeriod.id).filter(GrossProfitPeriod.period_end >= posting_date).first():
+        return
+
+    db.query(GrossProfitSummary).filter(
+        GrossProfitSummary.period_end >= posting_date
+    ).delete(synchronize_session=False)
+    db.query(GrossProfitPeriod).filter(
+        GrossProfitPeriod.period_end >= posting_date
+    ).delete(synchronize_session=False)
+
+
+def _cached_months(db: Session, from_date: date, to_date: date) -> List[date]:
+    """
+    Month ends of the completed months that lie wholly inside the range,
+    building the missing ones (one commit per month).
+    """
+    first_open_day = date.today().replace(day=1)
+    months = []
+    period_end = month_end(from_date)
+    if from_date.day != 1:
+        period_end = month_end(period_end + timedelta(days=1))
+    while period_end <= to_date and period_end < first_open_day:
+        months.append(period_end)
+        period_end = month_end(period_end + timedelta(days=1))
+    if not months:
+        return months
+
+    built = {
+        period_end for (period_end,) in db.query(GrossProfitPeriod.period_end).filter(
+            GrossProfitPeriod.period_end.in_(months)
+        ).all()
+    }
+    for period_end in months:
+        if period_end not in built:
+            build_gross_profit_period(db, period_end)
+            db.commit()
+    return months
+
+
+def get_gross_profit(
+    db: Session,
+    from_date: date,
+    to_date: date,
+    group_by: str = "item",
+    customer_id: Optional[int] = None,
+    item_code: Optional[str] = None,
+    item_group_ids: Optional[List[int]] = None
+) -> List[dict]:
+    """
+    Gross profit of the invoices posted in a date range, grouped by item,
+    customer, item and customer, item group or invoice.
+
+    Completed months wholly inside the range are read from the monthly cache
+    (built on first use); only the open days at either end are costed from
+    the ledger, in one grouped query. Invoice grouping is always costed live.
+    Returns one row per group with qty, selling_amount, buying_amount,
+    gross_profit and gross_profit_percent.
+    """
+    from models import Item
+
+    keys = GROUP_BY_KEYS.get(group_by)
+    if not keys:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(GROUP_BY_KEYS)}")
+    if to_date < from_date:
+        raise HTTPException(status_code=400, detail="to_date must be on or after from_date")
+
+    item_codes = None
+    if item_code:
+        item_codes = [item_code]
+    if item_group_ids is not None:
+        group_items = select(Item.item_code).where(Item.item_group_id.in_(item_group_ids))
+        item_codes = group_items.where(Item.item_code == item_code) if item_code else group_items
+
+    months = _cached_months(db, from_date, to_date) if group_by != "invoice" else []
+
+    # The live ranges are the days outside the cached months
+    live_ranges = []
+    if months:
+        if from_date < months[0].replace(day=1):
+            live_ranges.append((from_date, months[0].replace(day=1) - timedelta(days=1)))
+        if months[-1] < to_date:
+            live_ranges.append((months[-1] + timedelta(days=1), to_date))
+    else:
+        live_ranges.append((from_date, to_date))
+
+    totals: Dict[tuple, list] = {}
+
+    def collect(statement, columns):
+        """Group a (qty, selling, buying) aggregate by the report keys and add it to the totals"""
+        if group_by == "item_group":
+            group = [Item.item_group_id]
+            statement = statement.outerjoin(Item, Item.item_code == columns.item_code)
+        else:
+            group = [columns[key] for key in keys]
+        for row in db.execute(statement.add_columns(*group).group_by(*group)).all():
+            total = totals.setdefault(tuple(row[3:]), [0.0, 0.0, 0.0])
+            for index in range(3):
+                total[index] += row[index] or 0.0
+
+    for start, end in live_ranges:
+        line_costs = get_line_costs(start, end, customer_id, item_codes)
+        statement = select(
+            func.sum(line_costs.c.qty),
+            func.sum(line_costs.c.selling_amount),
+            func.sum(line_costs.c.buying_amount)
+        ).select_from(line_costs)
+        collect(statement, line_costs.c)
+
+    if months:
+        summary = GrossProfitSummary.__table__
+        statement = select(
+            func.sum(summary.c.qty),
+            func.sum(summary.c.selling_amount),
+            func.sum(summary.c.buying_amount)
+        ).select_from(summary).where(summary.c.period_end.in_(months))
+        if customer_id:
+            statement = statement.where(summary.c.customer_id == customer_id)
+        if item_codes is not None:
+            statement = statement.where(summary.c.item_code.in_(item_codes))
+        collect(statement, summary.c)
+
+    results = []
+    for key in sorted(totals, key=lambda key: tuple((value is None, value) for value in key)):
+        qty, selling_amount, buying_amount = totals[key]
+        gross_profit = selling_amount - buying_amount
+        row = dict(zip(keys, key))
+        row.update({
+            "qty": qty,
+            "selling_amount": selling_amount,
+            "buying_amount": buying_amount,
+            "gross_profit": gross_profit,
+            "gross_profit_percent": gross_profit / selling_amount * 100 if selling_amount else 0.0
+        })
+        results.append(row)
+    return results
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, DateTime, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -8,7 +9,7 @@ class SalesInvoice(Base):
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
     sales_order_id = Column(Integer, ForeignKey("sales_orders.id"), nullable=True)
-    posting_date = Column(Date)
+    posting_date = Column(Date, index=True)
     due_date = Column(Date, nullable=True)
     total_amount = Column(Float, default=0.0)
     total_taxes_and_charges = Column(Float, default=0.0)
@@ -25,10 +26,34 @@ class SalesInvoiceItem(Base):
     __tablename__ = "sales_invoice_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    sales_invoice_id = Column(Integer, ForeignKey("sales_invoices.id"))
+    sales_invoice_id = Column(Integer, ForeignKey("sales_invoices.id"), index=True)
+    sales_order_item_id = Column(Integer, ForeignKey("sales_order_items.id"), nullable=True, index=True) # Order line billed
     item_code = Column(String)
     qty = Column(Float)
     rate = Column(Float)
     amount = Column(Float)
 
     sales_invoice = relationship("SalesInvoice", back_populates="items")
+
+class GrossProfitPeriod(Base):
+    """A completed month whose gross profit summary is cached"""
+    __tablename__ = "gross_profit_periods"
+
+    id = Column(Integer, primary_key=True, index=True)
+    period_end = Column(Date, unique=True, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class GrossProfitSummary(Base):
+    """Sales and cost of goods sold per item and customer for a cached month"""
+    __tablename__ = "gross_profit_summaries"
+    __table_args__ = (
+        UniqueConstraint("period_end", "item_code", "customer_id", name="uq_gross_profit_summary"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    period_end = Column(Date, nullable=False, index=True)
+    item_code = Column(String, nullable=False, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=True, index=True)
+    qty = Column(Float, default=0.0)
+    selling_amount = Column(Float, default=0.0)
+    buying_amount = Column(Float, default=0.0)
@@ -7,6 +7,7 @@ class SalesInvoiceItemBase(BaseModel):
     qty: float
     rate: float
     amount: float
+    sales_order_item_id: Optional[int] = None
 
 class SalesInvoiceItemCreate(SalesInvoiceItemBase):
     pass
@@ -39,3 +40,15 @@ class SalesInvoice(SalesInvoiceBase):
 
     class Config:
         from_attributes = True
+
+class GrossProfit(BaseModel):
+    item_code: Optional[str] = None
+    customer_id: Optional[int] = None
+    item_group_id: Optional[int] = None
+    sales_invoice_id: Optional[int] = None
+    posting_date: Optional[date] = None
+    qty: float
+    selling_amount: float
+    buying_amount: float
+    gross_profit: float
+    gross_profit_percent: float
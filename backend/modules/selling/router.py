@@ -1,4 +1,5 @@
-from typing import List, Dict, Any
+from datetime import date
+from typing import List, Dict, Any, Optional
 from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from database import SessionLocal
@@ -10,6 +11,7 @@ from . import models, schemas
 from . import invoice_schemas
 from utils.pdf_generator import generate_pdf
 from modules.setup.models import Company
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/selling",
@@ -99,12 +101,14 @@ def create_customer(
 
 @router.get("/customers/", response_model=List[schemas.Customer])
 def read_customers(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    customers = db.query(models.Customer).offset(skip).limit(limit).all()
+    customers = paginate(db.query(models.Customer), response, [models.Customer.id], skip, limit, cursor)
     return customers
 
 @router.post("/orders/", response_model=schemas.SalesOrder)
@@ -161,15 +165,15 @@ def create_sales_order(
 
 @router.get("/orders/", response_model=List[schemas.SalesOrder])
 def read_sales_orders(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all sales orders"""
-    orders = db.query(models.SalesOrder).order_by(
-        models.SalesOrder.transaction_date.desc()
-    ).offset(skip).limit(limit).all()
+    orders = paginate(db.query(models.SalesOrder), response, [models.SalesOrder.transaction_date, models.SalesOrder.id], skip, limit, cursor, descending=True)
     return orders
 
 
@@ -206,11 +210,13 @@ def submit_sales_order(
     if not order.items:
         raise HTTPException(status_code=400, detail="Order must have at least one item")
     
+    # Reserve the ordered qty until it is delivered (committed with the submit)
+    from modules.stock.availability_utils import update_bin_qty, order_item_changes
+    update_bin_qty(db, order_item_changes(order.items, "reserved_qty"))
+    
     # Submit the document
     submit_document(db, order, current_user.id)
     
-    # TODO: Create stock reservation or other business logic here
-    
     return {"message": "Sales Order submitted successfully", "status": order.status}
 
 @router.post("/orders/{order_id}/make-delivery")
@@ -231,17 +237,24 @@ def make_delivery_note(
 
     # 2. Create Stock Entry (Material Issue) with Ledger
     from modules.stock.router import create_stock_entry_with_ledger
-    
+    from modules.stock.availability_utils import update_bin_qty, order_item_changes, ORDER_WAREHOUSE
+    from modules.stock.batch_utils import allocate_batch_items
+
+    # Batch-tracked items are picked first expiry first out, one line per batch.
+    # Each issue points at its order line, invoices of the order take their cost from it
+    lines = allocate_batch_items(db, [{
+        'item_code': item.item_code,
+        'qty': item.qty,
+        'basic_rate': item.rate,
+        'voucher_detail_no': item.id
+    } for item in order.items], ORDER_WAREHOUSE, order.transaction_date)
+
     stock_entry_data = {
         'transaction_date': order.transaction_date,
         'purpose': "Material Issue",
         'voucher_type': "Sales Order",
-        'warehouse': "Stores", # Default to Stores for now
-        'items': [{
-            'item_code': item.item_code,
-            'qty': item.qty,
-            'basic_rate': item.rate
-        } for item in order.items]
+        'warehouse': ORDER_WAREHOUSE,
+        'items': lines
     }
     stock_entry = create_stock_entry_with_ledger(db, stock_entry_data)
     
@@ -260,34 +273,38 @@ def make_delivery_note(
     db.commit()
     db.refresh(delivery_note)
 
-    for item in order.items:
+    for line in lines:
         dn_item = DeliveryNoteItem(
             delivery_note_id=delivery_note.id,
-            item_code=item.item_code,
-            qty=item.qty,
-            rate=item.rate,
-            amount=item.amount
+            item_code=line['item_code'],
+            qty=line['qty'],
+            rate=line['basic_rate'],
+            amount=line['qty'] * line['basic_rate'],
+            batch_no=line.get('batch_no')
         )
         db.add(dn_item)
     
-    # 4. Update Order Status
+    # 4. Update Order Status and release the reservation, unless invoicing
+    # already issued the stock and released it
     order.delivery_status = "Fully Delivered"
+    if order.billing_status != "Fully Billed":
+        update_bin_qty(db, order_item_changes(order.items, "reserved_qty", sign=-1))
     db.commit()
     
     return {"message": "Delivery Note created", "stock_entry_id": stock_entry.id, "delivery_note_id": delivery_note.id}
 
 @router.get("/delivery-notes/", response_model=List[Dict[str, Any]])
 def read_delivery_notes(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all delivery notes"""
     from .delivery_models import DeliveryNote
-    notes = db.query(DeliveryNote).order_by(
-        DeliveryNote.posting_date.desc()
-    ).offset(skip).limit(limit).all()
+    notes = paginate(db.query(DeliveryNote), response, [DeliveryNote.posting_date, DeliveryNote.id], skip, limit, cursor, descending=True)
     return [{
         "id": note.id,
         "name": note.name,
@@ -341,15 +358,18 @@ def make_sales_invoice(
     db.commit()
     db.refresh(invoice)
 
+    invoice_items = []
     for item in order.items:
         invoice_item = SalesInvoiceItem(
             sales_invoice_id=invoice.id,
+            sales_order_item_id=item.id,
             item_code=item.item_code,
             qty=item.qty,
             rate=item.rate,
             amount=item.amount
         )
         db.add(invoice_item)
+        invoice_items.append(invoice_item)
     
     # 3. Create Journal Entry (for accounting)
     from modules.accounts.models import JournalEntry, JournalEntryAccount
@@ -404,24 +424,33 @@ def make_sales_invoice(
     # Ideally, we should have an "Update Stock" checkbox.
     if order.delivery_status == "Not Delivered":
         from modules.stock.router import create_stock_entry_with_ledger
+        from modules.stock.availability_utils import update_bin_qty, order_item_changes, ORDER_WAREHOUSE
         
         stock_entry_data = {
             'transaction_date': order.transaction_date,
             'purpose': "Material Issue",
             'voucher_type': "Sales Invoice", # Use Invoice as voucher type
-            'warehouse': "Stores",
+            'warehouse': ORDER_WAREHOUSE,
             'items': [{
                 'item_code': item.item_code,
                 'qty': item.qty,
-                'basic_rate': item.rate
-            } for item in order.items]
+                'basic_rate': item.rate,
+                'voucher_detail_no': item.id # Costs the invoice line in the gross profit report
+            } for item in invoice_items]
         }
         create_stock_entry_with_ledger(db, stock_entry_data)
+        # The stock has left, so the reservation goes with it
+        update_bin_qty(db, order_item_changes(order.items, "reserved_qty", sign=-1))
         # We mark as delivered implicitly for stock purposes, but let's keep delivery_status tracking physical delivery.
         # In strict ERP, we might update delivery_status only if we create a Delivery Note.
         # Here, let's say if you invoice without delivery, you still need to deliver physically, but stock is out (e.g. POS).
         # For now, let's NOT update order.delivery_status to avoid confusion with Delivery Note flow.
 
+    else:
+        # Invoicing a delivered order into a cached month
+        from .gross_profit_utils import invalidate_gross_profit
+        invalidate_gross_profit(db, order.transaction_date)
+
     # 5. Update Order Status
     order.billing_status = "Fully Billed"
     if order.delivery_status == "Fully Delivered":
@@ -470,11 +499,33 @@ def create_sales_invoice(invoice: invoice_schemas.SalesInvoiceCreate, db: Sessio
             **item_data.dict()
         )
         db.add(db_item)
+
+    if db_invoice.status not in ("Draft", "Cancelled"):
+        from .gross_profit_utils import invalidate_gross_profit
+        invalidate_gross_profit(db, db_invoice.posting_date)
     
     db.commit()
     db.refresh(db_invoice)
     return db_invoice
 
+@router.get("/reports/gross-profit", response_model=List[invoice_schemas.GrossProfit], response_model_exclude_none=True)
+def get_gross_profit_report(
+    from_date: date,
+    to_date: date,
+    group_by: str = "item",
+    customer_id: Optional[int] = None,
+    item_code: Optional[str] = None,
+    item_group_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Gross profit of invoiced sales against their cost of goods sold, grouped by item, customer, item_customer, item_group or invoice"""
+    from .gross_profit_utils import get_gross_profit
+    from modules.stock.ageing_utils import get_item_group_subtree_ids
+
+    item_group_ids = get_item_group_subtree_ids(db, item_group_id) if item_group_id else None
+    return get_gross_profit(db, from_date, to_date, group_by, customer_id, item_code, item_group_ids)
+
 # Import Return Logic
 from .return_logic import create_sales_return, submit_sales_return
 
@@ -487,9 +538,9 @@ def submit_return_endpoint(invoice_id: int, db: Session = Depends(get_db)):
     return submit_sales_return(invoice_id, db)
 
 @router.get("/invoices/", response_model=List[invoice_schemas.SalesInvoice])
-def read_sales_invoices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_sales_invoices(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
     from .invoice_models import SalesInvoice
-    invoices = db.query(SalesInvoice).offset(skip).limit(limit).all()
+    invoices = paginate(db.query(SalesInvoice), response, [SalesInvoice.id], skip, limit, cursor)
     return invoices
 
 @router.get("/invoices/{invoice_id}", response_model=invoice_schemas.SalesInvoice)
@@ -555,8 +606,8 @@ def create_quotation(
     return db_quotation
 
 @router.get("/quotations/", response_model=List[schemas.Quotation])
-def read_quotations(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.Quotation).offset(skip).limit(limit).all()
+def read_quotations(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.Quotation), response, [models.Quotation.id], skip, limit, cursor)
 
 @router.post("/quotations/{quotation_id}/submit")
 def submit_quotation(
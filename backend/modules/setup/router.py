@@ -1,13 +1,14 @@
 """
 Setup Module Router
 """
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from core.auth import get_current_active_user
 from models import User
 from . import models, schemas
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/setup",
@@ -39,13 +40,15 @@ def create_company(
 
 @router.get("/companies/", response_model=List[schemas.Company])
 def read_companies(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all companies"""
-    companies = db.query(models.Company).offset(skip).limit(limit).all()
+    companies = paginate(db.query(models.Company), response, [models.Company.id], skip, limit, cursor)
     return companies
 
 
@@ -79,13 +82,15 @@ def create_fiscal_year(
 
 @router.get("/fiscal-years/", response_model=List[schemas.FiscalYear])
 def read_fiscal_years(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all fiscal years"""
-    fiscal_years = db.query(models.FiscalYear).offset(skip).limit(limit).all()
+    fiscal_years = paginate(db.query(models.FiscalYear), response, [models.FiscalYear.id], skip, limit, cursor)
     return fiscal_years
 
 
@@ -106,13 +111,15 @@ def create_currency(
 
 @router.get("/currencies/", response_model=List[schemas.Currency])
 def read_currencies(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all currencies"""
-    currencies = db.query(models.Currency).offset(skip).limit(limit).all()
+    currencies = paginate(db.query(models.Currency), response, [models.Currency.id], skip, limit, cursor)
     return currencies
 
 
@@ -133,13 +140,15 @@ def create_cost_center(
 
 @router.get("/cost-centers/", response_model=List[schemas.CostCenter])
 def read_cost_centers(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all cost centers"""
-    cost_centers = db.query(models.CostCenter).offset(skip).limit(limit).all()
+    cost_centers = paginate(db.query(models.CostCenter), response, [models.CostCenter.id], skip, limit, cursor)
     return cost_centers
 
 
@@ -160,13 +169,15 @@ def create_item_group(
 
 @router.get("/item-groups/", response_model=List[schemas.ItemGroup])
 def read_item_groups(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all item groups"""
-    item_groups = db.query(models.ItemGroup).offset(skip).limit(limit).all()
+    item_groups = paginate(db.query(models.ItemGroup), response, [models.ItemGroup.id], skip, limit, cursor)
     return item_groups
 
 
@@ -187,13 +198,15 @@ def create_customer_group(
 
 @router.get("/customer-groups/", response_model=List[schemas.CustomerGroup])
 def read_customer_groups(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all customer groups"""
-    customer_groups = db.query(models.CustomerGroup).offset(skip).limit(limit).all()
+    customer_groups = paginate(db.query(models.CustomerGroup), response, [models.CustomerGroup.id], skip, limit, cursor)
     return customer_groups
 
 
@@ -214,13 +227,15 @@ def create_supplier_group(
 
 @router.get("/supplier-groups/", response_model=List[schemas.SupplierGroup])
 def read_supplier_groups(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all supplier groups"""
-    supplier_groups = db.query(models.SupplierGroup).offset(skip).limit(limit).all()
+    supplier_groups = paginate(db.query(models.SupplierGroup), response, [models.SupplierGroup.id], skip, limit, cursor)
     return supplier_groups
 
 
@@ -240,11 +255,13 @@ def create_price_list(
 
 @router.get("/price-lists/", response_model=List[schemas.PriceList])
 def read_price_lists(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all price lists"""
-    price_lists = db.query(models.PriceList).offset(skip).limit(limit).all()
+    price_lists = paginate(db.query(models.PriceList), response, [models.PriceList.id], skip, limit, cursor)
     return price_lists
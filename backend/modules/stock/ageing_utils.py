@@ -0,0 +1,153 @@
+"""
+Stock Ageing Utilities
+Age of the stock on hand per item and warehouse, from one streaming FIFO
+pass over the stock ledger
+"""
+from collections import deque
+from datetime import date
+from typing import Iterator, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+from .models import StockLedgerEntry
+from .valuation_utils import PRECISION
+
+# Upper bounds (in days) of the ageing ranges; stock older than the last is in the open range
+AGEING_RANGES = (30, 60, 90)
+AGEING_LABELS = ("0_30", "31_60", "61_90", "90_plus")
+
+# Ledger rows fetched per round trip from the server-side cursor
+AGEING_BATCH_SIZE = 5000
+
+
+def get_item_group_subtree_ids(db: Session, item_group_id: int) -> List[int]:
+    """Ids of an item group and all groups below it"""
+    from modules.setup.models import ItemGroup
+
+    children = {}
+    for group_id, parent_id in db.query(ItemGroup.id, ItemGroup.parent_item_group_id).all():
+        children.setdefault(parent_id, []).append(group_id)
+
+    subtree = [item_group_id]
+    for group_id in subtree:
+        subtree.extend(children.get(group_id, []))
+    return subtree
+
+
+def _age_bucket(age: int) -> int:
+    for index, upper in enumerate(AGEING_RANGES):
+        if age <= upper:
+            return index
+    return len(AGEING_RANGES)
+
+
+def _ageing_row(item_code: str, warehouse: str, queue: deque, rate: float, as_of: date) -> Optional[dict]:
+    """Summarize one key's remaining receipts, None when nothing is on hand"""
+    qty = sum(batch_qty for batch_qty, _ in queue)
+    if qty <= PRECISION:
+        return None
+
+    bucket_qty = [0.0] * len(AGEING_LABELS)
+    weighted_age = 0.0
+    for batch_qty, received in queue:
+        age = (as_of - received).days
+        bucket_qty[_age_bucket(age)] += batch_qty
+        weighted_age += batch_qty * age
+
+    row = {
+        "item_code": item_code,
+        "warehouse": warehouse,
+        "qty": qty,
+        "valuation_rate": rate,
+        "stock_value": qty * rate,
+        "average_age": weighted_age / qty,
+        "oldest_age": (as_of - queue[0][1]).days,
+    }
+    for label, bucket in zip(AGEING_LABELS, bucket_qty):
+        row[f"qty_{label}"] = bucket
+        row[f"value_{label}"] = bucket * rate
+    return row
+
+
+def iter_stock_ageing(
+    db: Session,
+    as_of: Optional[date] = None,
+    warehouses: Optional[List[str]] = None,
+    item_group_ids: Optional[List[int]] = None,
+    item_code: Optional[str] = None
+) -> Iterator[dict]:
+    """
+    Yield the ageing of the stock on hand per (item_code, warehouse) at the
+    end of as_of (default today).
+
+    The ledger is streamed with a server-side cursor ordered by item,
+    warehouse and posting order. Each key keeps a FIFO queue of
+    [qty, received date] receipts: inward rows append, outward rows consume
+    from the front, and stock issued beyond the queue is owed by the next
+    receipts. When the key changes its row is yielded and the queue dropped,
+    so memory is bounded by the largest single queue, not the ledger.
+    Values use the key's latest valuation rate.
+    """
+    from models import Item
+
+    as_of = as_of or date.today()
+    statement = select(
+        StockLedgerEntry.item_code,
+        StockLedgerEntry.warehouse,
+        StockLedgerEntry.posting_date,
+        StockLedgerEntry.actual_qty,
+        StockLedgerEntry.valuation_rate
+    ).where(StockLedgerEntry.posting_date <= as_of)
+    if warehouses is not None:
+        statement = statement.where(StockLedgerEntry.warehouse.in_(warehouses))
+    if item_group_ids is not None:
+        statement = statement.where(StockLedgerEntry.item_code.in_(
+            select(Item.item_code).where(Item.item_group_id.in_(item_group_ids))
+        ))
+    if item_code:
+        statement = statement.where(StockLedgerEntry.item_code == item_code)
+    statement = statement.order_by(
+        StockLedgerEntry.item_code,
+        StockLedgerEntry.warehouse,
+        StockLedgerEntry.posting_date,
+        StockLedgerEntry.posting_time,
+        StockLedgerEntry.id
+    ).execution_options(stream_results=True, yield_per=AGEING_BATCH_SIZE)
+
+    key = None
+    queue = deque()
+    owed = 0.0
+    rate = 0.0
+    for row_item, row_warehouse, posting_date, actual_qty, valuation_rate in db.execute(statement):
+        if (row_item, row_warehouse) != key:
+            if key:
+                summary = _ageing_row(key[0], key[1], queue, rate, as_of)
+                if summary:
+                    yield summary
+            key = (row_item, row_warehouse)
+            queue = deque()
+            owed = 0.0
+
+        rate = valuation_rate or 0.0
+        qty = actual_qty or 0.0
+        if qty > 0:
+            # Receipts first cover stock issued while the queue was empty
+            covered = min(qty, owed)
+            owed -= covered
+            if qty - covered > PRECISION:
+                queue.append([qty - covered, posting_date])
+        elif qty < 0:
+            to_consume = -qty
+            while to_consume > PRECISION and queue:
+                batch = queue[0]
+                if batch[0] <= to_consume + PRECISION:
+                    to_consume -= batch[0]
+                    queue.popleft()
+                else:
+                    batch[0] -= to_consume
+                    to_consume = 0.0
+            owed += max(to_consume, 0.0)
+
+    if key:
+        summary = _ageing_row(key[0], key[1], queue, rate, as_of)
+        if summary:
+            yield summary
@@ -0,0 +1,190 @@
+"""
+Stock Availability Utilities
+Ordered, reserved and planned quantities per item and warehouse, kept on the
+bins next to actual_qty. projected_qty is a generated column:
+actual + ordered + planned - reserved.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, func, update
+from typing import Dict, List, Optional, Tuple
+from .models import Bin
+from .bin_utils import get_bins
+
+# Sales orders are delivered from and purchase orders received into this
+# warehouse until orders carry their own
+ORDER_WAREHOUSE = "Stores"
+
+AVAILABILITY_FIELDS = ("ordered_qty", "reserved_qty", "planned_qty")
+
+
+def update_bin_qty(db: Session, changes: List[dict]):
+    """
+    Apply availability changes to bins in one statement.
+
+    changes format:
+    [
+        {"item_code": "ITEM-001", "warehouse": "Stores", "reserved_qty": 5.0},
+        {"item_code": "ITEM-002", "warehouse": "Stores", "ordered_qty": -2.0},
+        ...
+    ]
+
+    Changes for the same pair are summed. Quantities are added in SQL
+    (qty = qty + change), so concurrent transitions on the same bin do not
+    overwrite each other. Missing bins are created first.
+    Does not commit - the caller commits.
+    """
+    totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+    for change in changes:
+        key = (change["item_code"], change["warehouse"])
+        total = totals.setdefault(key, dict.fromkeys(AVAILABILITY_FIELDS, 0.0))
+        for field in AVAILABILITY_FIELDS:
+            total[field] += change.get(field) or 0.0
+
+    totals = {key: total for key, total in totals.items() if any(total.values())}
+    if not totals:
+        return
+
+    bins = get_bins(db, totals)
+    table = Bin.__table__
+    db.execute(
+        update(table)
+        .where(table.c.id == bindparam("bin_id"))
+        .values({
+            field: func.coalesce(table.c[field], 0.0) + bindparam(field)
+            for field in AVAILABILITY_FIELDS
+        }),
+        [{"bin_id": bins[key].id, **total} for key, total in totals.items()]
+    )
+
+    # The loaded bins no longer match the table for these columns
+    for key in totals:
+        db.expire(bins[key], list(AVAILABILITY_FIELDS) + ["projected_qty"])
+
+
+def order_item_changes(items, field: str, sign: float = 1.0, warehouse: str = ORDER_WAREHOUSE) -> List[dict]:
+    """Availability changes for the item lines of a sales or purchase order"""
+    return [
+        {"item_code": item.item_code, "warehouse": warehouse, field: sign * (item.qty or 0.0)}
+        for item in items
+    ]
+
+
+def work_order_changes(wo, sign: float = 1.0, planned: bool = True, materials: bool = True) -> List[dict]:
+    """
+    Availability changes for a work order: the quantity still to manufacture
+    is planned in the finished goods warehouse and the required materials are
+    reserved in their source warehouse until they are transferred to WIP.
+    """
+    changes = []
+    if planned:
+        changes.append({
+            "item_code": wo.production_item,
+            "warehouse": wo.fg_warehouse,
+            "planned_qty": sign * ((wo.qty_to_manufacture or 0.0) - (wo.qty_manufactured or 0.0))
+        })
+    if materials:
+        changes.extend(
+            {
+                "item_code": material.item_code,
+                "warehouse": material.source_warehouse or wo.warehouse,
+                "reserved_qty": sign * (material.required_qty or 0.0)
+            }
+            for material in wo.material_requests
+        )
+    return changes
+
+
+def get_availability(
+    db: Session,
+    item_codes: List[str],
+    warehouses: Optional[List[str]] = None,
+    per_warehouse: bool = True
+) -> List[dict]:
+    """
+    Availability for many items with one query over bins, per warehouse or
+    summed over warehouses. Items without a bin are returned with zeros.
+    """
+    columns = [
+        func.coalesce(func.sum(Bin.actual_qty), 0.0).label("actual_qty"),
+        func.coalesce(func.sum(Bin.ordered_qty), 0.0).label("ordered_qty"),
+        func.coalesce(func.sum(Bin.reserved_qty), 0.0).label("reserved_qty"),
+        func.coalesce(func.sum(Bin.planned_qty), 0.0).label("planned_qty"),
+        func.coalesce(func.sum(Bin.projected_qty), 0.0).label("projected_qty"),
+    ]
+    group_by = [Bin.item_code, Bin.warehouse] if per_warehouse else [Bin.item_code]
+
+    query = db.query(*group_by, *columns).filter(Bin.item_code.in_(item_codes))
+    if warehouses:
+        query = query.filter(Bin.warehouse.in_(warehouses))
+
+    rows = [
+        dict(row._mapping, warehouse=row.warehouse if per_warehouse else None)
+        for row in query.group_by(*group_by).order_by(*group_by).all()
+    ]
+
+    found = {row["item_code"] for row in rows}
+    rows.extend(
+        {
+            "item_code": item_code, "warehouse": None, "actual_qty": 0.0, "ordered_qty": 0.0,
+            "reserved_qty": 0.0, "planned_qty": 0.0, "projected_qty": 0.0
+        }
+        for item_code in dict.fromkeys(item_codes) if item_code not in found
+    )
+    return rows
+
+
+def rebuild_availability(db: Session) -> int:
+    """
+    Recompute ordered, reserved and planned quantities of all bins from the
+    open purchase orders, sales orders and work orders, with one grouped
+    query per document type. Does not commit - the caller commits.
+    Returns the number of bins with availability.
+    """
+    from modules.buying.models import PurchaseOrder, PurchaseOrderItem
+    from modules.selling.models import SalesOrder, SalesOrderItem
+    from modules.manufacturing.models import WorkOrder, WorkOrderMaterial
+
+    changes = []
+    for item_code, qty in db.query(
+        PurchaseOrderItem.item_code, func.sum(PurchaseOrderItem.qty)
+    ).join(PurchaseOrder).filter(
+        PurchaseOrder.status == "Submitted",
+        PurchaseOrder.receipt_status != "Fully Received"
+    ).group_by(PurchaseOrderItem.item_code).all():
+        changes.append({"item_code": item_code, "warehouse": ORDER_WAREHOUSE, "ordered_qty": qty})
+
+    for item_code, qty in db.query(
+        SalesOrderItem.item_code, func.sum(SalesOrderItem.qty)
+    ).join(SalesOrder).filter(
+        SalesOrder.docstatus == 1,
+        SalesOrder.delivery_status != "Fully Delivered",
+        SalesOrder.billing_status != "Fully Billed" # Invoicing an undelivered order issues its stock
+    ).group_by(SalesOrderItem.item_code).all():
+        changes.append({"item_code": item_code, "warehouse": ORDER_WAREHOUSE, "reserved_qty": qty})
+
+    for item_code, warehouse, qty in db.query(
+        WorkOrder.production_item,
+        WorkOrder.fg_warehouse,
+        func.sum(WorkOrder.qty_to_manufacture - func.coalesce(WorkOrder.qty_manufactured, 0.0))
+    ).filter(
+        WorkOrder.status.in_(("Draft", "In Progress"))
+    ).group_by(WorkOrder.production_item, WorkOrder.fg_warehouse).all():
+        changes.append({"item_code": item_code, "warehouse": warehouse, "planned_qty": qty})
+
+    source_warehouse = func.coalesce(WorkOrderMaterial.source_warehouse, WorkOrder.warehouse)
+    for item_code, warehouse, qty in db.query(
+        WorkOrderMaterial.item_code, source_warehouse, func.sum(WorkOrderMaterial.required_qty)
+    ).join(WorkOrder).filter(
+        WorkOrder.status == "Draft"
+    ).group_by(WorkOrderMaterial.item_code, source_warehouse).all():
+        changes.append({"item_code": item_code, "warehouse": warehouse, "reserved_qty": qty})
+
+    db.query(Bin).update(
+        dict.fromkeys(AVAILABILITY_FIELDS, 0.0), synchronize_session=False
+    )
+    update_bin_qty(db, changes)
+    db.expire_all()
+
+    return db.query(func.count(Bin.id)).filter(
+        (Bin.ordered_qty != 0) | (Bin.reserved_qty != 0) | (Bin.planned_qty != 0)
+    ).scalar() or 0
@@ -0,0 +1,219 @@
+"""
+Batch Utilities
+Per-(item, warehouse, batch) balances kept by ledger postings and
+first-expiry-first-out batch allocation
+"""
+from datetime import date
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, bindparam, func, insert, select, tuple_, update
+from typing import Dict, List, Optional, Tuple
+from .models import StockLedgerEntry
+from .serial_batch_models import Batch, BatchBin
+from .valuation_utils import PRECISION
+
+
+def update_batch_bins(db: Session, rows: List[dict]):
+    """
+    Apply the batch quantities of ledger rows to the batch balances.
+    Existing balances are read with one query and the rows walked in order,
+    so an outward row may not take a batch below zero; the changes are then
+    written with one insert for new batches and one executemany increment
+    (qty = qty + change) for the rest.
+    Raises HTTPException 400 when a batch is short. Does not commit - the caller commits.
+    """
+    batch_rows = [row for row in rows if row.get('batch_no')]
+    if not batch_rows:
+        return
+
+    keys = {(row['item_code'], row['warehouse'], row['batch_no']) for row in batch_rows}
+    existing: Dict[Tuple[str, str, str], Tuple[int, float]] = {
+        (item_code, warehouse, batch_no): (batch_bin_id, actual_qty or 0.0)
+        for batch_bin_id, item_code, warehouse, batch_no, actual_qty in db.query(
+            BatchBin.id, BatchBin.item_code, BatchBin.warehouse, BatchBin.batch_no, BatchBin.actual_qty
+        ).filter(
+            tuple_(BatchBin.item_code, BatchBin.warehouse, BatchBin.batch_no).in_(keys)
+        ).all()
+    }
+
+    balances = {key: existing[key][1] if key in existing else 0.0 for key in keys}
+    changes = dict.fromkeys(keys, 0.0)
+    for row in batch_rows:
+        key = (row['item_code'], row['warehouse'], row['batch_no'])
+        if row['actual_qty'] < 0 and balances[key] + row['actual_qty'] < -PRECISION:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Batch {key[2]} of item {key[0]} has only {balances[key]:g} in warehouse {key[1]}"
+            )
+        balances[key] += row['actual_qty']
+        changes[key] += row['actual_qty']
+
+    new_rows = [
+        {'item_code': key[0], 'warehouse': key[1], 'batch_no': key[2], 'actual_qty': change}
+        for key, change in changes.items() if key not in existing
+    ]
+    if new_rows:
+        db.execute(insert(BatchBin), new_rows)
+
+    table = BatchBin.__table__
+    increments = [
+        {'batch_bin_id': existing[key][0], 'change': change}
+        for key, change in changes.items() if key in existing and change
+    ]
+    if increments:
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam('batch_bin_id'))
+            .values(actual_qty=func.coalesce(table.c.actual_qty, 0.0) + bindparam('change')),
+            increments
+        )
+
+
+def rebuild_batch_bins(db: Session) -> int:
+    """
+    Regenerate all batch balances from the stock ledger with one grouped
+    INSERT ... SELECT. Does not commit - the caller commits.
+    Returns the number of batch balances written.
+    """
+    db.query(BatchBin).delete(synchronize_session=False)
+    result = db.execute(
+        insert(BatchBin).from_select(
+            ['item_code', 'warehouse', 'batch_no', 'actual_qty'],
+            select(
+                StockLedgerEntry.item_code,
+                StockLedgerEntry.warehouse,
+                StockLedgerEntry.batch_no,
+                func.sum(StockLedgerEntry.actual_qty)
+            ).where(
+                StockLedgerEntry.batch_no.isnot(None),
+                StockLedgerEntry.batch_no != ""
+            ).group_by(
+                StockLedgerEntry.item_code,
+                StockLedgerEntry.warehouse,
+                StockLedgerEntry.batch_no
+            )
+        )
+    )
+    return result.rowcount
+
+
+def allocate_batches(
+    db: Session,
+    demands: List[dict],
+    posting_date: Optional[date] = None,
+    exclude_expired: bool = True
+) -> List[dict]:
+    """
+    Allocate batches to a list of demands, first expiry first out.
+
+    demands format:
+    [
+        {"item_code": "ITEM-001", "warehouse": "Stores", "qty": 10.0},
+        ...
+    ]
+
+    The batches in stock for every demanded item and warehouse are read with
+    one query, ordered by expiry (batches without expiry last), and the
+    demands are filled in one pass. Demands for the same item and warehouse
+    draw on the same batches, so repeated lines are not allocated twice.
+    Batches expired before posting_date (default today) are skipped.
+    Nothing is written. Returns one allocation per demand, in order:
+    {"item_code", "warehouse", "qty", "allocated_qty", "shortage",
+     "batches": [{"batch_no", "qty", "expiry_date"}]}
+    """
+    pairs = {(demand['item_code'], demand['warehouse']) for demand in demands}
+    available: Dict[Tuple[str, str], List[list]] = {pair: [] for pair in pairs}
+
+    if pairs:
+        query = db.query(
+            BatchBin.item_code,
+            BatchBin.warehouse,
+            BatchBin.batch_no,
+            BatchBin.actual_qty,
+            Batch.expiry_date
+        ).outerjoin(Batch, and_(
+            Batch.batch_id == BatchBin.batch_no,
+            Batch.item_code == BatchBin.item_code
+        )).filter(
+            tuple_(BatchBin.item_code, BatchBin.warehouse).in_(pairs),
+            BatchBin.actual_qty > PRECISION
+        )
+        if exclude_expired:
+            posting_date = posting_date or date.today()
+            query = query.filter(Batch.expiry_date.is_(None) | (Batch.expiry_date >= posting_date))
+
+        for item_code, warehouse, batch_no, qty, expiry_date in query.order_by(
+            BatchBin.item_code,
+            BatchBin.warehouse,
+            Batch.expiry_date.nulls_last(),
+            BatchBin.batch_no
+        ).all():
+            available[(item_code, warehouse)].append([batch_no, qty, expiry_date])
+
+    allocations = []
+    for demand in demands:
+        batches = available[(demand['item_code'], demand['warehouse'])]
+        remaining = demand['qty']
+        allocated = []
+        while remaining > PRECISION and batches:
+            batch = batches[0]
+            take = min(remaining, batch[1])
+            allocated.append({"batch_no": batch[0], "qty": take, "expiry_date": batch[2]})
+            remaining -= take
+            batch[1] -= take
+            if batch[1] <= PRECISION:
+                batches.pop(0)
+
+        remaining = max(remaining, 0.0)
+        allocations.append({
+            "item_code": demand['item_code'],
+            "warehouse": demand['warehouse'],
+            "qty": demand['qty'],
+            "allocated_qty": demand['qty'] - remaining,
+            "shortage": remaining,
+            "batches": allocated
+        })
+    return allocations
+
+
+def allocate_batch_items(db: Session, items: List[dict], warehouse: str, posting_date: Optional[date] = None) -> List[dict]:
+    """
+    Split outgoing voucher lines of batch-tracked items (Item.has_batch_no)
+    that do not name a batch into one line per batch, first expiry first out.
+    Other lines are returned unchanged. Raises HTTPException 400 when the
+    batches in the warehouse cannot cover a line.
+    """
+    from .item_utils import get_item_records
+
+    item_codes = {item['item_code'] for item in items if not item.get('batch_no')}
+    if not item_codes:
+        return items
+
+    batched = {
+        item_code for item_code, record in get_item_records(db, item_codes).items()
+        if record and record.has_batch_no
+    }
+    pending = [item for item in items if not item.get('batch_no') and item['item_code'] in batched]
+    if not pending:
+        return items
+
+    allocations = iter(allocate_batches(db, [
+        {"item_code": item['item_code'], "warehouse": warehouse, "qty": item['qty']}
+        for item in pending
+    ], posting_date=posting_date))
+
+    lines = []
+    for item in items:
+        if item.get('batch_no') or item['item_code'] not in batched:
+            lines.append(item)
+            continue
+
+        allocation = next(allocations)
+        if allocation['shortage'] > PRECISION:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Batches of item {item['item_code']} in warehouse {warehouse} "
+                       f"cover only {allocation['allocated_qty']:g} of {item['qty']:g}"
+            )
+        lines.extend(dict(item, qty=batch['qty'], batch_no=batch['batch_no']) for batch in allocation['batches'])
+    return lines
@@ -0,0 +1,165 @@
+"""
+Stock Bin Utilities
+Maintains the materialized per-(item, warehouse) balance in the bins table
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, select
+from typing import Optional
+from .models import Bin, StockLedgerEntry
+from .valuation_utils import MOVING_AVERAGE
+
+
+def latest_entry_ids(*filters):
+    """
+    Select the id of the latest ledger entry per (item_code, warehouse) in
+    posting order (posting_date, posting_time, id), so back-dated entries
+    with higher ids are not mistaken for the current balance.
+    """
+    ranked = select(
+        StockLedgerEntry.id,
+        func.row_number().over(
+            partition_by=(StockLedgerEntry.item_code, StockLedgerEntry.warehouse),
+            order_by=(
+                StockLedgerEntry.posting_date.desc(),
+                StockLedgerEntry.posting_time.desc(),
+                StockLedgerEntry.id.desc()
+            )
+        ).label('row_number')
+    ).where(*filters).subquery()
+
+    return select(ranked.c.id).where(ranked.c.row_number == 1)
+
+
+def get_bins(db: Session, pairs) -> dict:
+    """
+    Get bins for many (item_code, warehouse) pairs with one query.
+    Missing bins are seeded from the ledger with one more grouped query.
+    Returns {(item_code, warehouse): Bin}
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+
+    item_codes = {item_code for item_code, _ in pairs}
+    warehouses = {warehouse for _, warehouse in pairs}
+
+    bins = {}
+    for bin_doc in db.query(Bin).filter(
+        Bin.item_code.in_(item_codes),
+        Bin.warehouse.in_(warehouses)
+    ).all():
+        key = (bin_doc.item_code, bin_doc.warehouse)
+        if key in pairs:
+            bins[key] = bin_doc
+
+    missing = pairs - set(bins)
+    if not missing:
+        return bins
+
+    latest = latest_entry_ids(
+        StockLedgerEntry.item_code.in_({item_code for item_code, _ in missing}),
+        StockLedgerEntry.warehouse.in_({warehouse for _, warehouse in missing})
+    )
+
+    last_sles = {
+        (sle.item_code, sle.warehouse): sle
+        for sle in db.query(StockLedgerEntry).filter(StockLedgerEntry.id.in_(latest)).all()
+    }
+
+    rows = []
+    for item_code, warehouse in missing:
+        last_sle = last_sles.get((item_code, warehouse))
+        rows.append({
+            'item_code': item_code,
+            'warehouse': warehouse,
+            'actual_qty': last_sle.qty_after_transaction if last_sle else 0.0,
+            'valuation_rate': last_sle.valuation_rate if last_sle else 0.0,
+            'stock_value': last_sle.stock_value if last_sle else 0.0,
+            'stock_uom': last_sle.stock_uom if last_sle else "Nos",
+            'stock_queue': last_sle.stock_queue if last_sle else None
+        })
+
+    # One bulk insert and one read back instead of a unit of work per bin;
+    # the rows are in the transaction, so later lookups find them
+    db.execute(insert(Bin), rows)
+    for bin_doc in db.query(Bin).filter(
+        Bin.item_code.in_({item_code for item_code, _ in missing}),
+        Bin.warehouse.in_({warehouse for _, warehouse in missing})
+    ).all():
+        key = (bin_doc.item_code, bin_doc.warehouse)
+        if key in missing:
+            bins[key] = bin_doc
+
+    return bins
+
+
+def get_bin(
+    db: Session,
+    item_code: str,
+    warehouse: str,
+    create: bool = True
+) -> Optional[Bin]:
+    """
+    Get the bin for an item and warehouse.
+    A missing bin is created and seeded from the last ledger entry so that
+    databases populated before bins existed stay consistent.
+    """
+    if not create:
+        return db.query(Bin).filter(
+            Bin.item_code == item_code,
+            Bin.warehouse == warehouse
+        ).first()
+
+    return get_bins(db, [(item_code, warehouse)])[(item_code, warehouse)]
+
+
+def rebuild_bins(db: Session) -> int:
+    """
+    Regenerate all bins from the stock ledger.
+    Uses one set-based INSERT ... SELECT over the latest entry per item and warehouse
+    in posting order;
+    valuation methods chosen on existing bins are preserved, availability
+    is recomputed from open orders and batch balances from the ledger.
+    Returns the number of bins written.
+    """
+    methods = [
+        {'item_code': item_code, 'warehouse': warehouse, 'valuation_method': method}
+        for item_code, warehouse, method in db.query(
+            Bin.item_code, Bin.warehouse, Bin.valuation_method
+        ).filter(Bin.valuation_method != MOVING_AVERAGE).all()
+    ]
+
+    source = select(
+        StockLedgerEntry.item_code,
+        StockLedgerEntry.warehouse,
+        StockLedgerEntry.qty_after_transaction,
+        StockLedgerEntry.valuation_rate,
+        StockLedgerEntry.stock_value,
+        StockLedgerEntry.stock_uom,
+        StockLedgerEntry.stock_queue
+    ).where(StockLedgerEntry.id.in_(latest_entry_ids()))
+
+    db.query(Bin).delete(synchronize_session=False)
+    db.execute(
+        insert(Bin).from_select(
+            ['item_code', 'warehouse', 'actual_qty', 'valuation_rate', 'stock_value', 'stock_uom', 'stock_queue'],
+            source
+        )
+    )
+
+    for method in methods:
+        db.query(Bin).filter(
+            Bin.item_code == method['item_code'],
+            Bin.warehouse == method['warehouse']
+        ).update({'valuation_method': method['valuation_method']}, synchronize_session=False)
+
+    # Ordered/reserved/planned quantities do not come from the ledger
+    from .availability_utils import rebuild_availability
+    rebuild_availability(db)
+
+    from .batch_utils import rebuild_batch_bins
+    rebuild_batch_bins(db)
+
+    db.commit()
+
+    return db.query(func.count(Bin.id)).scalar() or 0
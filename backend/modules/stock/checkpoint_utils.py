@@ -0,0 +1,177 @@
+"""
+Stock Checkpoint Utilities
+Month-end balance checkpoints and as-of-date stock balances
+"""
+import calendar
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, func, insert, select, tuple_
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from .models import StockLedgerEntry, StockCheckpoint
+
+
+def month_end(day: date) -> date:
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def get_balances_as_of(
+    db: Session,
+    as_of: date,
+    warehouse: Optional[str] = None,
+    item_code: Optional[str] = None,
+    warehouses: Optional[List[str]] = None
+) -> Dict[Tuple[str, str], dict]:
+    """
+    Stock qty and value per (item_code, warehouse) at the end of a date.
+    Reads the nearest checkpoint on or before the date for each pair and adds
+    only the ledger movements after it - two grouped queries, no full scan.
+    Pairs without a checkpoint are summed from the start of the ledger.
+    Returns {(item_code, warehouse): {"qty": float, "value": float}}
+    """
+    cp_filters = [StockCheckpoint.period_end <= as_of]
+    sle_filters = [StockLedgerEntry.posting_date <= as_of]
+    if warehouse:
+        cp_filters.append(StockCheckpoint.warehouse == warehouse)
+        sle_filters.append(StockLedgerEntry.warehouse == warehouse)
+    if warehouses is not None:
+        cp_filters.append(StockCheckpoint.warehouse.in_(warehouses))
+        sle_filters.append(StockLedgerEntry.warehouse.in_(warehouses))
+    if item_code:
+        cp_filters.append(StockCheckpoint.item_code == item_code)
+        sle_filters.append(StockLedgerEntry.item_code == item_code)
+
+    nearest = select(
+        StockCheckpoint.item_code,
+        StockCheckpoint.warehouse,
+        func.max(StockCheckpoint.period_end).label('period_end')
+    ).where(*cp_filters).group_by(
+        StockCheckpoint.item_code,
+        StockCheckpoint.warehouse
+    ).subquery()
+
+    balances = {}
+    for checkpoint in db.query(StockCheckpoint).join(nearest, and_(
+        StockCheckpoint.item_code == nearest.c.item_code,
+        StockCheckpoint.warehouse == nearest.c.warehouse,
+        StockCheckpoint.period_end == nearest.c.period_end
+    )).all():
+        balances[(checkpoint.item_code, checkpoint.warehouse)] = {
+            "qty": checkpoint.qty or 0.0,
+            "value": checkpoint.stock_value or 0.0
+        }
+
+    delta = db.query(
+        StockLedgerEntry.item_code,
+        StockLedgerEntry.warehouse,
+        func.sum(StockLedgerEntry.actual_qty).label('qty'),
+        func.sum(StockLedgerEntry.stock_value_difference).label('value')
+    ).outerjoin(nearest, and_(
+        StockLedgerEntry.item_code == nearest.c.item_code,
+        StockLedgerEntry.warehouse == nearest.c.warehouse
+    )).filter(
+        *sle_filters,
+        or_(nearest.c.period_end.is_(None), StockLedgerEntry.posting_date > nearest.c.period_end)
+    ).group_by(
+        StockLedgerEntry.item_code,
+        StockLedgerEntry.warehouse
+    )
+
+    for row in delta.all():
+        balance = balances.setdefault((row.item_code, row.warehouse), {"qty": 0.0, "value": 0.0})
+        balance["qty"] += float(row.qty or 0.0)
+        balance["value"] += float(row.value or 0.0)
+
+    return balances
+
+
+def build_checkpoints(db: Session, period_end: date) -> int:
+    """
+    Write checkpoints for a period end for every pair that does not have one.
+    Does not commit - the caller commits. Returns the number of checkpoints written.
+    """
+    existing = {
+        (item_code, warehouse)
+        for item_code, warehouse in db.query(
+            StockCheckpoint.item_code, StockCheckpoint.warehouse
+        ).filter(StockCheckpoint.period_end == period_end).all()
+    }
+
+    rows = [
+        {
+            'item_code': item_code,
+            'warehouse': warehouse,
+            'period_end': period_end,
+            'qty': balance['qty'],
+            'stock_value': balance['value']
+        }
+        for (item_code, warehouse), balance in get_balances_as_of(db, period_end).items()
+        if (item_code, warehouse) not in existing
+    ]
+
+    if rows:
+        db.execute(insert(StockCheckpoint), rows)
+    return len(rows)
+
+
+def build_month_end_checkpoints(db: Session, up_to: Optional[date] = None) -> dict:
+    """
+    Checkpoint every completed month from the first ledger month to the month
+    before up_to (default today). Months are built in order so each one only
+    replays its own movements on top of the previous month-end; months that
+    are already complete write nothing.
+    """
+    up_to = up_to or date.today()
+    last_period_end = up_to.replace(day=1) - timedelta(days=1)
+
+    first_posting = db.query(func.min(StockLedgerEntry.posting_date)).scalar()
+    if not first_posting:
+        return {"periods": 0, "checkpoints": 0}
+
+    periods = 0
+    written = 0
+    period_end = month_end(first_posting)
+    while period_end <= last_period_end:
+        written += build_checkpoints(db, period_end)
+        db.commit()
+        periods += 1
+        period_end = month_end(period_end + timedelta(days=1))
+
+    return {"periods": periods, "checkpoints": written}
+
+
+def invalidate_checkpoints(db: Session, points: Dict[Tuple[str, str], date]):
+    """
+    Drop checkpoints made stale by postings on or before their period end.
+    points: {(item_code, warehouse): earliest posting date}. The next
+    checkpoint run rebuilds them. Does not commit - the caller commits.
+    """
+    if not points:
+        return
+
+    # Postings are normally after the last checkpoint, skip the delete then
+    if not db.query(StockCheckpoint.id).filter(
+        StockCheckpoint.period_end >= min(points.values())
+    ).first():
+        return
+
+    # One delete per distinct posting date, not one condition per pair
+    pairs_by_date = {}
+    for pair, posting_date in points.items():
+        pairs_by_date.setdefault(posting_date, []).append(pair)
+
+    for posting_date, pairs in pairs_by_date.items():
+        db.query(StockCheckpoint).filter(
+            StockCheckpoint.period_end >= posting_date,
+            tuple_(StockCheckpoint.item_code, StockCheckpoint.warehouse).in_(pairs)
+        ).delete(synchronize_session=False)
+
+
+def run_checkpoint_job():
+    """Background task entry point - builds month-end checkpoints in its own session"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        build_month_end_checkpoints(db)
+    finally:
+        db.close()
@@ -0,0 +1,148 @@
+"""
+Item Master Utilities
+Process-wide index of the item fields that postings, pricing and
+manufacturing read for every line
+"""
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, NamedTuple, Optional
+
+# Items kept in the index, least recently used are dropped beyond this
+ITEM_CACHE_SIZE = 100000
+
+# Entries are reloaded after this many seconds, so changes committed by
+# other processes are picked up; changes committed in this process
+# invalidate their entries immediately
+ITEM_CACHE_TTL = 300
+
+# Item codes loaded per query when filling the index
+ITEM_LOAD_CHUNK_SIZE = 5000
+
+DEFAULT_UOM = "Nos"
+
+
+class ItemRecord(NamedTuple):
+    """Immutable snapshot of the item master fields used in hot loops"""
+    item_code: str
+    uom: str
+    is_stock_item: bool
+    has_serial_no: bool
+    has_batch_no: bool
+    standard_rate: Optional[float]
+
+
+class ItemCache:
+    """
+    Index of item records by item code. Missing items are loaded for many
+    codes at once with one query per chunk and kept in least-recently-used
+    order. Unknown codes are not remembered, so an item created by another
+    process is found on the next lookup rather than after the TTL.
+    """
+
+    def __init__(self, size: int = ITEM_CACHE_SIZE, ttl: float = ITEM_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # item_code -> (loaded_at, ItemRecord)
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < self.ttl
+
+    def get_items(self, db: Session, item_codes: Iterable[str]) -> Dict[str, Optional[ItemRecord]]:
+        """Records for many item codes, None for unknown codes, loading the missing ones together"""
+        from models import Item
+
+        item_codes = list(dict.fromkeys(item_codes))
+        records = {}
+        with self._lock:
+            for item_code in item_codes:
+                entry = self._items.get(item_code)
+                if entry and self._fresh(entry[0]):
+                    self._items.move_to_end(item_code)
+                    records[item_code] = entry[1]
+
+        missing = [item_code for item_code in item_codes if item_code not in records]
+        if not missing:
+            return records
+
+        loaded = dict.fromkeys(missing)
+        for start in range(0, len(missing), ITEM_LOAD_CHUNK_SIZE):
+            chunk = missing[start:start + ITEM_LOAD_CHUNK_SIZE]
+            for item_code, uom, is_stock_item, has_serial_no, has_batch_no, standard_rate in db.query(
+                Item.item_code,
+                Item.uom,
+                Item.is_stock_item,
+                Item.has_serial_no,
+                Item.has_batch_no,
+                Item.standard_rate
+            ).filter(Item.item_code.in_(chunk)).all():
+                loaded[item_code] = ItemRecord(
+                    item_code,
+                    uom or DEFAULT_UOM,
+                    bool(is_stock_item),
+                    bool(has_serial_no),
+                    bool(has_batch_no),
+                    standard_rate
+                )
+
+        loaded_at = time.monotonic()
+        with self._lock:
+            for item_code, record in loaded.items():
+                if record is None:
+                    continue
+                self._items[item_code] = (loaded_at, record)
+                self._items.move_to_end(item_code)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+        records.update(loaded)
+        return records
+
+    def invalidate_items(self, item_codes):
+        with self._lock:
+            for item_code in item_codes:
+                self._items.pop(item_code, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+item_cache = ItemCache()
+
+
+def get_item_records(db: Session, item_codes: Iterable[str]) -> Dict[str, Optional[ItemRecord]]:
+    """Item records by code from the index, None for codes without an item"""
+    return item_cache.get_items(db, item_codes)
+
+
+def get_item_record(db: Session, item_code: str) -> Optional[ItemRecord]:
+    return item_cache.get_items(db, [item_code])[item_code]
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_item_changes(session, flush_context):
+    """Remember which items changed in this transaction, the index drops them on commit"""
+    from models import Item
+
+    changed = session.info.setdefault("item_cache_changes", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Item):
+            changed.add(obj.item_code)
+            # A renamed item invalidates its old code too
+            changed.update(inspect(obj).attrs.item_code.history.deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_item_cache(session):
+    changed = session.info.pop("item_cache_changes", None)
+    if changed:
+        item_cache.invalidate_items(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_item_changes(session):
+    session.info.pop("item_cache_changes", None)
@@ -0,0 +1,159 @@
+"""
+Material Request Utilities
+Consolidation of pending purchase material requests into purchase orders
+"""
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy import case, exists, func, insert, update
+from .models import MaterialRequest, MaterialRequestItem
+from .price_utils import resolve_prices
+
+ORDERED = "Ordered"
+PARTIALLY_ORDERED = "Partially Ordered"
+
+
+def get_pending_purchase_lines(db: Session, material_request_ids: Optional[List[int]] = None):
+    """
+    Lines of submitted Purchase material requests that are not fully
+    ordered yet, partially ordered requests included, locked until commit
+    so concurrent runs cannot order them twice.
+    """
+    ordered_qty = func.coalesce(MaterialRequestItem.ordered_qty, 0.0)
+    query = db.query(
+        MaterialRequestItem.id,
+        MaterialRequestItem.material_request_id,
+        MaterialRequestItem.item_code,
+        (MaterialRequestItem.qty - ordered_qty).label('pending_qty')
+    ).join(MaterialRequest).filter(
+        MaterialRequest.docstatus == 1,
+        MaterialRequest.material_request_type == "Purchase",
+        MaterialRequest.status != "Cancelled",
+        MaterialRequestItem.qty > ordered_qty
+    )
+    if material_request_ids is not None:
+        query = query.filter(MaterialRequest.id.in_(material_request_ids))
+    return query.order_by(MaterialRequestItem.id).with_for_update(of=MaterialRequestItem).all()
+
+
+def consolidate_material_requests(
+    db: Session,
+    material_request_ids: Optional[List[int]] = None,
+    default_supplier_id: Optional[int] = None,
+    transaction_date: Optional[date] = None
+) -> dict:
+    """
+    Turn the pending qty of purchase material requests into draft purchase
+    orders, one per supplier with one line per item.
+
+    The supplier of a line is its item's default supplier, else
+    default_supplier_id; lines with neither stay pending and their items
+    are reported. Lines are priced from the buying price lists on
+    transaction_date (default today). Orders and their lines are written
+    with two bulk inserts, ordered_qty and the request statuses with one
+    UPDATE each, and everything commits once.
+    Returns {"purchase_order_ids", "material_requests", "lines", "unassigned_items"}
+    """
+    from models import Item
+    from modules.buying.models import PurchaseOrder, PurchaseOrderItem
+
+    transaction_date = transaction_date or date.today()
+    lines = get_pending_purchase_lines(db, material_request_ids)
+
+    item_codes = list(dict.fromkeys(line.item_code for line in lines))
+    suppliers = dict(
+        db.query(Item.item_code, Item.default_supplier_id).filter(Item.item_code.in_(item_codes)).all()
+    ) if item_codes else {}
+
+    # (supplier_id, item_code) -> qty, in order of first appearance
+    grouped: Dict[Tuple[int, str], float] = {}
+    ordered_line_ids = []
+    material_requests = set()
+    unassigned = []
+    for line in lines:
+        supplier_id = suppliers.get(line.item_code) or default_supplier_id
+        if not supplier_id:
+            unassigned.append(line.item_code)
+            continue
+        key = (supplier_id, line.item_code)
+        grouped[key] = grouped.get(key, 0.0) + line.pending_qty
+        ordered_line_ids.append(line.id)
+        material_requests.add(line.material_request_id)
+
+    if not grouped:
+        return {
+            "purchase_order_ids": [],
+            "material_requests": 0,
+            "lines": 0,
+            "unassigned_items": list(dict.fromkeys(unassigned))
+        }
+
+    rates = {
+        price["item_code"]: price["price"] or 0.0
+        for price in resolve_prices(db, [item_code for _, item_code in grouped], transaction_type="buying", posting_date=transaction_date)
+    }
+
+    order_lines: Dict[int, List[dict]] = {}
+    for (supplier_id, item_code), qty in grouped.items():
+        order_lines.setdefault(supplier_id, []).append({
+            'item_code': item_code,
+            'qty': qty,
+            'rate': rates[item_code],
+            'amount': qty * rates[item_code]
+        })
+
+    totals = [sum(line['amount'] for line in supplier_lines) for supplier_lines in order_lines.values()]
+    order_ids = db.scalars(
+        insert(PurchaseOrder).returning(PurchaseOrder.id, sort_by_parameter_order=True),
+        [
+            {
+                'supplier_id': supplier_id,
+                'transaction_date': transaction_date,
+                'total_amount': total,
+                'grand_total': total,
+                'status': "Draft"
+            }
+            for supplier_id, total in zip(order_lines, totals)
+        ]
+    ).all()
+
+    db.execute(insert(PurchaseOrderItem), [
+        dict(line, purchase_order_id=order_id)
+        for order_id, supplier_lines in zip(order_ids, order_lines.values())
+        for line in supplier_lines
+    ])
+
+    # Everything still pending on the chosen lines is ordered now; the lines
+    # are locked, so the update must hit all of them
+    result = db.execute(
+        update(MaterialRequestItem)
+        .where(
+            MaterialRequestItem.id.in_(ordered_line_ids),
+            func.coalesce(MaterialRequestItem.ordered_qty, 0.0) < MaterialRequestItem.qty
+        )
+        .values(ordered_qty=MaterialRequestItem.qty)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(ordered_line_ids):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Material requests were ordered concurrently, retry")
+
+    still_pending = exists().where(
+        MaterialRequestItem.material_request_id == MaterialRequest.id,
+        func.coalesce(MaterialRequestItem.ordered_qty, 0.0) < MaterialRequestItem.qty
+    )
+    db.execute(
+        update(MaterialRequest)
+        .where(MaterialRequest.id.in_(material_requests))
+        .values(status=case((still_pending, PARTIALLY_ORDERED), else_=ORDERED))
+        .execution_options(synchronize_session=False)
+    )
+
+    db.commit()
+    return {
+        "purchase_order_ids": list(order_ids),
+        "material_requests": len(material_requests),
+        "lines": len(ordered_line_ids),
+        "unassigned_items": list(dict.fromkeys(unassigned))
+    }
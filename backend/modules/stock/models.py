@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, DateTime, Text, UniqueConstraint, Index, Computed
 from sqlalchemy.orm import relationship
 from database import Base
+from datetime import datetime
 
 class StockEntry(Base):
     __tablename__ = "stock_entries"
@@ -28,6 +29,17 @@ class StockEntryDetail(Base):
 
 class StockLedgerEntry(Base):
     __tablename__ = "stock_ledger_entries"
+    __table_args__ = (
+        # Running balance / repost walks: one item in one warehouse in posting order
+        Index("ix_sle_item_warehouse_posting", "item_code", "warehouse", "posting_date", "posting_time", "id"),
+        # Latest entry by id for an item in a warehouse
+        Index("ix_sle_item_warehouse_id", "item_code", "warehouse", "id"),
+        # Period deltas (as-of balances, checkpoints) read only these columns
+        Index("ix_sle_posting_date", "posting_date", "item_code", "warehouse", "actual_qty", "stock_value_difference"),
+        Index("ix_sle_voucher", "voucher_type", "voucher_no"),
+        # Cost of a document line (gross profit joins sales lines to their issues)
+        Index("ix_sle_voucher_detail", "voucher_type", "voucher_detail_no"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     item_code = Column(String, index=True)
@@ -36,18 +48,92 @@ class StockLedgerEntry(Base):
     posting_time = Column(String, default="00:00:00")
     voucher_type = Column(String) # Stock Entry, Sales Order, Purchase Order, etc.
     voucher_no = Column(Integer)
+    voucher_detail_no = Column(Integer, nullable=True) # Document line posted, e.g. a sales invoice or sales order item
     actual_qty = Column(Float, default=0.0) # +ve for IN, -ve for OUT
     qty_after_transaction = Column(Float, default=0.0) # Running balance
     stock_uom = Column(String, default="Nos")
     valuation_rate = Column(Float, default=0.0)
     stock_value = Column(Float, default=0.0)
     stock_value_difference = Column(Float, default=0.0)
+    incoming_rate = Column(Float, default=0.0) # Rate of inward stock, used to replay valuation
+    stock_queue = Column(Text, nullable=True) # FIFO queue after this entry (JSON [[qty, rate], ...])
     serial_no = Column(String, nullable=True) # Newline separated serial numbers
     batch_no = Column(String, nullable=True)
 
+class Bin(Base):
+    """Materialized stock balance per item and warehouse - updated on every ledger posting"""
+    __tablename__ = "bins"
+    __table_args__ = (
+        UniqueConstraint("item_code", "warehouse", name="uq_bin_item_warehouse"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    item_code = Column(String, nullable=False, index=True)
+    warehouse = Column(String, nullable=False, index=True)
+    actual_qty = Column(Float, default=0.0)
+    valuation_rate = Column(Float, default=0.0)
+    stock_value = Column(Float, default=0.0)
+    stock_uom = Column(String, default="Nos")
+    valuation_method = Column(String, default="Moving Average") # Moving Average, FIFO
+    stock_queue = Column(Text, nullable=True) # FIFO queue (JSON [[qty, rate], ...])
+    # Availability, maintained by order and work order transitions (see availability_utils)
+    ordered_qty = Column(Float, default=0.0) # On submitted purchase orders, not yet received
+    reserved_qty = Column(Float, default=0.0) # For submitted sales orders and work order materials
+    planned_qty = Column(Float, default=0.0) # To be produced by open work orders
+    projected_qty = Column(Float, Computed("actual_qty + ordered_qty + planned_qty - reserved_qty", persisted=True))
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ItemReorder(Base):
+    """Reorder level and quantity per item and warehouse, used by the reorder engine"""
+    __tablename__ = "item_reorders"
+    __table_args__ = (
+        UniqueConstraint("item_code", "warehouse", name="uq_item_reorder"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    item_code = Column(String, nullable=False)
+    warehouse = Column(String, nullable=False)
+    reorder_level = Column(Float, default=0.0) # Request when projected qty falls below this
+    reorder_qty = Column(Float, default=0.0) # Minimum qty to request
+    material_request_type = Column(String, default="Purchase") # Purchase, Material Transfer, Manufacture
+
+class StockCheckpoint(Base):
+    """Stock balance per item and warehouse at a period end (month-end), used for as-of queries"""
+    __tablename__ = "stock_checkpoints"
+    __table_args__ = (
+        UniqueConstraint("item_code", "warehouse", "period_end", name="uq_stock_checkpoint"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    item_code = Column(String, nullable=False, index=True)
+    warehouse = Column(String, nullable=False, index=True)
+    period_end = Column(Date, nullable=False, index=True)
+    qty = Column(Float, default=0.0)
+    stock_value = Column(Float, default=0.0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class RepostItemValuation(Base):
+    """Queued recomputation of later ledger entries after a back-dated posting"""
+    __tablename__ = "repost_item_valuations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    item_code = Column(String, nullable=False, index=True)
+    warehouse = Column(String, nullable=False, index=True)
+    posting_date = Column(Date, nullable=False) # Repost entries from this point on
+    posting_time = Column(String, default="00:00:00")
+    status = Column(String, default="Queued", index=True) # Queued, In Progress, Completed, Failed
+    entries_reposted = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class ItemPrice(Base):
     """Item Price Master"""
     __tablename__ = "item_prices"
+    __table_args__ = (
+        # Price history of an item in one price list, by validity
+        Index("ix_item_price_validity", "item_code", "price_list_id", "valid_from"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     item_code = Column(String, index=True, nullable=False)
@@ -68,7 +154,7 @@ class MaterialRequest(Base):
     transaction_date = Column(Date)
     schedule_date = Column(Date)
     material_request_type = Column(String) # Purchase, Material Transfer, Material Issue, Manufacture
-    status = Column(String, default="Draft") # Draft, Submitted, Ordered, Issued, Transferred, Cancelled
+    status = Column(String, default="Draft") # Draft, Submitted, Partially Ordered, Ordered, Issued, Transferred, Cancelled
     docstatus = Column(Integer, default=0)
     
     items = relationship("MaterialRequestItem", back_populates="material_request")
@@ -77,7 +163,7 @@ class MaterialRequestItem(Base):
     __tablename__ = "material_request_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    material_request_id = Column(Integer, ForeignKey("material_requests.id"))
+    material_request_id = Column(Integer, ForeignKey("material_requests.id"), index=True)
     item_code = Column(String)
     qty = Column(Float, default=0.0)
     schedule_date = Column(Date)
@@ -97,7 +183,10 @@ class StockReconciliation(Base):
     posting_time = Column(String, default="00:00:00")
     purpose = Column(String, default="Stock Reconciliation") # Opening Stock, Stock Reconciliation
     docstatus = Column(Integer, default=0)
-    status = Column(String, default="Draft")
+    status = Column(String, default="Draft") # Draft, Queued, In Progress, Failed, Submitted
+    total_lines = Column(Integer, default=0)
+    processed_lines = Column(Integer, default=0) # Lines posted so far, submission resumes after them
+    error = Column(Text, nullable=True)
     
     items = relationship("StockReconciliationItem", back_populates="reconciliation")
 
@@ -105,7 +194,7 @@ class StockReconciliationItem(Base):
     __tablename__ = "stock_reconciliation_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    reconciliation_id = Column(Integer, ForeignKey("stock_reconciliations.id"))
+    reconciliation_id = Column(Integer, ForeignKey("stock_reconciliations.id"), index=True)
     item_code = Column(String)
     warehouse = Column(String)
     qty = Column(Float, default=0.0) # Target Qty
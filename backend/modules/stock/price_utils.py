@@ -0,0 +1,326 @@
+"""
+Price Resolution Utilities
+Item price lookup for one or many items from an in-process index of price
+lists and item prices, and date-effective repricing
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import date, timedelta
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Tuple
+from .models import ItemPrice
+from .item_utils import get_item_records
+
+# Items kept in the index, least recently used are dropped beyond this
+PRICE_CACHE_SIZE = 100000
+
+# Entries are reloaded after this many seconds, so changes committed by
+# other processes are picked up; changes committed in this process
+# invalidate their entries immediately
+PRICE_CACHE_TTL = 300
+
+PRICE_LIST = "Price List"
+STANDARD_RATE = "Standard Rate"
+DEFAULT_CURRENCY = "USD"
+
+# Item codes loaded per query when filling the index
+PRICE_LOAD_CHUNK_SIZE = 5000
+
+
+class PriceTimeline:
+    """
+    Effective price of an item in one price list over time, as sorted
+    non-overlapping segments, so the price on a date is one binary search.
+    Where validity intervals overlap the price with the latest valid_from
+    wins, the latest entered among equals; dates no price covers have none.
+    """
+    __slots__ = ("starts", "values")
+
+    def __init__(self, prices: List[tuple]):
+        """prices: [(valid_from, valid_upto, rate, currency, id)], open ends as None"""
+        self.starts: List[date] = []
+        self.values: List[Optional[Tuple[float, str]]] = []
+
+        boundaries = {date.min}
+        for valid_from, valid_upto, _, _, _ in prices:
+            boundaries.add(valid_from or date.min)
+            if valid_upto and valid_upto < date.max:
+                boundaries.add(valid_upto + timedelta(days=1))
+
+        # Sweep the boundaries, the heap holds the prices started so far with
+        # the winning one on top; prices that ended are dropped when they surface
+        pending = sorted(prices, key=lambda price: price[0] or date.min)
+        heap = []
+        position = 0
+        for boundary in sorted(boundaries):
+            while position < len(pending) and (pending[position][0] or date.min) <= boundary:
+                valid_from, valid_upto, rate, currency, price_id = pending[position]
+                heapq.heappush(heap, (
+                    -(valid_from or date.min).toordinal(), -price_id, valid_upto or date.max, rate, currency
+                ))
+                position += 1
+            while heap and heap[0][2] < boundary:
+                heapq.heappop(heap)
+
+            value = (heap[0][3], heap[0][4]) if heap else None
+            if self.values and self.values[-1] == value:
+                continue
+            self.starts.append(boundary)
+            self.values.append(value)
+
+    def price_on(self, posting_date: date) -> Optional[Tuple[float, str]]:
+        """(rate, currency) valid on a date, or None"""
+        index = bisect_right(self.starts, posting_date) - 1
+        return self.values[index] if index >= 0 else None
+
+
+class PriceCache:
+    """
+    Index of price lists and, per item code, its item prices. Standard rates
+    come from the item master index (see item_utils). Item entries are loaded for many items at once with one query per table
+    and kept in least-recently-used order.
+    """
+
+    def __init__(self, size: int = PRICE_CACHE_SIZE, ttl: float = PRICE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._price_lists = None # (loaded_at, [(id, name, enabled, buying, selling, currency)])
+        # item_code -> (loaded_at, {price_list_id: PriceTimeline})
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < self.ttl
+
+    def get_price_lists(self, db: Session) -> List[tuple]:
+        from modules.setup.models import PriceList
+
+        with self._lock:
+            if self._price_lists and self._fresh(self._price_lists[0]):
+                return self._price_lists[1]
+
+        price_lists = [
+            tuple(row) for row in db.query(
+                PriceList.id,
+                PriceList.price_list_name,
+                PriceList.enabled,
+                PriceList.buying,
+                PriceList.selling,
+                PriceList.currency
+            ).order_by(PriceList.id).all()
+        ]
+        with self._lock:
+            self._price_lists = (time.monotonic(), price_lists)
+        return price_lists
+
+    def get_items(self, db: Session, item_codes: List[str]) -> Dict[str, dict]:
+        """Index entries {price_list_id: PriceTimeline} for many items, loading the missing ones together"""
+        entries = {}
+        with self._lock:
+            for item_code in item_codes:
+                entry = self._items.get(item_code)
+                if entry and self._fresh(entry[0]):
+                    self._items.move_to_end(item_code)
+                    entries[item_code] = entry[1]
+
+        missing = [item_code for item_code in dict.fromkeys(item_codes) if item_code not in entries]
+        if not missing:
+            return entries
+
+        prices = {item_code: {} for item_code in missing}
+        for start in range(0, len(missing), PRICE_LOAD_CHUNK_SIZE):
+            chunk = missing[start:start + PRICE_LOAD_CHUNK_SIZE]
+            for item_code, price_list_id, valid_from, valid_upto, rate, currency, price_id in db.query(
+                ItemPrice.item_code,
+                ItemPrice.price_list_id,
+                ItemPrice.valid_from,
+                ItemPrice.valid_upto,
+                ItemPrice.price_list_rate,
+                ItemPrice.currency,
+                ItemPrice.id
+            ).filter(ItemPrice.item_code.in_(chunk)).all():
+                prices[item_code].setdefault(price_list_id, []).append(
+                    (valid_from, valid_upto, rate, currency, price_id)
+                )
+
+        timelines = {
+            item_code: {
+                price_list_id: PriceTimeline(list_prices)
+                for price_list_id, list_prices in item_prices.items()
+            }
+            for item_code, item_prices in prices.items()
+        }
+
+        loaded_at = time.monotonic()
+        with self._lock:
+            for item_code in missing:
+                self._items[item_code] = (loaded_at, timelines[item_code])
+                self._items.move_to_end(item_code)
+                entries[item_code] = timelines[item_code]
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+        return entries
+
+    def invalidate_items(self, item_codes):
+        with self._lock:
+            for item_code in item_codes:
+                self._items.pop(item_code, None)
+
+    def clear(self):
+        with self._lock:
+            self._price_lists = None
+            self._items.clear()
+
+
+price_cache = PriceCache()
+
+
+def _get_price_lists(db: Session, price_list: Optional[str], transaction_type: str) -> List[tuple]:
+    """Enabled price lists to resolve from, in order of preference"""
+    return [
+        row for row in price_cache.get_price_lists(db)
+        if row[2] and (
+            row[1] == price_list if price_list
+            else (row[3] if transaction_type == "buying" else row[4])
+        )
+    ]
+
+
+def _standard_rate(item) -> Optional[float]:
+    return item.standard_rate if item else None
+
+
+def _resolve(item_code: str, timelines: dict, standard_rate: Optional[float], price_lists: List[tuple], posting_date: date) -> dict:
+    for price_list_id, name, _, _, _, list_currency in price_lists:
+        timeline = timelines.get(price_list_id)
+        price = timeline.price_on(posting_date) if timeline else None
+        if price:
+            return {
+                "item_code": item_code,
+                "price": price[0],
+                "currency": price[1] or list_currency,
+                "price_list": name,
+                "source": PRICE_LIST
+            }
+
+    return {
+        "item_code": item_code,
+        "price": standard_rate,
+        "currency": DEFAULT_CURRENCY,
+        "price_list": None,
+        "source": STANDARD_RATE if standard_rate is not None else None
+    }
+
+
+def resolve_prices(
+    db: Session,
+    item_codes: List[str],
+    price_list: Optional[str] = None,
+    transaction_type: str = "selling",
+    posting_date: Optional[date] = None
+) -> List[dict]:
+    """
+    Resolve the price of many items on a date from the index.
+
+    With price_list the named list is used, otherwise the first enabled
+    buying or selling list (in order of creation) with a price valid on
+    posting_date (default today). Items without a price fall back to
+    Item.standard_rate; unknown items come back with price None.
+    Returns one result per distinct item code, in order:
+    {"item_code", "price", "currency", "price_list", "source"}
+    """
+    posting_date = posting_date or date.today()
+    price_lists = _get_price_lists(db, price_list, transaction_type)
+
+    item_codes = list(dict.fromkeys(item_codes))
+    entries = price_cache.get_items(db, item_codes)
+    items = get_item_records(db, item_codes)
+    return [
+        _resolve(item_code, entries[item_code], _standard_rate(items[item_code]), price_lists, posting_date)
+        for item_code in item_codes
+    ]
+
+
+def reprice_lines(
+    db: Session,
+    lines: List[dict],
+    price_list: Optional[str] = None,
+    transaction_type: str = "selling"
+) -> List[dict]:
+    """
+    Price document lines as of their own posting dates, for analytics.
+
+    lines format:
+    [
+        {"item_code": "ITEM-001", "posting_date": date(2024, 1, 1), "qty": 2.0, "rate": 9.5, ...},
+        ...
+    ]
+
+    The indexes are filled for all items of the lines at once and each line is
+    one binary search per price list. Nothing is written. Each line comes
+    back with its other keys plus price_list_rate, price_list, source,
+    rate_difference (rate - price_list_rate) and amount_difference.
+    """
+    price_lists = _get_price_lists(db, price_list, transaction_type)
+    item_codes = list(dict.fromkeys(line['item_code'] for line in lines))
+    entries = price_cache.get_items(db, item_codes)
+    items = get_item_records(db, item_codes)
+
+    results = []
+    for line in lines:
+        price = _resolve(
+            line['item_code'],
+            entries[line['item_code']],
+            _standard_rate(items[line['item_code']]),
+            price_lists,
+            line['posting_date']
+        )
+        rate_difference = (
+            (line.get('rate') or 0.0) - price['price'] if price['price'] is not None else None
+        )
+        results.append(dict(
+            line,
+            price_list_rate=price['price'],
+            price_list=price['price_list'],
+            source=price['source'],
+            rate_difference=rate_difference,
+            amount_difference=(
+                rate_difference * (line.get('qty') or 0.0) if rate_difference is not None else None
+            )
+        ))
+    return results
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_price_changes(session, flush_context):
+    """Remember which prices changed in this transaction, the index drops them on commit"""
+    from modules.setup.models import PriceList
+
+    changed = session.info.setdefault("price_cache_changes", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, PriceList):
+            changed.add(None)
+        elif isinstance(obj, ItemPrice):
+            changed.add(obj.item_code)
+            # A price moved to another item invalidates the old one too
+            changed.update(inspect(obj).attrs.item_code.history.deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_price_cache(session):
+    changed = session.info.pop("price_cache_changes", None)
+    if not changed:
+        return
+    if None in changed:
+        price_cache.clear()
+    else:
+        price_cache.invalidate_items(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_price_changes(session):
+    session.info.pop("price_cache_changes", None)
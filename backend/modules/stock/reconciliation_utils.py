@@ -0,0 +1,291 @@
+"""
+Stock Reconciliation Utilities
+Bulk creation and chunked, resumable submission of stock reconciliations
+"""
+import csv
+import io
+from datetime import date
+from typing import List, Optional
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, insert, select, update
+from .models import Bin, StockReconciliation, StockReconciliationItem
+from .stock_ledger_utils import make_sl_entries
+from .valuation_utils import PRECISION
+
+DRAFT = "Draft"
+QUEUED = "Queued"
+IN_PROGRESS = "In Progress"
+FAILED = "Failed"
+
+# Lines posted and committed per step of a submission
+RECONCILIATION_CHUNK_SIZE = 5000
+
+# Larger reconciliations are submitted in the background, poll their progress
+RECONCILIATION_SYNC_LINES = 10000
+
+CSV_REQUIRED_COLUMNS = ("item_code", "warehouse", "qty")
+
+
+def _parse_number(value: Optional[str], column: str, line_no: int) -> float:
+    value = (value or "").strip()
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Line {line_no}: {column} '{value}' is not a number")
+
+
+def parse_reconciliation_csv(content: bytes) -> List[dict]:
+    """
+    Read reconciliation lines from a CSV with the columns
+    item_code, warehouse, qty and optionally valuation_rate.
+    Blank rows are skipped, a blank valuation_rate keeps the current rate.
+    """
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV file must be UTF-8 encoded")
+
+    reader = csv.DictReader(io.StringIO(text))
+    columns = [column.strip() for column in reader.fieldnames or []]
+    missing = [column for column in CSV_REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"CSV is missing columns: {', '.join(missing)}")
+    reader.fieldnames = columns
+
+    lines = []
+    for line_no, row in enumerate(reader, start=2):
+        item_code = (row.get("item_code") or "").strip()
+        warehouse = (row.get("warehouse") or "").strip()
+        if not item_code and not warehouse and not (row.get("qty") or "").strip():
+            continue
+        if not item_code or not warehouse:
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: item_code and warehouse are required")
+
+        lines.append({
+            "item_code": item_code,
+            "warehouse": warehouse,
+            "qty": _parse_number(row.get("qty"), "qty", line_no),
+            "valuation_rate": _parse_number(row.get("valuation_rate"), "valuation_rate", line_no)
+        })
+
+    if not lines:
+        raise HTTPException(status_code=400, detail="CSV has no reconciliation lines")
+    return lines
+
+
+def snapshot_current_balances(db: Session, reconciliation_id: int):
+    """
+    Copy the current bin qty and rate onto every line of a reconciliation
+    with one set-based UPDATE, however many lines it has.
+    Lines without a bin snapshot as zero. Does not commit - the caller commits.
+    """
+    def bin_value(column):
+        return func.coalesce(select(column).where(
+            Bin.item_code == StockReconciliationItem.item_code,
+            Bin.warehouse == StockReconciliationItem.warehouse
+        ).scalar_subquery(), 0.0)
+
+    db.execute(
+        update(StockReconciliationItem)
+        .where(StockReconciliationItem.reconciliation_id == reconciliation_id)
+        .values(
+            current_qty=bin_value(Bin.actual_qty),
+            current_valuation_rate=bin_value(Bin.valuation_rate)
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def create_reconciliation(
+    db: Session,
+    posting_date: date,
+    posting_time: str,
+    purpose: str,
+    lines: List[dict]
+) -> StockReconciliation:
+    """
+    Create a draft reconciliation: the lines are written with one bulk
+    insert and their current balances snapshotted with one UPDATE.
+    An item may appear only once per warehouse.
+    """
+    from core.numbering import get_next_number
+
+    seen = set()
+    for line in lines:
+        key = (line["item_code"], line["warehouse"])
+        if key in seen:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Item {key[0]} is listed more than once for warehouse {key[1]}"
+            )
+        seen.add(key)
+
+    reco = StockReconciliation(
+        name=get_next_number(db, "Stock Reconciliation", date=posting_date),
+        posting_date=posting_date,
+        posting_time=posting_time,
+        purpose=purpose,
+        status=DRAFT,
+        docstatus=0,
+        total_lines=len(lines),
+        processed_lines=0
+    )
+    db.add(reco)
+    db.flush()
+
+    if lines:
+        db.execute(insert(StockReconciliationItem), [
+            {
+                "reconciliation_id": reco.id,
+                "item_code": line["item_code"],
+                "warehouse": line["warehouse"],
+                "qty": line["qty"],
+                "valuation_rate": line.get("valuation_rate") or 0.0
+            }
+            for line in lines
+        ])
+        snapshot_current_balances(db, reco.id)
+
+    db.commit()
+    db.refresh(reco)
+    return reco
+
+
+def _read_chunk(db: Session, reconciliation_id: int, after_id: int, chunk_size: int):
+    """Next chunk of lines with their current bin balance, in one query"""
+    return db.query(
+        StockReconciliationItem.id,
+        StockReconciliationItem.item_code,
+        StockReconciliationItem.warehouse,
+        StockReconciliationItem.qty,
+        StockReconciliationItem.valuation_rate,
+        StockReconciliationItem.current_qty,
+        StockReconciliationItem.current_valuation_rate,
+        Bin.id.label('bin_id'),
+        Bin.actual_qty.label('bin_qty'),
+        Bin.valuation_rate.label('bin_rate')
+    ).outerjoin(Bin, and_(
+        Bin.item_code == StockReconciliationItem.item_code,
+        Bin.warehouse == StockReconciliationItem.warehouse
+    )).filter(
+        StockReconciliationItem.reconciliation_id == reconciliation_id,
+        StockReconciliationItem.id > after_id
+    ).order_by(StockReconciliationItem.id).limit(chunk_size).all()
+
+
+def _post_chunk(db: Session, reco: StockReconciliation, lines) -> None:
+    """
+    Post one chunk of lines. Lines that already match their bin are skipped;
+    the rest go to make_sl_entries in one call with the counted qty, so the
+    adjustment is taken from the balance at posting time. Pairs without a bin
+    are always posted, their bin is seeded from the ledger while posting.
+    The current qty/rate snapshot is rewritten only where it changed.
+    """
+    balances = {}
+    sl_map = []
+    for line in lines:
+        current_qty = line.bin_qty or 0.0
+        current_rate = line.bin_rate or 0.0
+        balances[(line.item_code, line.warehouse)] = (current_qty, current_rate)
+
+        # A zero rate keeps the current valuation
+        new_rate = line.valuation_rate if line.valuation_rate and line.valuation_rate > 0 else None
+        if (
+            line.bin_id is None
+            or abs(line.qty - current_qty) > PRECISION
+            or (new_rate is not None and abs(new_rate - current_rate) > PRECISION)
+        ):
+            sl_map.append({
+                "item_code": line.item_code,
+                "warehouse": line.warehouse,
+                "posting_date": reco.posting_date,
+                "posting_time": reco.posting_time or "00:00:00",
+                "voucher_type": "Stock Reconciliation",
+                "voucher_no": reco.id,
+                "qty_after_transaction": line.qty,
+                "incoming_rate": new_rate
+            })
+
+    for row in make_sl_entries(db, sl_map):
+        # Balance the row was posted against, seeded bins included
+        previous_qty = row["qty_after_transaction"] - row["actual_qty"]
+        previous_value = row["stock_value"] - row["stock_value_difference"]
+        _, bin_rate = balances[(row["item_code"], row["warehouse"])]
+        balances[(row["item_code"], row["warehouse"])] = (
+            previous_qty,
+            previous_value / previous_qty if abs(previous_qty) > PRECISION else bin_rate
+        )
+
+    snapshot = []
+    for line in lines:
+        current_qty, current_rate = balances[(line.item_code, line.warehouse)]
+        if current_qty != line.current_qty or current_rate != line.current_valuation_rate:
+            snapshot.append({
+                "id": line.id,
+                "current_qty": current_qty,
+                "current_valuation_rate": current_rate
+            })
+    if snapshot:
+        db.execute(update(StockReconciliationItem), snapshot)
+
+
+def submit_reconciliation(
+    db: Session,
+    reco: StockReconciliation,
+    chunk_size: int = RECONCILIATION_CHUNK_SIZE
+) -> StockReconciliation:
+    """
+    Post a reconciliation in chunks of lines, in line order. Each chunk
+    commits together with processed_lines, so progress can be polled while
+    it runs and a Failed submission resumes after the last committed chunk.
+    On failure the status is set to Failed with the error; nothing is raised.
+    """
+    from core.document_lifecycle import submit_document
+
+    reco.status = IN_PROGRESS
+    reco.error = None
+    db.commit()
+
+    try:
+        last_id = 0
+        if reco.processed_lines:
+            last_id = db.query(StockReconciliationItem.id).filter(
+                StockReconciliationItem.reconciliation_id == reco.id
+            ).order_by(StockReconciliationItem.id).offset(reco.processed_lines - 1).limit(1).scalar() or 0
+
+        while True:
+            lines = _read_chunk(db, reco.id, last_id, chunk_size)
+            if not lines:
+                break
+
+            _post_chunk(db, reco, lines)
+            reco.processed_lines = (reco.processed_lines or 0) + len(lines)
+            db.commit()
+            last_id = lines[-1].id
+
+        submit_document(db, reco, 1)
+    except Exception as e:
+        db.rollback()
+        reco.status = FAILED
+        reco.error = str(getattr(e, "detail", e))
+        db.commit()
+
+    return reco
+
+
+def run_reconciliation_submit(reconciliation_id: int):
+    """Background task entry point - submits a queued reconciliation in its own session"""
+    from database import SessionLocal
+    from .repost_utils import process_repost_queue
+
+    db = SessionLocal()
+    try:
+        reco = db.query(StockReconciliation).filter(StockReconciliation.id == reconciliation_id).first()
+        if reco and reco.status == QUEUED:
+            submit_reconciliation(db, reco)
+            process_repost_queue(db)
+    finally:
+        db.close()
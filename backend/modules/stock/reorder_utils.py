@@ -0,0 +1,173 @@
+"""
+Reorder Utilities
+Reorder levels per item and warehouse, and the reorder engine that raises
+material requests for every shortfall at once
+"""
+from datetime import date
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, case, func, insert, select, tuple_, update
+from .models import Bin, ItemReorder, MaterialRequest, MaterialRequestItem
+from .availability_utils import ORDER_WAREHOUSE
+
+
+def set_reorder_levels(db: Session, levels: List[dict]) -> int:
+    """
+    Insert or update reorder settings for many item-warehouse pairs: one
+    read of the existing pairs, one bulk insert and one bulk update.
+    Does not commit - the caller commits. Returns the number of pairs.
+    """
+    levels = list({(level['item_code'], level['warehouse']): level for level in levels}.values())
+    if not levels:
+        return 0
+
+    existing = dict(
+        ((item_code, warehouse), reorder_id)
+        for reorder_id, item_code, warehouse in db.query(
+            ItemReorder.id, ItemReorder.item_code, ItemReorder.warehouse
+        ).filter(
+            tuple_(ItemReorder.item_code, ItemReorder.warehouse).in_(
+                [(level['item_code'], level['warehouse']) for level in levels]
+            )
+        ).all()
+    )
+
+    updates = []
+    new_rows = []
+    for level in levels:
+        reorder_id = existing.get((level['item_code'], level['warehouse']))
+        if reorder_id:
+            updates.append(dict(level, id=reorder_id))
+        else:
+            new_rows.append(level)
+
+    if new_rows:
+        db.execute(insert(ItemReorder), new_rows)
+    if updates:
+        db.execute(update(ItemReorder), updates)
+    return len(levels)
+
+
+def get_shortfalls(db: Session) -> List[dict]:
+    """
+    Every item-warehouse pair whose projected qty is below its reorder
+    level, computed in one statement over all reorder settings.
+
+    projected = bin projected qty (actual + ordered + planned - reserved)
+              + qty on submitted material requests not ordered yet
+              + qty on draft purchase orders (counted in the order warehouse)
+
+    The qty to request is the larger of the reorder qty and the shortfall.
+    """
+    from modules.buying.models import PurchaseOrder, PurchaseOrderItem
+
+    requested = select(
+        MaterialRequestItem.item_code,
+        MaterialRequestItem.warehouse,
+        func.sum(MaterialRequestItem.qty - func.coalesce(MaterialRequestItem.ordered_qty, 0.0)).label('qty')
+    ).join(MaterialRequest).where(
+        MaterialRequest.docstatus == 1,
+        MaterialRequest.status != "Cancelled",
+        MaterialRequestItem.qty > func.coalesce(MaterialRequestItem.ordered_qty, 0.0)
+    ).group_by(MaterialRequestItem.item_code, MaterialRequestItem.warehouse).subquery()
+
+    drafted = select(
+        PurchaseOrderItem.item_code,
+        func.sum(PurchaseOrderItem.qty).label('qty')
+    ).join(PurchaseOrder).where(
+        PurchaseOrder.status == "Draft"
+    ).group_by(PurchaseOrderItem.item_code).subquery()
+
+    projected = (
+        func.coalesce(Bin.projected_qty, 0.0)
+        + func.coalesce(requested.c.qty, 0.0)
+        + case((ItemReorder.warehouse == ORDER_WAREHOUSE, func.coalesce(drafted.c.qty, 0.0)), else_=0.0)
+    )
+    shortfall = ItemReorder.reorder_level - projected
+
+    rows = db.execute(
+        select(
+            ItemReorder.item_code,
+            ItemReorder.warehouse,
+            ItemReorder.material_request_type,
+            ItemReorder.reorder_level,
+            ItemReorder.reorder_qty,
+            projected.label('projected_qty'),
+            case((ItemReorder.reorder_qty > shortfall, ItemReorder.reorder_qty), else_=shortfall).label('qty')
+        ).select_from(ItemReorder).outerjoin(Bin, and_(
+            Bin.item_code == ItemReorder.item_code,
+            Bin.warehouse == ItemReorder.warehouse
+        )).outerjoin(requested, and_(
+            requested.c.item_code == ItemReorder.item_code,
+            requested.c.warehouse == ItemReorder.warehouse
+        )).outerjoin(
+            drafted, drafted.c.item_code == ItemReorder.item_code
+        ).where(
+            ItemReorder.reorder_level > 0,
+            shortfall > 0
+        ).order_by(ItemReorder.material_request_type, ItemReorder.item_code, ItemReorder.warehouse)
+    ).all()
+    return [dict(row._mapping) for row in rows]
+
+
+def run_reorder(db: Session, transaction_date: Optional[date] = None) -> dict:
+    """
+    Raise submitted material requests for all current shortfalls, one per
+    material request type, with bulk inserts and one commit. Pairs already
+    covered by open requests or orders are not requested again, so runs
+    can be repeated safely.
+    Returns {"material_request_ids", "lines"}
+    """
+    from core.numbering import get_next_number
+
+    transaction_date = transaction_date or date.today()
+    shortfalls = get_shortfalls(db)
+    if not shortfalls:
+        return {"material_request_ids": [], "lines": 0}
+
+    by_type = {}
+    for shortfall in shortfalls:
+        by_type.setdefault(shortfall['material_request_type'] or "Purchase", []).append(shortfall)
+
+    request_ids = db.scalars(
+        insert(MaterialRequest).returning(MaterialRequest.id, sort_by_parameter_order=True),
+        [
+            {
+                'name': get_next_number(db, "Material Request", date=transaction_date),
+                'transaction_date': transaction_date,
+                'schedule_date': transaction_date,
+                'material_request_type': request_type,
+                'status': "Submitted",
+                'docstatus': 1
+            }
+            for request_type in by_type
+        ]
+    ).all()
+
+    db.execute(insert(MaterialRequestItem), [
+        {
+            'material_request_id': request_id,
+            'item_code': shortfall['item_code'],
+            'warehouse': shortfall['warehouse'],
+            'qty': shortfall['qty'],
+            'schedule_date': transaction_date,
+            'ordered_qty': 0.0,
+            'received_qty': 0.0
+        }
+        for request_id, type_shortfalls in zip(request_ids, by_type.values())
+        for shortfall in type_shortfalls
+    ])
+
+    db.commit()
+    return {"material_request_ids": list(request_ids), "lines": len(shortfalls)}
+
+
+def run_reorder_job():
+    """Scheduler / background task entry point - runs the reorder engine in its own session"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        run_reorder(db)
+    finally:
+        db.close()
@@ -0,0 +1,361 @@
+"""
+Stock Repost Utilities
+Forward recomputation of the stock ledger after back-dated postings
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, func, tuple_, update
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from .models import StockLedgerEntry, RepostItemValuation
+from .bin_utils import get_bin
+from .valuation_utils import ValuationState, RESET_VOUCHER_TYPES
+from .checkpoint_utils import invalidate_checkpoints
+
+REPOST_CHUNK_SIZE = 1000
+
+# Incoming rate changes smaller than this do not revalue a transfer target
+RATE_TOLERANCE = 1e-9
+
+QUEUED = "Queued"
+IN_PROGRESS = "In Progress"
+COMPLETED = "Completed"
+FAILED = "Failed"
+
+# Ledger entries are ordered by posting date, posting time and then id
+POSTING_ORDER = (StockLedgerEntry.posting_date, StockLedgerEntry.posting_time, StockLedgerEntry.id)
+
+
+def posted_after(posting_date: date, posting_time: str, entry_id: Optional[int] = None):
+    """Filter for entries after a point in posting order (inclusive of the point when no id is given)"""
+    if entry_id is None:
+        same_time = StockLedgerEntry.posting_time >= posting_time
+    else:
+        same_time = or_(
+            StockLedgerEntry.posting_time > posting_time,
+            and_(StockLedgerEntry.posting_time == posting_time, StockLedgerEntry.id > entry_id)
+        )
+    return or_(
+        StockLedgerEntry.posting_date > posting_date,
+        and_(StockLedgerEntry.posting_date == posting_date, same_time)
+    )
+
+
+def posted_before(posting_date: date, posting_time: str):
+    """Filter for entries strictly before a posting date and time"""
+    return or_(
+        StockLedgerEntry.posting_date < posting_date,
+        and_(StockLedgerEntry.posting_date == posting_date, StockLedgerEntry.posting_time < posting_time)
+    )
+
+
+def get_back_dated_points(db: Session, sl_rows: List[dict]) -> Dict[Tuple[str, str], Tuple[date, str]]:
+    """
+    Find rows about to be posted before existing ledger entries of the same
+    item and warehouse. Must run before the rows are inserted.
+    Uses one grouped query: the latest posting time per (item, warehouse, date)
+    from the earliest new posting date onwards.
+    Returns {(item_code, warehouse): (posting_date, posting_time)} - the
+    earliest back-dated point per pair.
+    """
+    if not sl_rows:
+        return {}
+
+    pairs = {(row['item_code'], row['warehouse']) for row in sl_rows}
+    min_date = min(row['posting_date'] for row in sl_rows)
+
+    later = {}
+    for item_code, warehouse, posting_date, posting_time in db.query(
+        StockLedgerEntry.item_code,
+        StockLedgerEntry.warehouse,
+        StockLedgerEntry.posting_date,
+        func.max(StockLedgerEntry.posting_time)
+    ).filter(
+        StockLedgerEntry.item_code.in_({item_code for item_code, _ in pairs}),
+        StockLedgerEntry.warehouse.in_({warehouse for _, warehouse in pairs}),
+        StockLedgerEntry.posting_date >= min_date
+    ).group_by(
+        StockLedgerEntry.item_code,
+        StockLedgerEntry.warehouse,
+        StockLedgerEntry.posting_date
+    ).all():
+        if (item_code, warehouse) in pairs:
+            later.setdefault((item_code, warehouse), []).append((posting_date, posting_time or "00:00:00"))
+
+    points = {}
+    for row in sl_rows:
+        key = (row['item_code'], row['warehouse'])
+        point = (row['posting_date'], row.get('posting_time') or "00:00:00")
+        if any(existing > point for existing in later.get(key, ())):
+            if key not in points or point < points[key]:
+                points[key] = point
+    return points
+
+
+def queue_reposts(db: Session, points: Dict[Tuple[str, str], Tuple[date, str]]) -> List[RepostItemValuation]:
+    """
+    Queue reposts, coalescing with entries already waiting for the same
+    item and warehouse: a burst of back-dated postings moves the start point
+    of one queued repost back instead of adding more passes.
+    Does not commit - the caller commits.
+    """
+    if not points:
+        return []
+
+    queued = {}
+    for entry in db.query(RepostItemValuation).filter(
+        RepostItemValuation.status == QUEUED,
+        RepostItemValuation.item_code.in_({item_code for item_code, _ in points}),
+        RepostItemValuation.warehouse.in_({warehouse for _, warehouse in points})
+    ).all():
+        queued.setdefault((entry.item_code, entry.warehouse), entry)
+
+    entries = []
+    for key, (posting_date, posting_time) in points.items():
+        entry = queued.get(key)
+        if entry:
+            if (posting_date, posting_time) < (entry.posting_date, entry.posting_time):
+                entry.posting_date = posting_date
+                entry.posting_time = posting_time
+        else:
+            entry = RepostItemValuation(
+                item_code=key[0],
+                warehouse=key[1],
+                posting_date=posting_date,
+                posting_time=posting_time,
+                status=QUEUED
+            )
+            db.add(entry)
+        entries.append(entry)
+
+    db.flush()
+    return entries
+
+
+def revalue_transfer_targets(db: Session, item_code: str, warehouse: str, outgoing: Dict[int, tuple]) -> int:
+    """
+    Carry new outgoing values of transfers to their incoming legs. A
+    transfer's incoming row is the row of the same voucher and item with
+    positive qty in another warehouse; with several lines of the item in one
+    voucher, outgoing and incoming rows pair up in posting (id) order.
+    Incoming rows get the new outgoing rate and their (item, warehouse)
+    pairs are queued for repost from that row on.
+    outgoing: {entry_id: (voucher_type, voucher_no, actual_qty, stock_value_difference)}
+    for the outgoing rows whose value changed.
+    Does not commit. Returns the number of incoming rows revalued.
+    """
+    if not outgoing:
+        return 0
+
+    vouchers = {(voucher_type, voucher_no) for voucher_type, voucher_no, _, _ in outgoing.values()}
+    legs = db.query(
+        StockLedgerEntry.id,
+        StockLedgerEntry.voucher_type,
+        StockLedgerEntry.voucher_no,
+        StockLedgerEntry.warehouse,
+        StockLedgerEntry.actual_qty,
+        StockLedgerEntry.incoming_rate,
+        StockLedgerEntry.posting_date,
+        StockLedgerEntry.posting_time
+    ).filter(
+        StockLedgerEntry.item_code == item_code,
+        tuple_(StockLedgerEntry.voucher_type, StockLedgerEntry.voucher_no).in_(list(vouchers)),
+        or_(
+            and_(StockLedgerEntry.warehouse == warehouse, StockLedgerEntry.actual_qty < 0),
+            and_(StockLedgerEntry.warehouse != warehouse, StockLedgerEntry.actual_qty > 0)
+        )
+    ).order_by(StockLedgerEntry.id).all()
+
+    out_legs: Dict[tuple, list] = {}
+    in_legs: Dict[tuple, list] = {}
+    for leg in legs:
+        legs_of_voucher = out_legs if leg.warehouse == warehouse else in_legs
+        legs_of_voucher.setdefault((leg.voucher_type, leg.voucher_no), []).append(leg)
+
+    updates = []
+    points: Dict[Tuple[str, str], Tuple[date, str]] = {}
+    for voucher, voucher_out_legs in out_legs.items():
+        for out_leg, in_leg in zip(voucher_out_legs, in_legs.get(voucher, [])):
+            if out_leg.id not in outgoing:
+                continue
+            _, _, actual_qty, stock_value_difference = outgoing[out_leg.id]
+            if not actual_qty:
+                continue
+            rate = stock_value_difference / actual_qty
+            if in_leg.incoming_rate is not None and abs(in_leg.incoming_rate - rate) <= RATE_TOLERANCE:
+                continue
+            updates.append({'id': in_leg.id, 'incoming_rate': rate})
+            key = (item_code, in_leg.warehouse)
+            point = (in_leg.posting_date, in_leg.posting_time or "00:00:00")
+            if key not in points or point < points[key]:
+                points[key] = point
+
+    if updates:
+        db.execute(update(StockLedgerEntry), updates)
+        queue_reposts(db, points)
+    return len(updates)
+
+
+def repost_item_valuation(
+    db: Session,
+    item_code: str,
+    warehouse: str,
+    posting_date: date,
+    posting_time: str = "00:00:00",
+    chunk_size: int = REPOST_CHUNK_SIZE
+) -> int:
+    """
+    Recompute running qty and valuation for every ledger entry of an item in a
+    warehouse from a posting date and time onwards, in posting order.
+    Starts from the balance stored on the entry just before that point, reads
+    entries in keyset chunks and writes changed rows with one bulk update per
+    chunk, then moves the bin to the final balance. Checkpoints from the
+    posting date on are dropped if any entry changed.
+    Stock Reconciliation entries keep their counted qty, so their actual_qty is
+    recomputed against the new opening balance. Transfers whose outgoing
+    value changed revalue their incoming leg and queue a repost of the
+    target warehouse (see revalue_transfer_targets).
+    Does not commit - the caller commits. Returns the number of entries updated.
+    """
+    bin_doc = get_bin(db, item_code, warehouse)
+    pair_filter = and_(
+        StockLedgerEntry.item_code == item_code,
+        StockLedgerEntry.warehouse == warehouse
+    )
+
+    previous = db.query(StockLedgerEntry).filter(
+        pair_filter,
+        posted_before(posting_date, posting_time)
+    ).order_by(*[column.desc() for column in POSTING_ORDER]).first()
+
+    if previous:
+        state = ValuationState.from_balance(
+            bin_doc.valuation_method,
+            previous.qty_after_transaction,
+            previous.stock_value,
+            previous.valuation_rate,
+            previous.stock_queue
+        )
+    else:
+        state = ValuationState(bin_doc.valuation_method)
+
+    columns = (
+        StockLedgerEntry.id,
+        StockLedgerEntry.posting_date,
+        StockLedgerEntry.posting_time,
+        StockLedgerEntry.voucher_type,
+        StockLedgerEntry.voucher_no,
+        StockLedgerEntry.actual_qty,
+        StockLedgerEntry.incoming_rate,
+        StockLedgerEntry.qty_after_transaction,
+        StockLedgerEntry.valuation_rate,
+        StockLedgerEntry.stock_value,
+        StockLedgerEntry.stock_value_difference,
+        StockLedgerEntry.stock_queue
+    )
+
+    updated = 0
+    position = posted_after(posting_date, posting_time)
+    while True:
+        chunk = db.query(*columns).filter(pair_filter, position).order_by(*POSTING_ORDER).limit(chunk_size).all()
+        if not chunk:
+            break
+
+        updates = []
+        changed_outgoing = {}
+        for sle in chunk:
+            is_reset = sle.voucher_type in RESET_VOUCHER_TYPES
+            actual_qty = sle.actual_qty
+            if is_reset:
+                # The counted qty stands, the movement is whatever reaches it
+                actual_qty = (sle.qty_after_transaction or 0.0) - state.qty
+            incoming_rate = sle.incoming_rate if (actual_qty > 0 or is_reset) else None
+
+            stock_value_difference = state.apply(actual_qty, incoming_rate, is_reset)
+            values = {
+                'actual_qty': actual_qty,
+                'qty_after_transaction': state.qty,
+                'valuation_rate': state.rate,
+                'stock_value': state.value,
+                'stock_value_difference': stock_value_difference,
+                'stock_queue': state.dump_queue()
+            }
+            if any(getattr(sle, field) != value for field, value in values.items()):
+                values['id'] = sle.id
+                updates.append(values)
+                if actual_qty < 0 and sle.stock_value_difference != stock_value_difference:
+                    changed_outgoing[sle.id] = (sle.voucher_type, sle.voucher_no, actual_qty, stock_value_difference)
+
+        if updates:
+            db.execute(update(StockLedgerEntry), updates)
+            updated += len(updates)
+            revalue_transfer_targets(db, item_code, warehouse, changed_outgoing)
+
+        last = chunk[-1]
+        position = posted_after(last.posting_date, last.posting_time, last.id)
+
+    bin_doc.actual_qty = state.qty
+    bin_doc.valuation_rate = state.rate
+    bin_doc.stock_value = state.value
+    bin_doc.stock_queue = state.dump_queue()
+    if updated:
+        from modules.selling.gross_profit_utils import invalidate_gross_profit
+        invalidate_checkpoints(db, {(item_code, warehouse): posting_date})
+        invalidate_gross_profit(db, posting_date)
+    db.flush()
+
+    return updated
+
+
+def process_repost_queue(db: Session, limit: Optional[int] = None) -> dict:
+    """
+    Run queued reposts, oldest first. Each repost commits on its own so a
+    failure only marks that entry as Failed. Reposts queued while the queue
+    runs (transfer targets of revalued transfers) run in the same pass.
+    """
+    result = {"processed": 0, "failed": 0, "entries_reposted": 0}
+    while True:
+        done = result["processed"] + result["failed"]
+        if limit and done >= limit:
+            break
+        entry = db.query(RepostItemValuation).filter(
+            RepostItemValuation.status == QUEUED
+        ).order_by(RepostItemValuation.id).first()
+        if not entry:
+            break
+
+        entry.status = IN_PROGRESS
+        db.commit()
+
+        try:
+            count = repost_item_valuation(
+                db,
+                entry.item_code,
+                entry.warehouse,
+                entry.posting_date,
+                entry.posting_time or "00:00:00"
+            )
+            entry.status = COMPLETED
+            entry.entries_reposted = count
+            entry.error = None
+            db.commit()
+            result["processed"] += 1
+            result["entries_reposted"] += count
+        except Exception as e:
+            db.rollback()
+            entry.status = FAILED
+            entry.error = str(e)
+            db.commit()
+            result["failed"] += 1
+
+    return result
+
+
+def run_repost_queue():
+    """Background task entry point - processes the queue in its own session"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        process_repost_queue(db)
+    finally:
+        db.close()
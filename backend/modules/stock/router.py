@@ -1,9 +1,13 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from datetime import date
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Response, UploadFile, File, Form, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, insert
 from database import SessionLocal
 from . import models, schemas, serial_batch_models
+from .stock_ledger_utils import make_sl_entries, INWARD_PURPOSES
+from .repost_utils import run_repost_queue
+from core.pagination import paginate
 
 router = APIRouter(
     prefix="/stock",
@@ -22,178 +26,324 @@ def create_stock_entry_with_ledger(db: Session, entry_data: dict):
     warehouse = entry_data.get('warehouse', 'Main Store')
     from_warehouse = entry_data.get('from_warehouse')
     to_warehouse = entry_data.get('to_warehouse')
+    purpose = entry_data['purpose']
     
-    # Create Stock Entry
+    # Create Stock Entry (flush only to get the id, everything commits once below)
     db_entry = models.StockEntry(
         transaction_date=entry_data['transaction_date'],
-        purpose=entry_data['purpose'],
+        purpose=purpose,
         from_warehouse=from_warehouse,
         to_warehouse=to_warehouse
     )
     db.add(db_entry)
-    db.commit()
-    db.refresh(db_entry)
-
-    # Create Stock Entry Details and Ledger Entries
-    for item_data in entry_data['items']:
-        db_item = models.StockEntryDetail(
-            stock_entry_id=db_entry.id,
-            item_code=item_data['item_code'],
-            qty=item_data['qty'],
-            basic_rate=item_data['basic_rate'],
-            serial_no=item_data.get('serial_no'),
-            batch_no=item_data.get('batch_no')
-        )
-        db.add(db_item)
+    db.flush()
+
+    # Outgoing lines of batch-tracked items without a batch are split per batch, FEFO
+    items = entry_data['items']
+    if purpose not in INWARD_PURPOSES:
+        from .batch_utils import allocate_batch_items
+        source_warehouse = from_warehouse if purpose == "Material Transfer" else warehouse
+        items = allocate_batch_items(db, items, source_warehouse, entry_data['transaction_date'])
+
+    # Build Stock Entry Details and the ledger map for all lines
+    details = []
+    sl_map = []
+    for item_data in items:
+        details.append({
+            'stock_entry_id': db_entry.id,
+            'item_code': item_data['item_code'],
+            'qty': item_data['qty'],
+            'basic_rate': item_data['basic_rate'],
+            'serial_no': item_data.get('serial_no'),
+            'batch_no': item_data.get('batch_no')
+        })
         
         # Handle different purposes
-        if entry_data['purpose'] == "Material Transfer":
+        if purpose == "Material Transfer":
             # Transfer: Deduct from source, add to target
-            # Deduct from source warehouse
-            create_ledger_entry(db, item_data, -item_data['qty'], from_warehouse, entry_data, db_entry.id)
-            # Add to target warehouse
-            create_ledger_entry(db, item_data, item_data['qty'], to_warehouse, entry_data, db_entry.id)
+            sl_map.append(get_sl_dict(item_data, -item_data['qty'], from_warehouse, entry_data, db_entry.id))
+            transfer_in = get_sl_dict(item_data, item_data['qty'], to_warehouse, entry_data, db_entry.id)
+            transfer_in['is_transfer_in'] = True
+            sl_map.append(transfer_in)
         else:
-            # Material Receipt or Issue
-            actual_qty = item_data['qty'] if entry_data['purpose'] == "Material Receipt" else -item_data['qty']
-            create_ledger_entry(db, item_data, actual_qty, warehouse, entry_data, db_entry.id)
+            # Receipt (incl. Sales Return) or Issue
+            actual_qty = item_data['qty'] if purpose in INWARD_PURPOSES else -item_data['qty']
+            sl_map.append(get_sl_dict(item_data, actual_qty, warehouse, entry_data, db_entry.id))
+    
+    if details:
+        db.execute(insert(models.StockEntryDetail), details)
+    make_sl_entries(db, sl_map)
     
     db.commit()
     db.refresh(db_entry)
     return db_entry
 
+def get_sl_dict(item_data: dict, actual_qty: float, warehouse: str, entry_data: dict, voucher_no: int) -> dict:
+    """Build a stock ledger map row for make_sl_entries"""
+    return {
+        'item_code': item_data['item_code'],
+        'warehouse': warehouse,
+        'posting_date': entry_data['transaction_date'],
+        'posting_time': entry_data.get('posting_time', "00:00:00"),
+        'voucher_type': entry_data.get('voucher_type', 'Stock Entry'),
+        'voucher_no': voucher_no,
+        'voucher_detail_no': item_data.get('voucher_detail_no'),
+        'actual_qty': actual_qty,
+        'incoming_rate': item_data['basic_rate'],
+        'serial_no': item_data.get('serial_no'),
+        'batch_no': item_data.get('batch_no')
+    }
+
 def create_ledger_entry(db: Session, item_data: dict, actual_qty: float, warehouse: str, entry_data: dict, voucher_no: int):
     """Create a single stock ledger entry for a warehouse"""
-    # Get previous balance for this warehouse
-    last_sle = db.query(models.StockLedgerEntry).filter(
-        models.StockLedgerEntry.item_code == item_data['item_code'],
-        models.StockLedgerEntry.warehouse == warehouse
-    ).order_by(models.StockLedgerEntry.id.desc()).first()
-    
-    prev_qty = last_sle.qty_after_transaction if last_sle else 0.0
-    new_qty = prev_qty + actual_qty
-    
-    # Create Stock Ledger Entry
-    sle = models.StockLedgerEntry(
-        item_code=item_data['item_code'],
-        warehouse=warehouse,
-        posting_date=entry_data['transaction_date'],
-        voucher_type=entry_data.get('voucher_type', 'Stock Entry'),
-        voucher_no=voucher_no,
-        actual_qty=actual_qty,
-        qty_after_transaction=new_qty,
-        stock_uom="Nos",
-        valuation_rate=item_data['basic_rate'],
-        stock_value=new_qty * item_data['basic_rate'],
-        stock_value_difference=actual_qty * item_data['basic_rate'],
-        serial_no=item_data.get('serial_no'),
-        batch_no=item_data.get('batch_no')
-    )
-    db.add(sle)
+    make_sl_entries(db, [get_sl_dict(item_data, actual_qty, warehouse, entry_data, voucher_no)])
 
 
 @router.post("/entries/", response_model=schemas.StockEntry)
-def create_stock_entry(entry: schemas.StockEntryCreate, db: Session = Depends(get_db)):
+def create_stock_entry(entry: schemas.StockEntryCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     entry_data = {
         'transaction_date': entry.transaction_date,
         'purpose': entry.purpose,
         'items': [item.dict() for item in entry.items]
     }
-    return create_stock_entry_with_ledger(db, entry_data)
+    db_entry = create_stock_entry_with_ledger(db, entry_data)
+    # Back-dated postings queue reposts, run them after the response
+    background_tasks.add_task(run_repost_queue)
+    return db_entry
 
 @router.get("/entries/", response_model=List[schemas.StockEntry])
-def read_stock_entries(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    entries = db.query(models.StockEntry).offset(skip).limit(limit).all()
+def read_stock_entries(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    entries = paginate(db.query(models.StockEntry), response, [models.StockEntry.id], skip, limit, cursor)
     return entries
 
 @router.get("/ledger/", response_model=List[schemas.StockLedgerEntry])
-def get_stock_ledger(item_code: str = None, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_stock_ledger(response: Response, item_code: str = None, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
     query = db.query(models.StockLedgerEntry)
     if item_code:
         query = query.filter(models.StockLedgerEntry.item_code == item_code)
-    entries = query.order_by(models.StockLedgerEntry.id.desc()).offset(skip).limit(limit).all()
+    entries = paginate(query, response, [models.StockLedgerEntry.id], skip, limit, cursor, descending=True)
     return entries
 
+@router.get("/ledger/export")
+def export_stock_ledger(
+    item_code: str = None,
+    warehouse: str = None,
+    from_date: date = None,
+    to_date: date = None,
+    format: str = "ndjson"
+):
+    """Stream all matching stock ledger entries as NDJSON or CSV, in posting order"""
+    from sqlalchemy import select
+    from core.export import stream_export
+    from .repost_utils import POSTING_ORDER
+    
+    statement = select(models.StockLedgerEntry.__table__)
+    if item_code:
+        statement = statement.where(models.StockLedgerEntry.item_code == item_code)
+    if warehouse:
+        statement = statement.where(models.StockLedgerEntry.warehouse == warehouse)
+    if from_date:
+        statement = statement.where(models.StockLedgerEntry.posting_date >= from_date)
+    if to_date:
+        statement = statement.where(models.StockLedgerEntry.posting_date <= to_date)
+    
+    statement = statement.order_by(*POSTING_ORDER)
+    return stream_export(statement, format, "stock_ledger")
+
 @router.get("/balance/{item_code}")
 def get_stock_balance(item_code: str, db: Session = Depends(get_db)):
-    # Get the latest stock ledger entry for this item
-    last_entry = db.query(models.StockLedgerEntry).filter(
-        models.StockLedgerEntry.item_code == item_code
-    ).order_by(models.StockLedgerEntry.id.desc()).first()
+    # Sum the item's bins across all warehouses
+    result = db.query(
+        func.sum(models.Bin.actual_qty).label('balance'),
+        func.sum(models.Bin.stock_value).label('value')
+    ).filter(models.Bin.item_code == item_code).first()
     
-    if not last_entry:
+    if not result or result.balance is None:
         return {"item_code": item_code, "balance": 0.0, "value": 0.0, "valuation_rate": 0.0}
     
+    balance = float(result.balance)
+    value = float(result.value or 0.0)
     return {
         "item_code": item_code,
-        "balance": last_entry.qty_after_transaction,
-        "value": last_entry.stock_value,
-        "valuation_rate": last_entry.valuation_rate
+        "balance": balance,
+        "value": value,
+        "valuation_rate": value / balance if balance else 0.0
     }
 
 @router.get("/reports/stock-balance")
-def get_stock_balance_report(db: Session = Depends(get_db)):
-    """Get stock balance for all items"""
-    from sqlalchemy import func
-    
-    # Get latest entry for each item
-    subquery = db.query(
-        models.StockLedgerEntry.item_code,
-        func.max(models.StockLedgerEntry.id).label('latest_id')
-    ).group_by(models.StockLedgerEntry.item_code).subquery()
-    
-    stock_balances = db.query(models.StockLedgerEntry).join(
-        subquery,
-        (models.StockLedgerEntry.item_code == subquery.c.item_code) &
-        (models.StockLedgerEntry.id == subquery.c.latest_id)
-    ).all()
-    
-    total_value = sum([entry.stock_value for entry in stock_balances])
+def get_stock_balance_report(as_of: Optional[date] = None, db: Session = Depends(get_db)):
+    """Get stock balance for all items, currently or at the end of an as_of date"""
+    if as_of:
+        # Nearest month-end checkpoint plus the ledger movements after it
+        from .checkpoint_utils import get_balances_as_of
+        totals = {}
+        for (item_code, _), balance in get_balances_as_of(db, as_of).items():
+            total = totals.setdefault(item_code, [0.0, 0.0])
+            total[0] += balance['qty']
+            total[1] += balance['value']
+        stock_balances = [(item_code, qty, value) for item_code, (qty, value) in totals.items()]
+    else:
+        # One grouped read over bins, O(items) instead of O(ledger rows)
+        stock_balances = db.query(
+            models.Bin.item_code,
+            func.sum(models.Bin.actual_qty).label('balance'),
+            func.sum(models.Bin.stock_value).label('value')
+        ).group_by(models.Bin.item_code).all()
+    
+    items = []
+    for item_code, balance, value in stock_balances:
+        balance = float(balance or 0.0)
+        value = float(value or 0.0)
+        items.append({
+            'item_code': item_code,
+            'balance': balance,
+            'valuation_rate': value / balance if balance else 0.0,
+            'value': value
+        })
     
     return {
-        'items': [{
-            'item_code': entry.item_code,
-            'balance': entry.qty_after_transaction,
-            'valuation_rate': entry.valuation_rate,
-            'value': entry.stock_value
-        } for entry in stock_balances],
-        'total_value': total_value
+        'items': items,
+        'total_value': sum([item['value'] for item in items])
     }
 
+@router.get("/reports/stock-ageing", response_model=List[schemas.StockAgeing])
+def get_stock_ageing_report(
+    as_of: Optional[date] = None,
+    warehouse_id: Optional[int] = None,
+    item_group_id: Optional[int] = None,
+    item_code: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Stock on hand per item and warehouse in ageing ranges, optionally for a warehouse or item group subtree"""
+    from .ageing_utils import iter_stock_ageing, get_item_group_subtree_ids
+    from .warehouse_models import Warehouse
+    from .warehouse_utils import ensure_warehouse_tree, get_subtree_warehouse_names
+
+    warehouses = None
+    if warehouse_id:
+        if not db.query(Warehouse.id).filter(Warehouse.id == warehouse_id).first():
+            raise HTTPException(status_code=404, detail="Warehouse not found")
+        ensure_warehouse_tree(db)
+        warehouses = get_subtree_warehouse_names(db, warehouse_id)
+
+    item_group_ids = get_item_group_subtree_ids(db, item_group_id) if item_group_id else None
+    return list(iter_stock_ageing(db, as_of, warehouses, item_group_ids, item_code))
+
+@router.post("/checkpoints/build")
+def build_stock_checkpoints(background_tasks: BackgroundTasks):
+    """Write missing month-end stock checkpoints in the background"""
+    from .checkpoint_utils import run_checkpoint_job
+    background_tasks.add_task(run_checkpoint_job)
+    return {"message": "Checkpoint build queued"}
+
+@router.post("/bins/rebuild")
+def rebuild_stock_bins(db: Session = Depends(get_db)):
+    """Regenerate all bins from the stock ledger"""
+    from .bin_utils import rebuild_bins
+    count = rebuild_bins(db)
+    return {"message": "Bins rebuilt", "bins": count}
+
+@router.put("/bins/valuation-method", response_model=schemas.Bin)
+def set_bin_valuation_method(data: schemas.BinValuationMethodUpdate, db: Session = Depends(get_db)):
+    """Select Moving Average or FIFO valuation for an item in a warehouse"""
+    from .bin_utils import get_bin
+    from .valuation_utils import ValuationState, VALUATION_METHODS
+    
+    if data.valuation_method not in VALUATION_METHODS:
+        raise HTTPException(status_code=400, detail=f"Valuation method must be one of {', '.join(VALUATION_METHODS)}")
+    
+    bin_doc = get_bin(db, data.item_code, data.warehouse)
+    # Existing stock carries over as a single layer at the current rate
+    state = ValuationState.from_bin(bin_doc)
+    state.method = data.valuation_method
+    bin_doc.valuation_method = data.valuation_method
+    bin_doc.stock_queue = state.dump_queue()
+    
+    db.commit()
+    db.refresh(bin_doc)
+    return bin_doc
+
+@router.get("/availability", response_model=List[schemas.StockAvailability])
+def get_stock_availability(
+    item_code: List[str] = Query(...),
+    warehouse: Optional[List[str]] = Query(None),
+    per_warehouse: bool = True,
+    db: Session = Depends(get_db)
+):
+    """
+    Actual, ordered, reserved, planned and projected qty for many items in one
+    query, e.g. ?item_code=A&item_code=B&warehouse=Stores
+    """
+    from .availability_utils import get_availability
+    
+    if len(item_code) > 1000:
+        raise HTTPException(status_code=400, detail="At most 1000 items per request")
+    return get_availability(db, item_code, warehouses=warehouse, per_warehouse=per_warehouse)
+
+@router.post("/availability/rebuild")
+def rebuild_stock_availability(db: Session = Depends(get_db)):
+    """Recompute ordered, reserved and planned qty from open orders and work orders"""
+    from .availability_utils import rebuild_availability
+    
+    count = rebuild_availability(db)
+    db.commit()
+    return {"message": "Availability rebuilt", "bins": count}
+
+@router.get("/valuation/verify")
+def verify_stock_valuation(item_code: str = None, warehouse: str = None, db: Session = Depends(get_db)):
+    """Replay the stock ledger and compare with incrementally posted valuation"""
+    from .stock_ledger_utils import verify_stock_ledger
+    return verify_stock_ledger(db, item_code=item_code, warehouse=warehouse)
+
+@router.get("/reposts/", response_model=List[schemas.RepostItemValuation])
+def read_reposts(response: Response, status: str = None, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    query = db.query(models.RepostItemValuation)
+    if status:
+        query = query.filter(models.RepostItemValuation.status == status)
+    return paginate(query, response, [models.RepostItemValuation.id], skip, limit, cursor, descending=True)
+
+@router.post("/reposts/", response_model=schemas.RepostItemValuation)
+def create_repost(repost: schemas.RepostItemValuationCreate, db: Session = Depends(get_db)):
+    """Queue a repost manually, merged with any repost already queued for the item and warehouse"""
+    from .repost_utils import queue_reposts
+    entry = queue_reposts(db, {(repost.item_code, repost.warehouse): (repost.posting_date, repost.posting_time)})[0]
+    db.commit()
+    db.refresh(entry)
+    return entry
+
+@router.post("/reposts/process")
+def process_reposts(limit: int = None, db: Session = Depends(get_db)):
+    """Run queued reposts now"""
+    from .repost_utils import process_repost_queue
+    return process_repost_queue(db, limit=limit)
+
 # Warehouse Management
 from . import warehouse_schemas
 from .warehouse_models import Warehouse
+from .warehouse_utils import add_to_warehouse_tree, ensure_warehouse_tree, get_subtree_balances, get_subtree_warehouse_names
 
 @router.post("/warehouses/", response_model=warehouse_schemas.Warehouse)
 def create_warehouse(warehouse: warehouse_schemas.WarehouseCreate, db: Session = Depends(get_db)):
     db_warehouse = Warehouse(**warehouse.dict())
     db.add(db_warehouse)
+    db.flush()
+    add_to_warehouse_tree(db, db_warehouse)
     db.commit()
     db.refresh(db_warehouse)
     return db_warehouse
 
 @router.get("/warehouses/", response_model=List[warehouse_schemas.WarehouseWithBalance])
 def read_warehouses(db: Session = Depends(get_db)):
+    ensure_warehouse_tree(db)
     warehouses = db.query(Warehouse).all()
-    result = []
     
+    # Stock value and item count of every warehouse's subtree (group warehouses
+    # roll up their children) in one aggregate query over the closure table and bins
+    balances = get_subtree_balances(db)
+    
+    result = []
     for wh in warehouses:
-        # Calculate stock value for this warehouse
-        subquery = db.query(
-            models.StockLedgerEntry.item_code,
-            func.max(models.StockLedgerEntry.id).label('latest_id')
-        ).filter(
-            models.StockLedgerEntry.warehouse == wh.warehouse_name
-        ).group_by(models.StockLedgerEntry.item_code).subquery()
-        
-        stock_entries = db.query(models.StockLedgerEntry).join(
-            subquery,
-            (models.StockLedgerEntry.item_code == subquery.c.item_code) &
-            (models.StockLedgerEntry.id == subquery.c.latest_id)
-        ).all()
-        
-        stock_value = sum([entry.stock_value for entry in stock_entries])
-        item_count = len([e for e in stock_entries if e.qty_after_transaction > 0])
+        balance = balances.get(wh.id, {})
         
         wh_dict = {
             "id": wh.id,
@@ -207,13 +357,20 @@ def read_warehouses(db: Session = Depends(get_db)):
             "is_active": wh.is_active,
             "created_at": wh.created_at,
             "updated_at": wh.updated_at,
-            "stock_value": float(stock_value),
-            "item_count": item_count
+            "stock_value": balance.get("stock_value", 0.0),
+            "item_count": balance.get("item_count", 0)
         }
         result.append(wh_dict)
     
     return result
 
+@router.post("/warehouses/tree/rebuild")
+def rebuild_warehouse_tree_endpoint(db: Session = Depends(get_db)):
+    """Regenerate the warehouse closure table from parent_warehouse_id"""
+    from .warehouse_utils import rebuild_warehouse_tree
+    count = rebuild_warehouse_tree(db)
+    return {"message": "Warehouse tree rebuilt", "rows": count}
+
 @router.get("/warehouses/{warehouse_id}", response_model=warehouse_schemas.Warehouse)
 def read_warehouse(warehouse_id: int, db: Session = Depends(get_db)):
     warehouse = db.query(Warehouse).filter(Warehouse.id == warehouse_id).first()
@@ -222,31 +379,39 @@ def read_warehouse(warehouse_id: int, db: Session = Depends(get_db)):
     return warehouse
 
 @router.get("/warehouses/{warehouse_id}/balance")
-def get_warehouse_stock_balance(warehouse_id: int, db: Session = Depends(get_db)):
+def get_warehouse_stock_balance(warehouse_id: int, as_of: Optional[date] = None, db: Session = Depends(get_db)):
     warehouse = db.query(Warehouse).filter(Warehouse.id == warehouse_id).first()
     if not warehouse:
         raise HTTPException(status_code=404, detail="Warehouse not found")
     
-    # Get latest stock entries for this warehouse
-    subquery = db.query(
-        models.StockLedgerEntry.item_code,
-        func.max(models.StockLedgerEntry.id).label('latest_id')
-    ).filter(
-        models.StockLedgerEntry.warehouse == warehouse.warehouse_name
-    ).group_by(models.StockLedgerEntry.item_code).subquery()
-    
-    stock_entries = db.query(models.StockLedgerEntry).join(
-        subquery,
-        (models.StockLedgerEntry.item_code == subquery.c.item_code) &
-        (models.StockLedgerEntry.id == subquery.c.latest_id)
-    ).all()
+    # A group warehouse reports the items of its whole subtree
+    ensure_warehouse_tree(db)
+    warehouse_names = get_subtree_warehouse_names(db, warehouse.id)
+    
+    if as_of:
+        from .checkpoint_utils import get_balances_as_of
+        totals = {}
+        for (item_code, _), balance in get_balances_as_of(db, as_of, warehouses=warehouse_names).items():
+            total = totals.setdefault(item_code, [0.0, 0.0])
+            total[0] += balance['qty']
+            total[1] += balance['value']
+        rows = [(item_code, qty, value) for item_code, (qty, value) in totals.items()]
+    else:
+        # Read current balances from the subtree's bins
+        rows = db.query(
+            models.Bin.item_code,
+            func.sum(models.Bin.actual_qty),
+            func.sum(models.Bin.stock_value)
+        ).filter(
+            models.Bin.warehouse.in_(warehouse_names)
+        ).group_by(models.Bin.item_code).all()
     
     items = [{
-        'item_code': entry.item_code,
-        'balance': entry.qty_after_transaction,
-        'valuation_rate': entry.valuation_rate,
-        'value': entry.stock_value
-    } for entry in stock_entries if entry.qty_after_transaction > 0]
+        'item_code': item_code,
+        'balance': qty,
+        'valuation_rate': value / qty,
+        'value': value
+    } for item_code, qty, value in rows if qty > 0]
     
     return {
         'warehouse': warehouse.warehouse_name,
@@ -261,6 +426,8 @@ def create_item_price(
     db: Session = Depends(get_db)
 ):
     """Create a new item price"""
+    if item_price.valid_from and item_price.valid_upto and item_price.valid_upto < item_price.valid_from:
+        raise HTTPException(status_code=400, detail="Valid Upto must be on or after Valid From")
     db_ip = models.ItemPrice(**item_price.dict())
     db.add(db_ip)
     db.commit()
@@ -269,10 +436,12 @@ def create_item_price(
 
 @router.get("/item-prices/", response_model=List[schemas.ItemPrice])
 def read_item_prices(
+    response: Response,
     item_code: str = None,
     price_list_id: int = None,
     skip: int = 0, 
-    limit: int = 100, 
+    limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get all item prices, optionally filtered by item or price list"""
@@ -282,48 +451,64 @@ def read_item_prices(
     if price_list_id:
         query = query.filter(models.ItemPrice.price_list_id == price_list_id)
         
-    item_prices = query.offset(skip).limit(limit).all()
+    item_prices = paginate(query, response, [models.ItemPrice.id], skip, limit, cursor)
     return item_prices
 
-@router.get("/get-price/")
+@router.get("/get-price/", response_model=schemas.ResolvedPrice)
 def get_item_price_endpoint(
     item_code: str,
     price_list: str = None, # Name of price list
     transaction_type: str = "selling", # buying or selling
+    posting_date: date = None,
     db: Session = Depends(get_db)
 ):
-    """Get price for an item"""
-    from modules.setup.models import PriceList
-    from datetime import datetime
-    
-    query = db.query(models.ItemPrice).join(PriceList, models.ItemPrice.price_list_id == PriceList.id)
-    query = query.filter(models.ItemPrice.item_code == item_code)
-    
-    if price_list:
-        query = query.filter(PriceList.price_list_name == price_list)
-    else:
-        # Default logic: Get enabled price list for transaction type
-        if transaction_type == "buying":
-            query = query.filter(PriceList.buying == True)
-        else:
-            query = query.filter(PriceList.selling == True)
-            
-    # Check validity
-    today = datetime.now().date()
-    # Note: In SQLite, date comparison might need care, but ORM handles usually.
-    # For simplicity, we pick the first match.
-    
-    price_entry = query.filter(PriceList.enabled == True).first()
-    
-    if price_entry:
-        return {"item_code": item_code, "price": price_entry.price_list_rate, "currency": price_entry.currency}
-    
-    # Fallback to Item Standard Rate
-    item = db.query(models.Item).filter(models.Item.item_code == item_code).first()
-    if item:
-        return {"item_code": item_code, "price": item.standard_rate, "currency": "USD", "source": "Standard Rate"}
-        
-    raise HTTPException(status_code=404, detail="Price not found")
+    """Get the price of an item valid on a date (default today); an item without any price comes back with price null"""
+    from .item_utils import get_item_record
+    from .price_utils import resolve_prices
+
+    if get_item_record(db, item_code) is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return resolve_prices(db, [item_code], price_list, transaction_type, posting_date)[0]
+
+@router.post("/get-prices/", response_model=List[schemas.ResolvedPrice])
+def get_item_prices_endpoint(request: schemas.PriceLookupRequest, db: Session = Depends(get_db)):
+    """Get the prices of many items at once; items without any price come back with price null"""
+    from .price_utils import resolve_prices
+
+    if len(request.item_codes) > 5000:
+        raise HTTPException(status_code=400, detail="At most 5000 items per request")
+    return resolve_prices(
+        db, request.item_codes, request.price_list, request.transaction_type, request.posting_date
+    )
+
+@router.post("/reprice/", response_model=List[schemas.RepricedLine])
+def reprice_sales_invoice_lines(request: schemas.RepriceRequest, db: Session = Depends(get_db)):
+    """Compare sales invoice line rates with the list price valid on each invoice's posting date"""
+    from modules.selling.invoice_models import SalesInvoice, SalesInvoiceItem
+    from .price_utils import reprice_lines
+
+    if not (request.sales_invoice_ids or request.from_date or request.to_date):
+        raise HTTPException(status_code=400, detail="Give sales_invoice_ids or a date range")
+
+    query = db.query(
+        SalesInvoiceItem.sales_invoice_id,
+        SalesInvoiceItem.id.label('line_id'),
+        SalesInvoiceItem.item_code,
+        SalesInvoice.posting_date,
+        SalesInvoiceItem.qty,
+        SalesInvoiceItem.rate
+    ).join(SalesInvoice, SalesInvoiceItem.sales_invoice_id == SalesInvoice.id).filter(
+        SalesInvoice.status != "Cancelled"
+    )
+    if request.sales_invoice_ids:
+        query = query.filter(SalesInvoice.id.in_(request.sales_invoice_ids))
+    if request.from_date:
+        query = query.filter(SalesInvoice.posting_date >= request.from_date)
+    if request.to_date:
+        query = query.filter(SalesInvoice.posting_date <= request.to_date)
+
+    lines = [dict(row._mapping) for row in query.order_by(SalesInvoice.posting_date, SalesInvoiceItem.id).all()]
+    return reprice_lines(db, lines, request.price_list)
 
 # Serial No and Batch CRUD
 
@@ -336,10 +521,51 @@ def create_serial_no(serial: schemas.SerialNoCreate, db: Session = Depends(get_d
     return db_serial
 
 @router.get("/serial-nos/", response_model=List[schemas.SerialNo])
-def read_serial_nos(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    serials = db.query(serial_batch_models.SerialNo).offset(skip).limit(limit).all()
+def read_serial_nos(
+    response: Response,
+    item_code: str = None,
+    warehouse: str = None,
+    status: str = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    query = db.query(serial_batch_models.SerialNo)
+    if item_code:
+        query = query.filter(serial_batch_models.SerialNo.item_code == item_code)
+    if warehouse:
+        query = query.filter(serial_batch_models.SerialNo.warehouse == warehouse)
+    if status:
+        query = query.filter(serial_batch_models.SerialNo.status == status)
+    serials = paginate(query, response, [serial_batch_models.SerialNo.id], skip, limit, cursor)
     return serials
 
+@router.post("/serial-nos/validate", response_model=schemas.SerialNoValidation)
+def validate_serial_nos(request: schemas.SerialNoValidationRequest, db: Session = Depends(get_db)):
+    """Check that all given serials are in stock in a warehouse with one query"""
+    from .serial_utils import validate_serials
+
+    if len(request.serial_nos) > 50000:
+        raise HTTPException(status_code=400, detail="At most 50000 serial numbers per request")
+    return validate_serials(db, request.serial_nos, request.warehouse, request.item_code)
+
+@router.post("/serial-nos/rebuild")
+def rebuild_serial_nos(db: Session = Depends(get_db)):
+    """Rewrite serial movements and current serial status from the stock ledger"""
+    from .serial_utils import rebuild_serial_movements
+
+    result = rebuild_serial_movements(db)
+    db.commit()
+    return result
+
+@router.get("/serial-nos/{serial_no}/history", response_model=List[schemas.SerialNoMovement])
+def read_serial_no_history(serial_no: str, db: Session = Depends(get_db)):
+    """Movements of a serial number in posting order"""
+    from .serial_utils import get_serial_history
+
+    return get_serial_history(db, serial_no)
+
 @router.post("/batches/", response_model=schemas.Batch)
 def create_batch(batch: schemas.BatchCreate, db: Session = Depends(get_db)):
     db_batch = serial_batch_models.Batch(**batch.dict())
@@ -349,10 +575,52 @@ def create_batch(batch: schemas.BatchCreate, db: Session = Depends(get_db)):
     return db_batch
 
 @router.get("/batches/", response_model=List[schemas.Batch])
-def read_batches(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    batches = db.query(serial_batch_models.Batch).offset(skip).limit(limit).all()
+def read_batches(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    batches = paginate(db.query(serial_batch_models.Batch), response, [serial_batch_models.Batch.id], skip, limit, cursor)
     return batches
 
+@router.get("/batch-balances", response_model=List[schemas.BatchBalance])
+def read_batch_balances(
+    response: Response,
+    item_code: str = None,
+    warehouse: str = None,
+    batch_no: str = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Batch balances in stock with their expiry, from the batch balance table"""
+    from sqlalchemy import and_
+    BatchBin = serial_batch_models.BatchBin
+    Batch = serial_batch_models.Batch
+
+    query = db.query(
+        BatchBin.id, BatchBin.item_code, BatchBin.warehouse, BatchBin.batch_no, BatchBin.actual_qty, Batch.expiry_date
+    ).outerjoin(Batch, and_(
+        Batch.batch_id == BatchBin.batch_no,
+        Batch.item_code == BatchBin.item_code
+    )).filter(BatchBin.actual_qty != 0)
+    if item_code:
+        query = query.filter(BatchBin.item_code == item_code)
+    if warehouse:
+        query = query.filter(BatchBin.warehouse == warehouse)
+    if batch_no:
+        query = query.filter(BatchBin.batch_no == batch_no)
+    return paginate(query, response, [BatchBin.id], skip, limit, cursor)
+
+@router.post("/batches/allocate", response_model=List[schemas.BatchAllocation])
+def allocate_batches(request: schemas.BatchAllocationRequest, db: Session = Depends(get_db)):
+    """Allocate batches to demand lines first expiry first out; nothing is posted"""
+    from .batch_utils import allocate_batches
+
+    return allocate_batches(
+        db,
+        [demand.dict() for demand in request.demands],
+        posting_date=request.posting_date,
+        exclude_expired=request.exclude_expired
+    )
+
 # Material Request
 @router.post("/material-requests/", response_model=schemas.MaterialRequest)
 def create_material_request(
@@ -388,8 +656,8 @@ def create_material_request(
     return db_mr
 
 @router.get("/material-requests/", response_model=List[schemas.MaterialRequest])
-def read_material_requests(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.MaterialRequest).offset(skip).limit(limit).all()
+def read_material_requests(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.MaterialRequest), response, [models.MaterialRequest.id], skip, limit, cursor)
 
 @router.post("/material-requests/{mr_id}/submit")
 def submit_material_request(mr_id: int, db: Session = Depends(get_db)):
@@ -401,12 +669,27 @@ def submit_material_request(mr_id: int, db: Session = Depends(get_db)):
     submit_document(db, mr, 1) # User ID 1 for now
     return {"message": "Material Request submitted", "status": mr.status}
 
+@router.post("/material-requests/consolidate")
+def consolidate_material_requests(request: schemas.MaterialRequestConsolidation, db: Session = Depends(get_db)):
+    """Order the pending qty of all submitted Purchase material requests, one draft Purchase Order per supplier"""
+    from .material_request_utils import consolidate_material_requests
+
+    return consolidate_material_requests(
+        db,
+        material_request_ids=request.material_request_ids,
+        default_supplier_id=request.default_supplier_id,
+        transaction_date=request.transaction_date
+    )
+
 @router.post("/material-requests/{mr_id}/make-purchase-order")
 def make_purchase_order_from_mr(
     mr_id: int,
+    default_supplier_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """Create Purchase Order from Material Request"""
+    """Create Purchase Orders from a Material Request, one per default supplier of its items"""
+    from .material_request_utils import consolidate_material_requests
+
     mr = db.query(models.MaterialRequest).filter(models.MaterialRequest.id == mr_id).first()
     if not mr:
         raise HTTPException(status_code=404, detail="Material Request not found")
@@ -414,482 +697,146 @@ def make_purchase_order_from_mr(
         raise HTTPException(status_code=400, detail="Material Request type must be Purchase")
     if mr.docstatus != 1:
         raise HTTPException(status_code=400, detail="Material Request must be submitted")
-        
-    # Create PO
-    from modules.buying.models import PurchaseOrder, PurchaseOrderItem
-    from core.numbering import get_next_number
-    from datetime import date
-    
-    today = date.today()
-    doc_name = get_next_number(db, "Purchase Order", date=today)
-    
-    # We need a supplier. For now, create PO without supplier (Draft), user must select.
-    # But PO model requires supplier_id.
-    # So we can't fully automate unless we know the supplier.
-    # Strategy: Return data structure for frontend to populate "New Purchase Order" form.
-    # BUT user asked for "Make > Purchase Order" action.
-    # In ERPNext, it opens a Mapper.
-    # Here, let's create a Draft PO with a placeholder supplier or throw error?
-    # Better: Create Draft PO with supplier_id=1 (First supplier) as default, let user change?
-    # Or just return the items to frontend?
-    # Let's implement it as "Create Draft PO with ID 1 (Demo Supplier) and items".
-    
-    supplier_id = 1 # Default
-    
-    po = PurchaseOrder(
-        name=doc_name,
-        supplier_id=supplier_id,
-        transaction_date=today,
-        status="Draft",
-        docstatus=0
-    )
-    db.add(po)
-    db.commit()
-    db.refresh(po)
-    
-    for item in mr.items:
-        pending_qty = item.qty - item.ordered_qty
-        if pending_qty > 0:
-            po_item = PurchaseOrderItem(
-                purchase_order_id=po.id,
-                item_code=item.item_code,
-                qty=pending_qty,
-                rate=0.0, # Fetch from Price List ideally
-                amount=0.0
+
+    result = consolidate_material_requests(db, material_request_ids=[mr_id], default_supplier_id=default_supplier_id)
+    if not result["purchase_order_ids"]:
+        if result["unassigned_items"]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"No supplier for items: {', '.join(result['unassigned_items'])}. "
+                       "Set their default supplier or pass default_supplier_id"
             )
-            db.add(po_item)
-            
-            # Update ordered qty
-            item.ordered_qty += pending_qty
-            
-    mr.status = "Ordered" # Or partial
+        raise HTTPException(status_code=400, detail="Material Request is already fully ordered")
+
+    return {
+        "message": "Purchase Order created",
+        "purchase_order_id": result["purchase_order_ids"][0],
+        "purchase_order_ids": result["purchase_order_ids"],
+        "unassigned_items": result["unassigned_items"]
+    }
+
+# Reorder
+@router.post("/reorder-levels/")
+def set_reorder_levels(levels: List[schemas.ItemReorderCreate], db: Session = Depends(get_db)):
+    """Insert or update reorder levels for many item-warehouse pairs"""
+    from .reorder_utils import set_reorder_levels
+
+    count = set_reorder_levels(db, [level.dict() for level in levels])
     db.commit()
-    
-    return {"message": "Purchase Order created", "purchase_order_id": po.id}
+    return {"message": "Reorder levels saved", "count": count}
 
-# Stock Reconciliation
-@router.post("/reconciliations/", response_model=schemas.StockReconciliation)
-def create_stock_reconciliation(
-    reco: schemas.StockReconciliationCreate,
+@router.get("/reorder-levels/", response_model=List[schemas.ItemReorder])
+def read_reorder_levels(
+    response: Response,
+    item_code: str = None,
+    warehouse: str = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """Create a Stock Reconciliation"""
-    from core.numbering import get_next_number
-    
-    doc_name = get_next_number(db, "Stock Reconciliation", date=reco.posting_date)
-    
-    db_reco = models.StockReconciliation(
-        name=doc_name,
-        posting_date=reco.posting_date,
-        purpose=reco.purpose,
-        status="Draft",
-        docstatus=0
-    )
-    db.add(db_reco)
-    db.commit()
-    db.refresh(db_reco)
-    
-    for item in reco.items:
-        db_item = models.StockReconciliationItem(
-            stock_reconciliation_id=db_reco.id,
-            **item.dict()
-        )
-        db.add(db_item)
-        
-    db.commit()
-    db.refresh(db_reco)
-    return db_reco
+    query = db.query(models.ItemReorder)
+    if item_code:
+        query = query.filter(models.ItemReorder.item_code == item_code)
+    if warehouse:
+        query = query.filter(models.ItemReorder.warehouse == warehouse)
+    return paginate(query, response, [models.ItemReorder.id], skip, limit, cursor)
 
-@router.get("/reconciliations/", response_model=List[schemas.StockReconciliation])
-def read_stock_reconciliations(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.StockReconciliation).offset(skip).limit(limit).all()
+@router.get("/reorder/shortfalls", response_model=List[schemas.ReorderShortfall])
+def read_reorder_shortfalls(db: Session = Depends(get_db)):
+    """Pairs below their reorder level and the qty the reorder engine would request"""
+    from .reorder_utils import get_shortfalls
 
-@router.post("/reconciliations/{reco_id}/submit")
-def submit_stock_reconciliation(reco_id: int, db: Session = Depends(get_db)):
-    from core.document_lifecycle import submit_document
-    
-    reco = db.query(models.StockReconciliation).filter(models.StockReconciliation.id == reco_id).first()
-    if not reco:
-        raise HTTPException(status_code=404, detail="Reconciliation not found")
-        
-    if reco.docstatus == 1:
-        raise HTTPException(status_code=400, detail="Already submitted")
-        
-    # Process each item
-    for item in reco.items:
-        # 1. Get current stock balance
-        last_sle = db.query(models.StockLedgerEntry).filter(
-            models.StockLedgerEntry.item_code == item.item_code,
-            models.StockLedgerEntry.warehouse == item.warehouse
-        ).order_by(models.StockLedgerEntry.id.desc()).first()
-        
-        current_qty = last_sle.qty_after_transaction if last_sle else 0.0
-        current_valuation = last_sle.valuation_rate if last_sle else 0.0
-        
-        # Store snapshot
-        item.current_qty = current_qty
-        item.current_valuation_rate = current_valuation
-        
-        # 2. Calculate difference
-        qty_diff = item.qty - current_qty
-        
-        # 3. Create Ledger Entry if difference
-        if abs(qty_diff) > 0.0:
-            # New Valuation Rate: Use provided rate if > 0, else keep current
-            new_valuation_rate = item.valuation_rate if item.valuation_rate > 0 else current_valuation
-            
-            # Calculate value difference
-            # If qty changed: (New Qty * New Rate) - (Old Qty * Old Rate)
-            # Wait, simplified logic:
-            # SLE should reflect the change.
-            # actual_qty = qty_diff
-            # qty_after = item.qty
-            # valuation_rate = new_valuation_rate
-            # stock_value = qty_after * valuation_rate
-            
-            sle = models.StockLedgerEntry(
-                item_code=item.item_code,
-                warehouse=item.warehouse,
-                posting_date=reco.posting_date,
-                voucher_type="Stock Reconciliation",
-                voucher_no=reco.name or str(reco.id),
-                actual_qty=qty_diff,
-                qty_after_transaction=item.qty,
-                stock_uom="Nos",
-                valuation_rate=new_valuation_rate,
-                stock_value=item.qty * new_valuation_rate,
-                stock_value_difference=(item.qty * new_valuation_rate) - (current_qty * current_valuation)
-            )
-            db.add(sle)
-            
-    submit_document(db, reco, 1)
-    return {"message": "Stock Reconciliation submitted", "status": reco.status}
+    return get_shortfalls(db)
 
-# Stock Reconciliation
-@router.post("/reconciliations/", response_model=schemas.StockReconciliation)
-def create_stock_reconciliation(
-    reco: schemas.StockReconciliationCreate,
-    db: Session = Depends(get_db)
-):
-    from core.numbering import get_next_number
-    from .models import StockReconciliation, StockReconciliationItem, StockLedgerEntry
-    
-    doc_name = get_next_number(db, "Stock Reconciliation", date=reco.posting_date)
-    
-    db_reco = StockReconciliation(
-        name=doc_name,
-        posting_date=reco.posting_date,
-        purpose=reco.purpose,
-        status="Draft",
-        docstatus=0
-    )
-    db.add(db_reco)
-    db.commit()
-    db.refresh(db_reco)
-    
-    for item in reco.items:
-        # Fetch current balance for snapshot (optional but good for reference)
-        # We reuse logic from get_stock_balance logic roughly
-        last_sle = db.query(StockLedgerEntry).filter(
-            StockLedgerEntry.item_code == item.item_code,
-            StockLedgerEntry.warehouse == item.warehouse
-        ).order_by(StockLedgerEntry.id.desc()).first()
-        
-        current_qty = last_sle.qty_after_transaction if last_sle else 0.0
-        current_val_rate = last_sle.valuation_rate if last_sle else 0.0
-        
-        db_item = StockReconciliationItem(
-            stock_reconciliation_id=db_reco.id,
-            current_qty=current_qty,
-            current_valuation_rate=current_val_rate,
-            **item.dict()
-        )
-        db.add(db_item)
-        
-    db.commit()
-    db.refresh(db_reco)
-    return db_reco
+@router.post("/reorder/run")
+def run_reorder(db: Session = Depends(get_db)):
+    """Raise material requests for all shortfalls; meant to be called by a scheduler"""
+    from .reorder_utils import run_reorder
 
-@router.get("/reconciliations/", response_model=List[schemas.StockReconciliation])
-def read_stock_reconciliations(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.StockReconciliation).offset(skip).limit(limit).all()
+    return run_reorder(db)
 
-@router.post("/reconciliations/{reco_id}/submit")
-def submit_stock_reconciliation(reco_id: int, db: Session = Depends(get_db)):
-    from core.document_lifecycle import submit_document
-    from .models import StockReconciliation, StockLedgerEntry
+# Stock Reconciliation
+def _start_reconciliation_submit(db: Session, reco: models.StockReconciliation, background_tasks: BackgroundTasks) -> dict:
+    """Submit small reconciliations inline, queue large ones and let the caller poll progress"""
+    from .reconciliation_utils import (
+        submit_reconciliation, run_reconciliation_submit,
+        QUEUED, IN_PROGRESS, FAILED, RECONCILIATION_SYNC_LINES
+    )
     
-    reco = db.query(StockReconciliation).filter(StockReconciliation.id == reco_id).first()
-    if not reco:
-        raise HTTPException(status_code=404, detail="Reconciliation not found")
     if reco.docstatus == 1:
         raise HTTPException(status_code=400, detail="Already submitted")
-        
-    # Process Adjustment
-    for item in reco.items:
-        # Get CURRENT balance at time of submission (to be safe)
-        last_sle = db.query(StockLedgerEntry).filter(
-            StockLedgerEntry.item_code == item.item_code,
-            StockLedgerEntry.warehouse == item.warehouse
-        ).order_by(StockLedgerEntry.id.desc()).first()
-        
-        current_qty = last_sle.qty_after_transaction if last_sle else 0.0
-        
-        difference = item.qty - current_qty
-        
-        if abs(difference) > 0.0:
-            # Create SLE
-            # Note: We are using create_ledger_entry helper logic but manually here to override values
-            # Or we can use create_ledger_entry if we construct proper args
-            
-            entry_data = {
-                'transaction_date': reco.posting_date,
-                'voucher_type': 'Stock Reconciliation',
-                'purpose': 'Stock Reconciliation'
-            }
-            item_data = {
-                'item_code': item.item_code,
-                'basic_rate': item.valuation_rate or (last_sle.valuation_rate if last_sle else 0.0)
-            }
-            
-            # If valuation rate changed, we might need more complex logic (revaluation)
-            # For now, we just post the difference qty at the *new* rate (or old rate if not provided)
-            
-            create_ledger_entry(
-                db, 
-                item_data, 
-                difference, 
-                item.warehouse, 
-                entry_data, 
-                reco.id # Use ID as voucher_no for now or name? logic expects int.
-                # Wait, create_ledger_entry expects voucher_no as int?
-                # models.StockLedgerEntry.voucher_no is Integer.
-                # But previously I fixed it to allow string? No, I fixed the submit_journal_entry logic to pass Name or ID.
-                # Let's check model definition.
-                # StockLedgerEntry.voucher_no is Integer (line 38).
-                # But Journal Entries use string names?
-                # Ah, Journal Entry logic I wrote uses .
-                # If  is string (e.g. ACC-JV-...), and  is Integer...
-                # PostgreSQL might complain if I try to insert string into int column!
-                # Wait, I missed that.  voucher_no is Integer.
-                #  voucher_no is String.
-                # GL Entry voucher_no is String usually.
-                # Let's check  model in  (read earlier).
-                # Line 38: 
-                # This is a design flaw if I want to use Document Names (Strings).
-                # I should change it to String.
-                # BUT changing column type requires migration (ALTER TABLE).
-                # SQLite accepts string in int column sometimes, PG definitely NOT.
-                # So if I try to put "MAT-REQ-..." into it, it will fail.
-                # Current usage:  uses  (int) in .
-                # So for Stock Entry it's fine.
-                # For Reconciliation, using  (int) is fine.
-                # So I will use .
-            )
-            
-    submit_document(db, reco, 1)
+    if reco.status in (QUEUED, IN_PROGRESS):
+        raise HTTPException(status_code=400, detail=f"Submission is already {reco.status.lower()}")
+    
+    if (reco.total_lines or 0) > RECONCILIATION_SYNC_LINES:
+        reco.status = QUEUED
+        db.commit()
+        background_tasks.add_task(run_reconciliation_submit, reco.id)
+        return {"message": "Stock Reconciliation queued for submission", "status": reco.status}
+    
+    submit_reconciliation(db, reco)
+    if reco.status == FAILED:
+        raise HTTPException(status_code=500, detail=f"Stock Reconciliation failed: {reco.error}")
+    background_tasks.add_task(run_repost_queue)
     return {"message": "Stock Reconciliation submitted", "status": reco.status}
 
-# Stock Reconciliation
 @router.post("/reconciliations/", response_model=schemas.StockReconciliation)
 def create_stock_reconciliation(
     reco: schemas.StockReconciliationCreate,
     db: Session = Depends(get_db)
 ):
-    """Create Stock Reconciliation"""
-    from core.numbering import get_next_number
-    
-    doc_name = get_next_number(db, "Stock Reconciliation", date=reco.posting_date)
+    """Create a Stock Reconciliation, snapshotting current balances for all lines at once"""
+    from .reconciliation_utils import create_reconciliation
     
-    db_reco = models.StockReconciliation(
-        name=doc_name,
-        posting_date=reco.posting_date,
-        posting_time=reco.posting_time,
-        purpose=reco.purpose,
-        status="Draft",
-        docstatus=0
+    return create_reconciliation(
+        db, reco.posting_date, reco.posting_time, reco.purpose,
+        [item.dict() for item in reco.items]
     )
-    db.add(db_reco)
-    db.commit()
-    db.refresh(db_reco)
-    
-    for item in reco.items:
-        # Fetch current balance snapshot
-        from .router import get_stock_balance
-        balance_info = get_stock_balance(item.item_code, db)
-        # Note: get_stock_balance gives total across all warehouses? No, wait.
-        # The get_stock_balance function I wrote earlier finds LAST entry for item_code.
-        # But it doesn't filter by warehouse if not passed?
-        # Let's check get_stock_balance implementation.
-        # It does 
-        # This is WRONG for multi-warehouse. It gets the absolute last entry, which might be for another warehouse.
-        # I need to fix  or write a specific query here.
-        # The ledger logic  correctly filters by warehouse to find last entry.
-        
-        last_sle = db.query(models.StockLedgerEntry).filter(
-            models.StockLedgerEntry.item_code == item.item_code,
-            models.StockLedgerEntry.warehouse == item.warehouse
-        ).order_by(models.StockLedgerEntry.id.desc()).first()
-        
-        current_qty = last_sle.qty_after_transaction if last_sle else 0.0
-        current_val_rate = last_sle.valuation_rate if last_sle else 0.0
-        
-        db_item = models.StockReconciliationItem(
-            reconciliation_id=db_reco.id,
-            current_qty=current_qty,
-            current_valuation_rate=current_val_rate,
-            **item.dict()
-        )
-        db.add(db_item)
-        
-    db.commit()
-    db.refresh(db_reco)
-    return db_reco
+
+@router.post("/reconciliations/upload", response_model=schemas.StockReconciliationProgress)
+async def upload_stock_reconciliation(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    posting_date: date = Form(...),
+    posting_time: str = Form("00:00:00"),
+    purpose: str = Form("Stock Reconciliation"),
+    submit: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    """
+    Create a Stock Reconciliation from a CSV physical count
+    (columns item_code, warehouse, qty and optionally valuation_rate).
+    With submit, the count is posted right away - large counts in the
+    background, see /reconciliations/{reco_id}/progress.
+    """
+    from .reconciliation_utils import parse_reconciliation_csv, create_reconciliation
+    
+    lines = parse_reconciliation_csv(await file.read())
+    reco = create_reconciliation(db, posting_date, posting_time, purpose, lines)
+    if submit:
+        _start_reconciliation_submit(db, reco, background_tasks)
+    return reco
 
 @router.get("/reconciliations/", response_model=List[schemas.StockReconciliation])
-def read_reconciliations(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.StockReconciliation).offset(skip).limit(limit).all()
+def read_stock_reconciliations(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    return paginate(db.query(models.StockReconciliation), response, [models.StockReconciliation.id], skip, limit, cursor)
 
-@router.post("/reconciliations/{reco_id}/submit")
-def submit_stock_reconciliation(reco_id: int, db: Session = Depends(get_db)):
+@router.get("/reconciliations/{reco_id}/progress", response_model=schemas.StockReconciliationProgress)
+def get_stock_reconciliation_progress(reco_id: int, db: Session = Depends(get_db)):
     reco = db.query(models.StockReconciliation).filter(models.StockReconciliation.id == reco_id).first()
     if not reco:
         raise HTTPException(status_code=404, detail="Reconciliation not found")
-    if reco.docstatus == 1:
-        raise HTTPException(status_code=400, detail="Already submitted")
-        
-    # Create Ledger Entries
-    for item in reco.items:
-        qty_diff = item.qty - item.current_qty
-        
-        # Only create entry if there is a difference
-        if qty_diff != 0 or item.valuation_rate != item.current_valuation_rate:
-            # If qty changed, we treat it as receipt/issue
-            # If only rate changed, we adjust value (complex, skipped for now, assume simple qty adjust)
-            
-            # Prepare dummy item_data for create_ledger_entry
-            # create_ledger_entry expects: item_code, basic_rate (new rate)
-            item_data = {
-                'item_code': item.item_code,
-                'basic_rate': item.valuation_rate,
-                'qty': abs(qty_diff) # Just for reference
-            }
-            
-            entry_data = {
-                'transaction_date': reco.posting_date,
-                'voucher_type': "Stock Reconciliation",
-                'purpose': reco.purpose
-            }
-            
-            create_ledger_entry(
-                db, 
-                item_data, 
-                qty_diff, 
-                item.warehouse, 
-                entry_data, 
-                reco.id # voucher_no using ID as int? 
-                # Wait, voucher_no is Integer in StockLedgerEntry model?
-                # Let's check model. Yes .
-                # But Sales Order used string name?
-                # My recent fix for Journal Entry used .
-                # If StockLedgerEntry.voucher_no is Integer, passing string will fail.
-                # Let's check .
-                # 
-                # So voucher_no MUST be int.
-                # But Purchase Invoice uses ID.
-                # So passing reco.id is correct.
-            )
-            
-    from core.document_lifecycle import submit_document
-    submit_document(db, reco, 1)
-    
-    return {"message": "Stock Reconciliation submitted", "status": reco.status}
-
-# Stock Reconciliation
-@router.post("/reconciliations/", response_model=schemas.StockReconciliation)
-def create_stock_reconciliation(
-    reco: schemas.StockReconciliationCreate,
-    db: Session = Depends(get_db)
-):
-    """Create Stock Reconciliation"""
-    from core.numbering import get_next_number
-    
-    doc_name = get_next_number(db, "Stock Reconciliation", date=reco.posting_date)
-    
-    db_reco = models.StockReconciliation(
-        name=doc_name,
-        posting_date=reco.posting_date,
-        posting_time=reco.posting_time,
-        purpose=reco.purpose,
-        status="Draft",
-        docstatus=0
-    )
-    db.add(db_reco)
-    db.commit()
-    db.refresh(db_reco)
-    
-    for item in reco.items:
-        # Fetch current balance snapshot for specific warehouse
-        last_sle = db.query(models.StockLedgerEntry).filter(
-            models.StockLedgerEntry.item_code == item.item_code,
-            models.StockLedgerEntry.warehouse == item.warehouse
-        ).order_by(models.StockLedgerEntry.id.desc()).first()
-        
-        current_qty = last_sle.qty_after_transaction if last_sle else 0.0
-        current_val_rate = last_sle.valuation_rate if last_sle else 0.0
-        
-        db_item = models.StockReconciliationItem(
-            reconciliation_id=db_reco.id,
-            current_qty=current_qty,
-            current_valuation_rate=current_val_rate,
-            **item.dict()
-        )
-        db.add(db_item)
-        
-    db.commit()
-    db.refresh(db_reco)
-    return db_reco
-
-@router.get("/reconciliations/", response_model=List[schemas.StockReconciliation])
-def read_reconciliations(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.StockReconciliation).offset(skip).limit(limit).all()
+    return reco
 
 @router.post("/reconciliations/{reco_id}/submit")
-def submit_stock_reconciliation(reco_id: int, db: Session = Depends(get_db)):
+def submit_stock_reconciliation(reco_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """
+    Post the adjusting ledger entries. Reconciliations over a size limit are
+    queued and submitted in the background; a Failed one resumes where it stopped.
+    """
     reco = db.query(models.StockReconciliation).filter(models.StockReconciliation.id == reco_id).first()
     if not reco:
         raise HTTPException(status_code=404, detail="Reconciliation not found")
-    if reco.docstatus == 1:
-        raise HTTPException(status_code=400, detail="Already submitted")
-        
-    # Create Ledger Entries
-    for item in reco.items:
-        qty_diff = item.qty - item.current_qty
-        
-        if qty_diff != 0 or item.valuation_rate != item.current_valuation_rate:
-            item_data = {
-                'item_code': item.item_code,
-                'basic_rate': item.valuation_rate,
-                'qty': abs(qty_diff)
-            }
-            
-            entry_data = {
-                'transaction_date': reco.posting_date,
-                'voucher_type': "Stock Reconciliation",
-                'purpose': reco.purpose
-            }
-            
-            # Use reco.id as voucher_no because StockLedgerEntry.voucher_no is Integer
-            create_ledger_entry(
-                db, 
-                item_data, 
-                qty_diff, 
-                item.warehouse, 
-                entry_data, 
-                reco.id 
-            )
-            
-    from core.document_lifecycle import submit_document
-    submit_document(db, reco, 1)
     
-    return {"message": "Stock Reconciliation submitted", "status": reco.status}
+    return _start_reconciliation_submit(db, reco, background_tasks)
@@ -1,6 +1,6 @@
 from typing import List, Optional
 from pydantic import BaseModel
-from datetime import date
+from datetime import date, datetime
 
 class StockEntryDetailBase(BaseModel):
     item_code: str
@@ -43,17 +43,82 @@ class StockLedgerEntry(BaseModel):
     posting_date: date
     voucher_type: str
     voucher_no: int
+    voucher_detail_no: Optional[int] = None
     actual_qty: float
     qty_after_transaction: float
     stock_uom: str
     valuation_rate: float
     stock_value: float
+    incoming_rate: Optional[float] = 0.0
     serial_no: Optional[str] = None
     batch_no: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class Bin(BaseModel):
+    id: int
+    item_code: str
+    warehouse: str
+    actual_qty: float
+    valuation_rate: float
+    stock_value: float
+    valuation_method: str = "Moving Average"
+    ordered_qty: float = 0.0
+    reserved_qty: float = 0.0
+    planned_qty: float = 0.0
+    projected_qty: float = 0.0
+
+    class Config:
+        from_attributes = True
+
+class StockAvailability(BaseModel):
+    item_code: str
+    warehouse: Optional[str] = None # None when summed over warehouses
+    actual_qty: float = 0.0
+    ordered_qty: float = 0.0
+    reserved_qty: float = 0.0
+    planned_qty: float = 0.0
+    projected_qty: float = 0.0
+
+class StockAgeing(BaseModel):
+    item_code: str
+    warehouse: str
+    qty: float
+    valuation_rate: float
+    stock_value: float
+    average_age: float
+    oldest_age: int
+    # Qty and value per ageing range in days (see ageing_utils.AGEING_RANGES)
+    qty_0_30: float = 0.0
+    qty_31_60: float = 0.0
+    qty_61_90: float = 0.0
+    qty_90_plus: float = 0.0
+    value_0_30: float = 0.0
+    value_31_60: float = 0.0
+    value_61_90: float = 0.0
+    value_90_plus: float = 0.0
+
+class BinValuationMethodUpdate(BaseModel):
+    item_code: str
+    warehouse: str
+    valuation_method: str  # "Moving Average" or "FIFO"
+
+class RepostItemValuationCreate(BaseModel):
+    item_code: str
+    warehouse: str
+    posting_date: date
+    posting_time: str = "00:00:00"
+
+class RepostItemValuation(RepostItemValuationCreate):
+    id: int
+    status: str
+    entries_reposted: int = 0
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
 # Serial No and Batch Schemas
 class SerialNoBase(BaseModel):
     serial_no: str
@@ -68,12 +133,39 @@ class SerialNoCreate(SerialNoBase):
 
 class SerialNo(SerialNoBase):
     id: int
-    created_at: date # datetime converted to date for simplicity or string
-    updated_at: date
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class SerialNoMovement(BaseModel):
+    id: int
+    serial_no: str
+    item_code: str
+    warehouse: str
+    actual_qty: float
+    posting_date: date
+    posting_time: str
+    voucher_type: str
+    voucher_no: int
+    stock_ledger_entry_id: int
 
     class Config:
         from_attributes = True
 
+class SerialNoValidationRequest(BaseModel):
+    serial_nos: List[str]
+    warehouse: str
+    item_code: Optional[str] = None
+
+class SerialNoValidation(BaseModel):
+    valid: bool
+    checked: int
+    missing: List[str] = []
+    not_in_warehouse: List[str] = []
+    wrong_item: List[str] = []
+
 class BatchBase(BaseModel):
     batch_id: str
     item_code: str
@@ -85,12 +177,42 @@ class BatchCreate(BatchBase):
 
 class Batch(BatchBase):
     id: int
-    created_at: date
-    updated_at: date
+    created_at: datetime
+    updated_at: datetime
 
     class Config:
         from_attributes = True
 
+class BatchBalance(BaseModel):
+    item_code: str
+    warehouse: str
+    batch_no: str
+    actual_qty: float
+    expiry_date: Optional[date] = None
+
+class BatchDemand(BaseModel):
+    item_code: str
+    warehouse: str
+    qty: float
+
+class BatchAllocationRequest(BaseModel):
+    demands: List[BatchDemand]
+    posting_date: Optional[date] = None
+    exclude_expired: bool = True
+
+class BatchAllocationLine(BaseModel):
+    batch_no: str
+    qty: float
+    expiry_date: Optional[date] = None
+
+class BatchAllocation(BaseModel):
+    item_code: str
+    warehouse: str
+    qty: float
+    allocated_qty: float
+    shortage: float
+    batches: List[BatchAllocationLine] = []
+
 
 class ItemPriceBase(BaseModel):
     item_code: str
@@ -109,6 +231,38 @@ class ItemPrice(ItemPriceBase):
     class Config:
         from_attributes = True
 
+class PriceLookupRequest(BaseModel):
+    item_codes: List[str]
+    price_list: Optional[str] = None # Name of price list
+    transaction_type: str = "selling" # buying or selling
+    posting_date: Optional[date] = None
+
+class RepriceRequest(BaseModel):
+    sales_invoice_ids: List[int] = []
+    from_date: Optional[date] = None
+    to_date: Optional[date] = None
+    price_list: Optional[str] = None # Name of price list, default the selling lists
+
+class RepricedLine(BaseModel):
+    sales_invoice_id: int
+    line_id: int
+    item_code: str
+    posting_date: date
+    qty: float = 0.0
+    rate: float = 0.0
+    price_list_rate: Optional[float] = None
+    price_list: Optional[str] = None
+    source: Optional[str] = None
+    rate_difference: Optional[float] = None
+    amount_difference: Optional[float] = None
+
+class ResolvedPrice(BaseModel):
+    item_code: str
+    price: Optional[float] = None
+    currency: str = "USD"
+    price_list: Optional[str] = None
+    source: Optional[str] = None # Price List, Standard Rate or None when not found
+
 class MaterialRequestItemBase(BaseModel):
     item_code: str
     qty: float
@@ -144,62 +298,53 @@ class MaterialRequest(MaterialRequestBase):
     class Config:
         from_attributes = True
 
-class StockReconciliationItemBase(BaseModel):
+class ItemReorderBase(BaseModel):
     item_code: str
     warehouse: str
-    qty: float
-    valuation_rate: float
+    reorder_level: float = 0.0
+    reorder_qty: float = 0.0
+    material_request_type: str = "Purchase"
 
-class StockReconciliationItemCreate(StockReconciliationItemBase):
+class ItemReorderCreate(ItemReorderBase):
     pass
 
-class StockReconciliationItem(StockReconciliationItemBase):
+class ItemReorder(ItemReorderBase):
     id: int
-    stock_reconciliation_id: int
-    current_qty: float = 0.0
-    current_valuation_rate: float = 0.0
 
     class Config:
         from_attributes = True
 
-class StockReconciliationBase(BaseModel):
-    posting_date: date
-    purpose: str = "Stock Reconciliation"
-    status: str = "Draft"
-
-class StockReconciliationCreate(StockReconciliationBase):
-    items: List[StockReconciliationItemCreate]
+class ReorderShortfall(ItemReorderBase):
+    projected_qty: float
+    qty: float # To request
 
-class StockReconciliation(StockReconciliationBase):
-    id: int
-    name: Optional[str] = None
-    items: List[StockReconciliationItem]
-
-    class Config:
-        from_attributes = True
+class MaterialRequestConsolidation(BaseModel):
+    material_request_ids: Optional[List[int]] = None # Default all pending Purchase requests
+    default_supplier_id: Optional[int] = None # For items without a default supplier
+    transaction_date: Optional[date] = None
 
 class StockReconciliationItemBase(BaseModel):
     item_code: str
     warehouse: str
     qty: float
-    valuation_rate: float = 0.0
+    valuation_rate: float = 0.0 # 0 keeps the current rate
 
 class StockReconciliationItemCreate(StockReconciliationItemBase):
     pass
 
 class StockReconciliationItem(StockReconciliationItemBase):
     id: int
-    stock_reconciliation_id: int
-    current_qty: float = 0.0
-    current_valuation_rate: float = 0.0
+    reconciliation_id: int
+    current_qty: float
+    current_valuation_rate: float
 
     class Config:
         from_attributes = True
 
 class StockReconciliationBase(BaseModel):
     posting_date: date
+    posting_time: str = "00:00:00"
     purpose: str = "Stock Reconciliation"
-    status: str = "Draft"
 
 class StockReconciliationCreate(StockReconciliationBase):
     items: List[StockReconciliationItemCreate]
@@ -207,42 +352,20 @@ class StockReconciliationCreate(StockReconciliationBase):
 class StockReconciliation(StockReconciliationBase):
     id: int
     name: Optional[str] = None
+    status: str
     items: List[StockReconciliationItem]
 
     class Config:
         from_attributes = True
 
-class StockReconciliationItemBase(BaseModel):
-    item_code: str
-    warehouse: str
-    qty: float
-    valuation_rate: float
-
-class StockReconciliationItemCreate(StockReconciliationItemBase):
-    pass
-
-class StockReconciliationItem(StockReconciliationItemBase):
-    id: int
-    reconciliation_id: int
-    current_qty: float
-    current_valuation_rate: float
-
-    class Config:
-        from_attributes = True
-
-class StockReconciliationBase(BaseModel):
-    posting_date: date
-    posting_time: str = "00:00:00"
-    purpose: str = "Stock Reconciliation"
-
-class StockReconciliationCreate(StockReconciliationBase):
-    items: List[StockReconciliationItemCreate]
-
-class StockReconciliation(StockReconciliationBase):
+class StockReconciliationProgress(BaseModel):
     id: int
     name: Optional[str] = None
     status: str
-    items: List[StockReconciliationItem]
+    docstatus: int
+    total_lines: int = 0
+    processed_lines: int = 0
+    error: Optional[str] = None
 
     class Config:
         from_attributes = True
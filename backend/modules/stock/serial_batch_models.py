@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Date, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Date, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -9,14 +9,35 @@ class SerialNo(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     serial_no = Column(String, index=True, nullable=False)
-    item_code = Column(String, ForeignKey("items.item_code"), nullable=False)
-    warehouse = Column(String, nullable=True) # Current warehouse
+    item_code = Column(String, ForeignKey("items.item_code"), nullable=False, index=True)
+    warehouse = Column(String, nullable=True, index=True) # Current warehouse, kept by ledger postings
     status = Column(String, default="Active") # Active, Inactive, Expired, Sold
     purchase_date = Column(Date, nullable=True)
     warranty_expiry_date = Column(Date, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class SerialNoMovement(Base):
+    """One row per serial number per stock ledger entry, written during posting"""
+    __tablename__ = "serial_no_movements"
+    __table_args__ = (
+        # History of one serial in posting order
+        Index("ix_serial_movement_serial_posting", "serial_no", "posting_date", "posting_time", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    serial_no = Column(String, nullable=False)
+    item_code = Column(String, nullable=False)
+    warehouse = Column(String, nullable=False)
+    actual_qty = Column(Float, nullable=False) # +1 in, -1 out
+    posting_date = Column(Date)
+    posting_time = Column(String, default="00:00:00")
+    voucher_type = Column(String)
+    voucher_no = Column(Integer)
+    # No foreign key: the ledger may be partitioned with a composite primary key
+    stock_ledger_entry_id = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Batch(Base):
     """Batch Master"""
     __tablename__ = "batches"
@@ -29,3 +50,16 @@ class Batch(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+
+class BatchBin(Base):
+    """Materialized stock balance per item, warehouse and batch, kept by ledger postings"""
+    __tablename__ = "batch_bins"
+    __table_args__ = (
+        UniqueConstraint("item_code", "warehouse", "batch_no", name="uq_batch_bin"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    item_code = Column(String, nullable=False)
+    warehouse = Column(String, nullable=False)
+    batch_no = Column(String, nullable=False)
+    actual_qty = Column(Float, default=0.0)
@@ -0,0 +1,258 @@
+"""
+Serial Number Utilities
+Serial movements written with the stock ledger, current serial status and
+set-based serial validation
+"""
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, select, update
+from typing import Dict, Iterable, List, Optional, Tuple
+from .models import StockLedgerEntry
+from .serial_batch_models import SerialNo, SerialNoMovement
+
+ACTIVE = "Active"
+INACTIVE = "Inactive"
+SOLD = "Sold"
+
+# Serials leaving stock on these vouchers are marked Sold, other outward
+# movements (issues, purchase returns, ...) mark them Inactive
+SALES_VOUCHER_TYPES = ("Sales Order", "Sales Invoice", "Delivery Note")
+
+
+def parse_serial_nos(value) -> List[str]:
+    """Serial numbers from a newline or comma separated string (or a list), blanks and repeats dropped"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.replace(",", "\n").split("\n")
+    return list(dict.fromkeys(serial.strip() for serial in value if serial and serial.strip()))
+
+
+def validate_serial_movements(db: Session, rows: List[dict]):
+    """
+    Check the serial numbers of ledger rows before they are posted: one serial
+    per unit of qty, outward serials must be in stock in the row's warehouse
+    and inward serials must not be in stock anywhere. The current location of
+    every serial is read with one query and the rows are walked in order, so
+    both legs of a transfer in the same voucher chain.
+    Raises HTTPException 400 on the first problem.
+    """
+    serials_by_row = [parse_serial_nos(row.get('serial_no')) for row in rows]
+    serials = {serial for serial_nos in serials_by_row for serial in serial_nos}
+    if not serials:
+        return
+
+    # serial -> (item_code, warehouse it is in stock in or None)
+    current: Dict[str, Tuple[str, Optional[str]]] = {}
+    for serial_no, item_code, warehouse, status in db.query(
+        SerialNo.serial_no, SerialNo.item_code, SerialNo.warehouse, SerialNo.status
+    ).filter(SerialNo.serial_no.in_(serials)).all():
+        in_stock = warehouse if status == ACTIVE else None
+        if serial_no not in current or in_stock:
+            current[serial_no] = (item_code, in_stock)
+
+    for row, serial_nos in zip(rows, serials_by_row):
+        if not serial_nos:
+            continue
+        actual_qty = row['actual_qty']
+        if len(serial_nos) != abs(actual_qty):
+            raise HTTPException(
+                status_code=400,
+                detail=f"{len(serial_nos)} serial numbers given for {abs(actual_qty):g} units "
+                       f"of item {row['item_code']} in warehouse {row['warehouse']}"
+            )
+
+        for serial in serial_nos:
+            item_code, warehouse = current.get(serial, (row['item_code'], None))
+            if item_code != row['item_code']:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Serial number {serial} belongs to item {item_code}, not {row['item_code']}"
+                )
+            if actual_qty > 0:
+                if warehouse:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Serial number {serial} is already in stock in warehouse {warehouse}"
+                    )
+                current[serial] = (item_code, row['warehouse'])
+            else:
+                if warehouse != row['warehouse']:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Serial number {serial} is not in stock in warehouse {row['warehouse']}"
+                    )
+                current[serial] = (item_code, None)
+
+
+def _movement_rows(sle_rows: Iterable, sle_ids: Iterable[int]) -> List[dict]:
+    movements = []
+    for row, sle_id in zip(sle_rows, sle_ids):
+        for serial in parse_serial_nos(row['serial_no']):
+            movements.append({
+                'serial_no': serial,
+                'item_code': row['item_code'],
+                'warehouse': row['warehouse'],
+                'actual_qty': 1.0 if row['actual_qty'] > 0 else -1.0,
+                'posting_date': row['posting_date'],
+                'posting_time': row['posting_time'],
+                'voucher_type': row['voucher_type'],
+                'voucher_no': row['voucher_no'],
+                'stock_ledger_entry_id': sle_id
+            })
+    return movements
+
+
+def make_serial_movements(db: Session, rows: List[dict], sle_ids: List[int]) -> int:
+    """
+    Write one movement per serial per posted ledger row with a single bulk
+    insert and bring the serials' current warehouse and status up to date.
+    sle_ids are the ids of the inserted ledger rows, in the same order.
+    Does not commit - the caller commits. Returns the number of movements.
+    """
+    movements = _movement_rows(rows, sle_ids)
+    if movements:
+        db.execute(insert(SerialNoMovement), movements)
+        refresh_serial_status(db, {movement['serial_no'] for movement in movements})
+    return len(movements)
+
+
+def refresh_serial_status(db: Session, serial_nos: Optional[Iterable[str]] = None) -> int:
+    """
+    Set warehouse and status of serials from their latest movement in posting
+    order (all serials with movements when serial_nos is None), so back-dated
+    postings land correctly. Serials without a master get one.
+    Does not commit - the caller commits. Returns the number of serials.
+    """
+    latest = select(
+        SerialNoMovement.serial_no,
+        SerialNoMovement.item_code,
+        SerialNoMovement.warehouse,
+        SerialNoMovement.actual_qty,
+        SerialNoMovement.voucher_type,
+        SerialNoMovement.posting_date,
+        func.row_number().over(
+            partition_by=SerialNoMovement.serial_no,
+            order_by=(
+                SerialNoMovement.posting_date.desc(),
+                SerialNoMovement.posting_time.desc(),
+                SerialNoMovement.id.desc()
+            )
+        ).label('rn')
+    )
+    masters = db.query(SerialNo.id, SerialNo.serial_no)
+    if serial_nos is not None:
+        serial_nos = list(serial_nos)
+        latest = latest.where(SerialNoMovement.serial_no.in_(serial_nos))
+        masters = masters.filter(SerialNo.serial_no.in_(serial_nos))
+    latest = latest.subquery()
+
+    states = {}
+    for row in db.execute(select(latest).where(latest.c.rn == 1)):
+        if row.actual_qty > 0:
+            warehouse, status = row.warehouse, ACTIVE
+        else:
+            warehouse, status = None, SOLD if row.voucher_type in SALES_VOUCHER_TYPES else INACTIVE
+        states[row.serial_no] = (row, warehouse, status)
+
+    updates = []
+    existing = set()
+    for master_id, serial_no in masters.all():
+        existing.add(serial_no)
+        if serial_no in states:
+            _, warehouse, status = states[serial_no]
+            updates.append({'id': master_id, 'warehouse': warehouse, 'status': status})
+    if updates:
+        db.execute(update(SerialNo), updates)
+
+    created = [
+        {
+            'serial_no': serial_no,
+            'item_code': row.item_code,
+            'warehouse': warehouse,
+            'status': status,
+            'purchase_date': row.posting_date if row.actual_qty > 0 else None
+        }
+        for serial_no, (row, warehouse, status) in states.items()
+        if serial_no not in existing
+    ]
+    if created:
+        db.execute(insert(SerialNo), created)
+
+    return len(states)
+
+
+def rebuild_serial_movements(db: Session) -> dict:
+    """
+    Rewrite the serial movement table from the serial numbers stored on the
+    stock ledger and refresh every serial's warehouse and status.
+    Does not commit - the caller commits.
+    """
+    db.query(SerialNoMovement).delete(synchronize_session=False)
+
+    sle_rows = db.query(
+        StockLedgerEntry.id,
+        StockLedgerEntry.item_code,
+        StockLedgerEntry.warehouse,
+        StockLedgerEntry.actual_qty,
+        StockLedgerEntry.posting_date,
+        StockLedgerEntry.posting_time,
+        StockLedgerEntry.voucher_type,
+        StockLedgerEntry.voucher_no,
+        StockLedgerEntry.serial_no
+    ).filter(
+        StockLedgerEntry.serial_no.isnot(None),
+        StockLedgerEntry.serial_no != ""
+    ).all()
+
+    rows = [row._mapping for row in sle_rows]
+    movements = _movement_rows(rows, [row.id for row in sle_rows])
+    if movements:
+        db.execute(insert(SerialNoMovement), movements)
+    serials = refresh_serial_status(db)
+    return {"movements": len(movements), "serials": serials}
+
+
+def validate_serials(
+    db: Session,
+    serial_nos: List[str],
+    warehouse: str,
+    item_code: Optional[str] = None
+) -> dict:
+    """
+    Check that serials are all in stock in a warehouse (and of an item) with
+    one query over the serial masters, however many serials are given.
+    """
+    serial_nos = parse_serial_nos(serial_nos)
+    found = {}
+    for serial_no, serial_item, serial_warehouse, status in db.query(
+        SerialNo.serial_no, SerialNo.item_code, SerialNo.warehouse, SerialNo.status
+    ).filter(SerialNo.serial_no.in_(serial_nos)).all():
+        in_warehouse = status == ACTIVE and serial_warehouse == warehouse
+        if serial_no not in found or in_warehouse:
+            found[serial_no] = (serial_item, in_warehouse)
+
+    missing = [serial for serial in serial_nos if serial not in found]
+    not_in_warehouse = [serial for serial in serial_nos if serial in found and not found[serial][1]]
+    wrong_item = [
+        serial for serial in serial_nos
+        if item_code and serial in found and found[serial][0] != item_code
+    ]
+    return {
+        "valid": not (missing or not_in_warehouse or wrong_item),
+        "checked": len(serial_nos),
+        "missing": missing,
+        "not_in_warehouse": not_in_warehouse,
+        "wrong_item": wrong_item
+    }
+
+
+def get_serial_history(db: Session, serial_no: str) -> List[SerialNoMovement]:
+    """Movements of one serial in posting order, from the serial/posting index"""
+    return db.query(SerialNoMovement).filter(
+        SerialNoMovement.serial_no == serial_no
+    ).order_by(
+        SerialNoMovement.posting_date,
+        SerialNoMovement.posting_time,
+        SerialNoMovement.id
+    ).all()
@@ -0,0 +1,242 @@
+"""
+Stock Ledger Utilities
+Set-based posting of stock ledger entries
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, update
+from typing import List, Optional
+from .models import StockLedgerEntry, Bin
+from .bin_utils import get_bins
+from .valuation_utils import ValuationState, RESET_VOUCHER_TYPES
+from .repost_utils import get_back_dated_points, queue_reposts, POSTING_ORDER
+from .checkpoint_utils import invalidate_checkpoints
+from .serial_utils import validate_serial_movements, make_serial_movements
+from .batch_utils import update_batch_bins
+from .item_utils import get_item_records, DEFAULT_UOM
+
+# Purposes that bring stock into the warehouse; everything else except
+# Material Transfer takes stock out
+INWARD_PURPOSES = ("Material Receipt", "Sales Return")
+
+
+def make_sl_entries(db: Session, sl_map: List[dict]) -> List[dict]:
+    """
+    Post stock ledger entries in bulk
+
+    sl_map format:
+    [
+        {
+            "item_code": "ITEM-001",
+            "warehouse": "Stores",
+            "posting_date": date(2024, 1, 1),
+            "posting_time": "00:00:00",
+            "voucher_type": "Stock Entry",
+            "voucher_no": 1,
+            "voucher_detail_no": None, # Document line the row is posted for, e.g. a sales invoice item
+            "actual_qty": 10.0,      # +ve for IN, -ve for OUT
+            "incoming_rate": 5.0,    # Used for inward rows; outward rows leave at valuation
+            "is_transfer_in": False, # Inward leg of a transfer, valued at the previous row's outgoing rate
+            "qty_after_transaction": None, # Reset vouchers only: counted qty, actual_qty is derived from it
+            "serial_no": None,
+            "batch_no": None,
+        },
+        ...
+    ]
+
+    Previous balances for every (item, warehouse) pair are read with one
+    query, running quantities and valuation (Moving Average or FIFO, per
+    bin) are computed in memory (so the same item repeated in one voucher
+    chains correctly) and all rows are written with a single bulk insert.
+    Rows without a stock_uom take the item's UOM from the item index.
+    Rows posted before existing entries of the same item and warehouse
+    queue a repost of everything from that point on (see repost_utils), and
+    month-end checkpoints and cached gross profit months on or after a row's
+    posting date are dropped.
+    Rows with serial numbers are validated before posting and get one serial
+    movement per serial (see serial_utils); rows with a batch update the
+    batch balances (see batch_utils).
+    Does not commit - the caller commits.
+    """
+    if not sl_map:
+        return []
+
+    bins = get_bins(db, [(sl['item_code'], sl['warehouse']) for sl in sl_map])
+    items = get_item_records(db, (sl['item_code'] for sl in sl_map))
+    states = {}
+    stock_uoms = {}
+
+    rows = []
+    outgoing_rate = 0.0
+    for sl in sl_map:
+        key = (sl['item_code'], sl['warehouse'])
+        if key not in states:
+            states[key] = ValuationState.from_bin(bins[key])
+        state = states[key]
+        item = items[sl['item_code']]
+
+        is_reset = sl.get('voucher_type') in RESET_VOUCHER_TYPES
+        if is_reset and sl.get('qty_after_transaction') is not None:
+            # Counted qty - post the difference from the running balance
+            actual_qty = sl['qty_after_transaction'] - state.qty
+        else:
+            actual_qty = sl['actual_qty']
+        if sl.get('is_transfer_in'):
+            # Transferred stock arrives at the value it left the source with
+            incoming_rate = outgoing_rate
+        elif actual_qty > 0 or is_reset:
+            incoming_rate = sl.get('incoming_rate')
+        else:
+            incoming_rate = None
+        if incoming_rate is None and (actual_qty > 0 or is_reset):
+            incoming_rate = state.rate
+
+        stock_value_difference = state.apply(actual_qty, incoming_rate, is_reset)
+        if actual_qty < 0:
+            outgoing_rate = stock_value_difference / actual_qty
+
+        row = {
+            'item_code': sl['item_code'],
+            'warehouse': sl['warehouse'],
+            'posting_date': sl['posting_date'],
+            'posting_time': sl.get('posting_time', "00:00:00"),
+            'voucher_type': sl.get('voucher_type', 'Stock Entry'),
+            'voucher_no': sl['voucher_no'],
+            'voucher_detail_no': sl.get('voucher_detail_no'),
+            'actual_qty': actual_qty,
+            'qty_after_transaction': state.qty,
+            'stock_uom': sl.get('stock_uom') or (item.uom if item else DEFAULT_UOM),
+            'valuation_rate': state.rate,
+            'stock_value': state.value,
+            'stock_value_difference': stock_value_difference,
+            'incoming_rate': incoming_rate if incoming_rate is not None else 0.0,
+            'stock_queue': state.dump_queue(),
+            'serial_no': sl.get('serial_no'),
+            'batch_no': sl.get('batch_no')
+        }
+        rows.append(row)
+        stock_uoms[key] = row['stock_uom']
+
+    validate_serial_movements(db, rows)
+    update_batch_bins(db, rows)
+
+    # Bins are written with one executemany UPDATE by primary key, which
+    # also refreshes the loaded Bin objects
+    bin_rows = [
+        {
+            'id': bins[key].id,
+            'actual_qty': state.qty,
+            'valuation_rate': state.rate,
+            'stock_value': state.value,
+            'stock_queue': state.dump_queue(),
+            'stock_uom': stock_uoms[key]
+        }
+        for key, state in states.items()
+    ]
+    db.execute(update(Bin), bin_rows)
+
+    back_dated = get_back_dated_points(db, rows)
+    if any(row['serial_no'] for row in rows):
+        # Serial movements point at their ledger rows, insert with RETURNING
+        sle_ids = db.scalars(
+            insert(StockLedgerEntry).returning(StockLedgerEntry.id, sort_by_parameter_order=True),
+            rows
+        ).all()
+        make_serial_movements(db, rows, sle_ids)
+    else:
+        db.execute(insert(StockLedgerEntry), rows)
+    queue_reposts(db, back_dated)
+
+    earliest = {}
+    for row in rows:
+        key = (row['item_code'], row['warehouse'])
+        if key not in earliest or row['posting_date'] < earliest[key]:
+            earliest[key] = row['posting_date']
+    invalidate_checkpoints(db, earliest)
+
+    from modules.selling.gross_profit_utils import invalidate_gross_profit
+    invalidate_gross_profit(db, min(earliest.values()))
+    return rows
+
+
+def verify_stock_ledger(
+    db: Session,
+    item_code: Optional[str] = None,
+    warehouse: Optional[str] = None,
+    tolerance: float = 0.01
+) -> dict:
+    """
+    Verification mode for the incremental valuation engine.
+    Replays the ledger from zero for each (item, warehouse) pair and compares
+    every entry and the final bin state with what was posted incrementally.
+    Rows are streamed pair by pair, so memory is bounded by one pair's state.
+    """
+    query = db.query(StockLedgerEntry)
+    if item_code:
+        query = query.filter(StockLedgerEntry.item_code == item_code)
+    if warehouse:
+        query = query.filter(StockLedgerEntry.warehouse == warehouse)
+    query = query.order_by(
+        StockLedgerEntry.item_code,
+        StockLedgerEntry.warehouse,
+        *POSTING_ORDER
+    ).yield_per(1000)
+
+    bin_query = db.query(Bin)
+    if item_code:
+        bin_query = bin_query.filter(Bin.item_code == item_code)
+    if warehouse:
+        bin_query = bin_query.filter(Bin.warehouse == warehouse)
+    bins = {(b.item_code, b.warehouse): b for b in bin_query.all()}
+
+    mismatches = []
+    checked = 0
+
+    def check_bin(key, state):
+        bin_doc = bins.get(key)
+        if not bin_doc:
+            mismatches.append({"item_code": key[0], "warehouse": key[1], "error": "Bin missing"})
+        elif abs((bin_doc.actual_qty or 0.0) - state.qty) > tolerance or \
+                abs((bin_doc.stock_value or 0.0) - state.value) > tolerance:
+            mismatches.append({
+                "item_code": key[0],
+                "warehouse": key[1],
+                "error": "Bin differs from replay",
+                "bin_qty": bin_doc.actual_qty,
+                "bin_value": bin_doc.stock_value,
+                "replay_qty": state.qty,
+                "replay_value": state.value
+            })
+
+    current_key = None
+    state = None
+    for sle in query:
+        key = (sle.item_code, sle.warehouse)
+        if key != current_key:
+            if current_key is not None:
+                check_bin(current_key, state)
+            bin_doc = bins.get(key)
+            state = ValuationState(bin_doc.valuation_method if bin_doc else None)
+            current_key = key
+
+        is_reset = sle.voucher_type in RESET_VOUCHER_TYPES
+        incoming_rate = sle.incoming_rate if (sle.actual_qty > 0 or is_reset) else None
+        state.apply(sle.actual_qty, incoming_rate, is_reset)
+        checked += 1
+
+        if abs((sle.qty_after_transaction or 0.0) - state.qty) > tolerance or \
+                abs((sle.stock_value or 0.0) - state.value) > tolerance:
+            mismatches.append({
+                "sle_id": sle.id,
+                "item_code": sle.item_code,
+                "warehouse": sle.warehouse,
+                "error": "Entry differs from replay",
+                "qty_after_transaction": sle.qty_after_transaction,
+                "stock_value": sle.stock_value,
+                "replay_qty": state.qty,
+                "replay_value": state.value
+            })
+
+    if current_key is not None:
+        check_bin(current_key, state)
+
+    return {"checked": checked, "mismatches": mismatches, "is_consistent": not mismatches}
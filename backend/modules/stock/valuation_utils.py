@@ -0,0 +1,137 @@
+"""
+Stock Valuation Utilities
+Incremental Moving Average and FIFO valuation for the stock ledger
+"""
+import json
+from collections import deque
+from typing import Optional
+
+MOVING_AVERAGE = "Moving Average"
+FIFO = "FIFO"
+VALUATION_METHODS = (MOVING_AVERAGE, FIFO)
+
+# Voucher types that set the balance to a counted qty and rate instead of moving it
+RESET_VOUCHER_TYPES = ("Stock Reconciliation",)
+
+PRECISION = 1e-9
+
+
+class ValuationState:
+    """Running valuation of one (item, warehouse) pair"""
+
+    __slots__ = ("method", "qty", "value", "rate", "queue")
+
+    def __init__(self, method: str = MOVING_AVERAGE, qty: float = 0.0, value: float = 0.0,
+                 rate: float = 0.0, queue=None):
+        self.method = method or MOVING_AVERAGE
+        self.qty = qty or 0.0
+        self.value = value or 0.0
+        self.rate = rate or 0.0
+        self.queue = deque(queue or [])
+
+    @classmethod
+    def from_balance(cls, method: str, qty: float, value: float, rate: float, stock_queue: Optional[str]):
+        """State from a stored balance - a bin or the ledger entry before a repost point"""
+        queue = load_queue(stock_queue)
+        if not queue and qty:
+            queue = [[qty, rate or 0.0]]
+        return cls(method, qty, value, rate, queue)
+
+    @classmethod
+    def from_bin(cls, bin_doc):
+        return cls.from_balance(bin_doc.valuation_method, bin_doc.actual_qty, bin_doc.stock_value,
+                                bin_doc.valuation_rate, bin_doc.stock_queue)
+
+    def dump_queue(self) -> Optional[str]:
+        """Serialized FIFO queue, None for Moving Average"""
+        if self.method != FIFO:
+            return None
+        return json.dumps([[qty, rate] for qty, rate in self.queue])
+
+    def apply(self, actual_qty: float, incoming_rate: Optional[float] = None, is_reset: bool = False) -> float:
+        """
+        Apply one ledger movement and return the stock value difference.
+        incoming_rate None means "at the current valuation rate".
+        """
+        prev_value = self.value
+
+        if is_reset:
+            self._reset(self.qty + actual_qty, incoming_rate)
+        elif self.method == FIFO:
+            self._apply_fifo(actual_qty, incoming_rate)
+        else:
+            self._apply_moving_average(actual_qty, incoming_rate)
+
+        return self.value - prev_value
+
+    def _reset(self, qty: float, rate: Optional[float]):
+        if rate:
+            self.rate = rate
+        self.qty = qty
+        self.value = qty * self.rate
+        self.queue = deque([[qty, self.rate]] if abs(qty) > PRECISION else [])
+
+    def _apply_moving_average(self, actual_qty: float, incoming_rate: Optional[float]):
+        new_qty = self.qty + actual_qty
+
+        if actual_qty > 0:
+            in_rate = self.rate if incoming_rate is None else incoming_rate
+            if self.qty < 0 or new_qty <= 0:
+                # Negative stock involved, restart the average at the incoming rate
+                self.rate = in_rate
+                self.value = new_qty * in_rate
+            else:
+                self.value += actual_qty * in_rate
+                self.rate = self.value / new_qty
+        else:
+            # Outgoing stock leaves at the current average
+            self.value = new_qty * self.rate
+
+        self.qty = new_qty
+
+    def _apply_fifo(self, actual_qty: float, incoming_rate: Optional[float]):
+        queue = self.queue
+
+        if actual_qty > 0:
+            in_rate = self.rate if incoming_rate is None else incoming_rate
+            if queue and queue[0][0] < 0:
+                # Fill the negative bucket first
+                qty = queue[0][0] + actual_qty
+                queue.clear()
+                if abs(qty) > PRECISION:
+                    queue.append([qty, in_rate])
+            elif queue and queue[-1][1] == in_rate:
+                queue[-1][0] += actual_qty
+            else:
+                queue.append([actual_qty, in_rate])
+            last_rate = in_rate
+        else:
+            to_consume = -actual_qty
+            last_rate = self.rate
+            while to_consume > PRECISION and queue and queue[0][0] > 0:
+                bucket = queue[0]
+                last_rate = bucket[1]
+                if bucket[0] - to_consume > PRECISION:
+                    bucket[0] -= to_consume
+                    to_consume = 0.0
+                else:
+                    to_consume -= bucket[0]
+                    queue.popleft()
+
+            if to_consume > PRECISION:
+                # Not enough stock, carry a negative bucket at the last rate
+                if queue and queue[0][0] <= 0:
+                    queue[0][0] -= to_consume
+                else:
+                    queue.appendleft([-to_consume, last_rate])
+
+        self.qty = sum(qty for qty, _ in queue)
+        self.value = sum(qty * rate for qty, rate in queue)
+        self.rate = self.value / self.qty if abs(self.qty) > PRECISION else last_rate
+
+
+def load_queue(raw: Optional[str]) -> list:
+    """Deserialize a stored FIFO queue"""
+    if not raw:
+        return []
+    return json.loads(raw)
@@ -21,3 +21,11 @@ class Warehouse(Base):
     
     # Relationships
     parent_warehouse = relationship("Warehouse", remote_side=[id], backref="child_warehouses")
+
+class WarehouseTree(Base):
+    """Closure table of the warehouse hierarchy - one row per (ancestor, descendant), including each warehouse with itself at depth 0"""
+    __tablename__ = "warehouse_tree"
+
+    ancestor_id = Column(Integer, ForeignKey("warehouses.id"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("warehouses.id"), primary_key=True, index=True)
+    depth = Column(Integer, default=0)
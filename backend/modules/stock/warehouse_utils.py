@@ -0,0 +1,96 @@
+"""
+Warehouse Tree Utilities
+Closure table maintenance and subtree stock rollups for the warehouse hierarchy
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import func, case, insert, select, literal
+from typing import Dict, List
+from .models import Bin
+from .warehouse_models import Warehouse, WarehouseTree
+
+
+def add_to_warehouse_tree(db: Session, warehouse: Warehouse):
+    """
+    Link a new warehouse into the closure table: itself at depth 0 plus every
+    ancestor of its parent one level deeper. Does not commit.
+    """
+    db.execute(insert(WarehouseTree).values(ancestor_id=warehouse.id, descendant_id=warehouse.id, depth=0))
+    if warehouse.parent_warehouse_id:
+        db.execute(
+            insert(WarehouseTree).from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(
+                    WarehouseTree.ancestor_id,
+                    literal(warehouse.id),
+                    WarehouseTree.depth + 1
+                ).where(WarehouseTree.descendant_id == warehouse.parent_warehouse_id)
+            )
+        )
+
+
+def rebuild_warehouse_tree(db: Session) -> int:
+    """
+    Regenerate the closure table from parent_warehouse_id.
+    Walks the tree level by level in memory and writes all rows with one bulk insert.
+    Returns the number of rows written.
+    """
+    parents = dict(db.query(Warehouse.id, Warehouse.parent_warehouse_id).all())
+
+    rows = []
+    for warehouse_id in parents:
+        ancestor_id, depth, seen = warehouse_id, 0, set()
+        # Stop on missing parents and cycles instead of looping forever
+        while ancestor_id is not None and ancestor_id in parents and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append({'ancestor_id': ancestor_id, 'descendant_id': warehouse_id, 'depth': depth})
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+
+    db.query(WarehouseTree).delete(synchronize_session=False)
+    if rows:
+        db.execute(insert(WarehouseTree), rows)
+    db.commit()
+    return len(rows)
+
+
+def ensure_warehouse_tree(db: Session):
+    """
+    Rebuild the closure table if warehouses were created without it
+    (seed scripts, direct inserts). One count query when it is up to date.
+    """
+    missing = db.query(func.count(Warehouse.id)).filter(
+        ~Warehouse.id.in_(select(WarehouseTree.descendant_id).where(WarehouseTree.depth == 0))
+    ).scalar()
+    if missing:
+        rebuild_warehouse_tree(db)
+
+
+def get_subtree_balances(db: Session) -> Dict[int, dict]:
+    """
+    Stock value and item count of every warehouse including all its
+    descendants, from one aggregate query joining the closure table to bins.
+    Returns {warehouse_id: {"stock_value": float, "item_count": int}}
+    """
+    descendant = Warehouse.__table__.alias("descendant")
+    rows = db.query(
+        WarehouseTree.ancestor_id,
+        func.sum(Bin.stock_value).label('stock_value'),
+        func.count(func.distinct(case((Bin.actual_qty > 0, Bin.item_code)))).label('item_count')
+    ).join(
+        descendant, descendant.c.id == WarehouseTree.descendant_id
+    ).join(
+        Bin, Bin.warehouse == descendant.c.warehouse_name
+    ).group_by(WarehouseTree.ancestor_id).all()
+
+    return {
+        row.ancestor_id: {"stock_value": float(row.stock_value or 0.0), "item_count": int(row.item_count or 0)}
+        for row in rows
+    }
+
+
+def get_subtree_warehouse_names(db: Session, warehouse_id: int) -> List[str]:
+    """Names of a warehouse and all its descendants"""
+    return [
+        name for (name,) in db.query(Warehouse.warehouse_name).join(
+            WarehouseTree, WarehouseTree.descendant_id == Warehouse.id
+        ).filter(WarehouseTree.ancestor_id == warehouse_id).all()
+    ]
@@ -0,0 +1,45 @@
+"""
+Account balance summary rebuild
+
+Regenerates the daily account balance summary (account_balance_summaries)
+from the non-cancelled GL entries - the backfill for a database whose GL
+predates the summary, and the repair when the check finds differences.
+With --check nothing is written; differences are reported and the exit
+status is 1 when there are any.
+
+Usage: python rebuild_account_balances.py [--company-id ID] [--check]
+"""
+import argparse
+import sys
+from database import SessionLocal, engine
+from modules.accounts.models import AccountBalanceSummary
+from modules.accounts.balance_utils import rebuild_account_balances, check_account_balances
+
+
+def main(company_id=None, check=False) -> int:
+    AccountBalanceSummary.__table__.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        if check:
+            result = check_account_balances(db, company_id)
+            print(f"checked {result['checked']} summary keys, {result['mismatched']} differ")
+            for mismatch in result['mismatches']:
+                print(mismatch)
+            return 1 if result['mismatched'] else 0
+
+        count = rebuild_account_balances(db, company_id)
+        db.commit()
+        print(f"account balance summary rebuilt: {count} rows")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild or check the daily account balance summary")
+    parser.add_argument("--company-id", type=int, default=None, help="Only this company")
+    parser.add_argument("--check", action="store_true", help="Compare with the GL without writing")
+    args = parser.parse_args()
+
+    sys.exit(main(args.company_id, args.check))
@@ -0,0 +1,19 @@
+from database import SessionLocal, engine
+from modules.stock.models import Bin
+from modules.stock.bin_utils import rebuild_bins
+
+def rebuild():
+    Bin.__table__.create(bind=engine, checkfirst=True)
+    db = SessionLocal()
+    try:
+        print("Rebuilding stock bins from the stock ledger...")
+        count = rebuild_bins(db)
+        print(f"Rebuilt {count} bins.")
+    except Exception as e:
+        print(f"Error: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild()
@@ -10,6 +10,8 @@ class ItemBase(BaseModel):
     is_stock_item: bool = True
     has_serial_no: bool = False
     has_batch_no: bool = False
+    default_supplier_id: Optional[int] = None
+    item_group_id: Optional[int] = None
 
 class ItemCreate(ItemBase):
     pass